@@ -3,9 +3,11 @@ import time
 import sys
 import cv2
 import threading
-import re
 from pypylon import pylon
-from collections import deque  # 追加: フレームバッファ用
+
+from module_video_writer import VideoWriterWorker
+from module_cameras_ver3 import DelayLine  # タイムスタンプ基準・メモリ上限付きの表示遅延
+from module_camera_source import apply_pfs
 
 
 # ==========================================================
@@ -52,50 +54,12 @@ def load_pfs_custom(camera, pfs_path):
     """
     {Selector=Value} 形式を含むPFSファイルを解析し、
     セレクタを切り替えてから値を設定するロジック
+    （解析結果はキャッシュされ、現在値と異なるノードだけ書き込む）
     """
     if not os.path.exists(pfs_path):
         return False
-        
-    nodemap = camera.GetNodeMap()
-    
-    # 正規表現: FeatureName {SelectorName=SelectorValue} Value
-    pattern_with_selector = re.compile(r'^(\w+)\s+\{(\w+)=(\w+)\}\s+(.+)$')
-    # 正規表現: FeatureName Value
-    pattern_simple = re.compile(r'^(\w+)\s+(.+)$')
-
-    with open(pfs_path, 'r', encoding='utf-8') as f:
-        for line in f:
-            line = line.strip()
-            if not line or line.startswith('#') or line.startswith('['):
-                continue
-            
-            try:
-                # 1. セレクタ付き形式のチェック
-                match_sel = pattern_with_selector.match(line)
-                if match_sel:
-                    feature, selector_name, selector_val, value = match_sel.groups()
-                    
-                    # セレクタ（GainSelector, BalanceRatioSelector等）を先に設定
-                    sel_node = nodemap.GetNode(selector_name)
-                    if sel_node:
-                        sel_node.FromString(selector_val)
-                    
-                    # その後に値を設定
-                    feat_node = nodemap.GetNode(feature)
-                    if feat_node:
-                        feat_node.FromString(value)
-                    continue
-
-                # 2. 通常形式のチェック
-                match_simple = pattern_simple.match(line)
-                if match_simple:
-                    feature, value = match_simple.groups()
-                    feat_node = nodemap.GetNode(feature)
-                    if feat_node and pylon.IsWritable(feat_node):
-                        feat_node.FromString(value)
-
-            except Exception:
-                continue # 読み取り専用ノードなどはスキップ
+
+    apply_pfs(camera.GetNodeMap(), pfs_path)
     return True
 
 # ==========================================================
@@ -118,7 +82,7 @@ class CameraController:
         
         # 表示同期用の設定
         self.delay_seconds = 0.0  # 遅延秒数
-        self.frame_queue = deque()
+        self.delay_line = None
 
         # Pylon Viewerと同じ色再現を行うためのコンバーター
         self.converter = pylon.ImageFormatConverter()
@@ -154,10 +118,12 @@ class CameraController:
         
         folder_name = os.path.basename(self.save_path)
         timestamp = time.strftime("%Y%m%d_%H%M%S")
-        fourcc = cv2.VideoWriter_fourcc(*VIDEO_CODEC)
         self.video_filename = os.path.join(self.save_path, f"{folder_name}_{timestamp}{VIDEO_EXIT}")
         
-        self.video_writer = cv2.VideoWriter(self.video_filename, fourcc, FPS, (self.width, self.height))
+        # エンコードは専用スレッドで行う（取得ループは受け渡しのみ）
+        self.video_writer = VideoWriterWorker(self.video_filename, VIDEO_CODEC, FPS, (self.width, self.height), name=self.name)
+        if not self.video_writer.start():
+            self.video_writer = None
         
         self.is_recording = True
         self.camera.StartGrabbing(pylon.GrabStrategy_LatestImageOnly)
@@ -175,23 +141,20 @@ class CameraController:
                     frame_bgr = converted.GetArray()
 
                     if self.video_writer:
-                        self.video_writer.write(frame_bgr)
+                        self.video_writer.submit(frame_bgr)
 
-                    # --- 秒数からフレーム数を計算して遅延実行 ---
+                    # --- グラブタイムスタンプ基準で遅延実行（縮小して保持するためメモリ上限あり） ---
                     with self.lock:
-                        delay_frames = int(self.delay_seconds * FPS)
-                        
-                        if delay_frames > 0:
-                            self.frame_queue.append(frame_bgr.copy())
-                            if len(self.frame_queue) > delay_frames:
-                                self.latest_frame = self.frame_queue.popleft()
-                            else:
-                                self.latest_frame = None
+                        if self.delay_seconds > 0:
+                            if self.delay_line is None or self.delay_line.delay_seconds != self.delay_seconds:
+                                self.delay_line = DelayLine(self.delay_seconds)
+                            timestamp = grab_result.TimeStamp
+                            self.delay_line.push(frame_bgr, timestamp)
+                            delayed = self.delay_line.get(timestamp)
+                            self.latest_frame = None if delayed is None else delayed.copy()
                         else:
                             self.latest_frame = frame_bgr.copy()
-                            self.frame_queue.clear() # 遅延0ならキューを空にする
-
-                    self.video_writer.write(frame_bgr)
+                            self.delay_line = None # 遅延0ならバッファを解放する
                 
                 grab_result.Release()
             except Exception as e:
@@ -205,7 +168,10 @@ class CameraController:
         if self.camera and self.camera.IsGrabbing():
             self.camera.StopGrabbing()
         if self.video_writer:
-            self.video_writer.release()
+            self.video_writer.stop()
+            stats = self.video_writer.get_stats()
+            print(f"録画停止: {self.name} (書き込み {stats['written']} / 破棄 {stats['dropped']})")
+            self.video_writer = None
 
     def get_current_frame(self):
         with self.lock:
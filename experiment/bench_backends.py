@@ -0,0 +1,72 @@
+import os
+import sys
+import glob
+import cv2
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from module_yolo_csv import ImageProcessor, compare_backends, BACKEND_CHOICES, MODEL_PATH, YOLO_IMG_SIZE
+
+# ==========================================================
+# 定数定義
+# ==========================================================
+SOURCE = sys.argv[1] if len(sys.argv) > 1 else "cam_video"     # 動画ファイル / 画像フォルダ / 録画フォルダ
+MAX_CROPS = 100                 # 計測に使うクロップ数
+FRAME_STEP = 5                  # 動画から何フレームおきに取り出すか
+TARGET_MS = 10.0                # 1クロップあたりの目標遅延
+
+# ==========================================================
+# 計測用のクロップを集める補助関数
+# ==========================================================
+def to_crop(frame):
+    """YoloDetector と同じ手順（ターゲット抽出 → クロップ → リサイズ）で推論入力を作る"""
+    target = ImageProcessor.get_target_info(frame)
+    if target is None:
+        return None
+    crop = ImageProcessor.dynamic_crop(frame, target)
+    return cv2.resize(crop, (YOLO_IMG_SIZE, YOLO_IMG_SIZE), interpolation=cv2.INTER_AREA)
+
+def collect_crops(source):
+    if os.path.isdir(source):
+        paths = sorted(glob.glob(os.path.join(source, "*.png")) + glob.glob(os.path.join(source, "*.jpg")))
+        videos = sorted(glob.glob(os.path.join(source, "*.avi")) + glob.glob(os.path.join(source, "*.mp4")))
+    else:
+        paths, videos = [], [source]
+
+    crops = []
+    for path in paths:
+        frame = cv2.imread(path)
+        crop = to_crop(frame) if frame is not None else None
+        if crop is not None:
+            crops.append(crop)
+        if len(crops) >= MAX_CROPS:
+            return crops
+
+    for path in videos:
+        cap = cv2.VideoCapture(path)
+        index = 0
+        while len(crops) < MAX_CROPS:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            if index % FRAME_STEP == 0:
+                crop = to_crop(frame)
+                if crop is not None:
+                    crops.append(crop)
+            index += 1
+        cap.release()
+    return crops
+
+# ==========================================================
+# メイン処理
+# ==========================================================
+if __name__ == "__main__":
+    crops = collect_crops(SOURCE)
+    if not crops:
+        print(f"エラー: {SOURCE} からサクランボのクロップを取得できませんでした")
+        sys.exit(1)
+    print(f"モデル: {MODEL_PATH}  クロップ数: {len(crops)}  imgsz: {YOLO_IMG_SIZE}")
+
+    report = compare_backends(crops, MODEL_PATH, BACKEND_CHOICES)
+    for backend, r in report.items():
+        verdict = "OK" if r["p95_ms"] < TARGET_MS else "目標未達"
+        print(f"{backend:8s}: p95 {r['p95_ms']:.2f} ms ({verdict}, 目標 {TARGET_MS:.0f} ms)")
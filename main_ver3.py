@@ -21,6 +21,7 @@ import module_cameras_ver3 as cam_ctr
 
 RPI_IP_ADDRESS = "192.168.2.2"
 RPI_PORT = 5000
+USE_REPLAY = "--replay" in sys.argv    # 実機カメラの代わりに cam_video/ の録画を再生する
 
 # ==========================================================
 # 汎用バックグラウンドタスク用クラス
@@ -120,7 +121,11 @@ class MainWindow(module_gui.MainWindowUI):
             print("リレーボードの接続に失敗しました")
             self.close()
         self.cameras = cam_ctr.CameraManager()
-        if not self.cameras.init_cameras():
+        if USE_REPLAY:
+            cameras_ready = self.cameras.init_replay_cameras(loop=True)
+        else:
+            cameras_ready = self.cameras.init_cameras()
+        if not cameras_ready:
             print("カメラの接続に失敗しました")
             self.close()
 
@@ -132,7 +137,7 @@ class MainWindow(module_gui.MainWindowUI):
             if controller.name in ["cam_under", "cam_inside"]:
                 controller.delay_seconds = DELAY_TIME_SEC
                 print(f"  [Sync] {controller.name} に {DELAY_TIME_SEC} 秒の表示遅延を設定しました")
-        self.cameras.start_all_get_frame() # 起動と同時にキャプチャ開始
+        self.cameras.start_all_get_frame(record=not USE_REPLAY) # 起動と同時にキャプチャ開始（再生時は録画しない）
 
         # イベント接続
         self.toggle_switch.toggled.connect(self.on_main_toggled)
@@ -0,0 +1,465 @@
+# -------------------------------------------------
+# カメラの画像取得元（実機 / 録画ファイル再生）を切り替えるプログラムmodule
+# -------------------------------------------------
+import os
+import re
+import glob
+import time
+import threading
+import contextlib
+
+import cv2
+
+try:
+    from pypylon import pylon
+except ImportError:     # 実機のない環境（リプレイのみ）では pypylon なしでも動かせるようにする
+    pylon = None
+
+# ==========================================================
+# 定数定義
+# ==========================================================
+GRAB_TIMEOUT_MS = 5000          # 画像取得の待機時間（ミリ秒）
+
+# カメラ設定ファイル（PFS）
+PFS_FOLDER = "cam_pfs"          # カメラ名.pfs を置くフォルダ
+
+# センサー側AOI・ビニング設定
+BINNING_CHOICES = (1, 2, 3, 4)  # 試すビニング係数（カメラが対応しない値は自動的に除外）
+PIXEL_BYTES = {"Mono8": 1, "RGB8": 3, "BGR8": 3, "BayerRG8": 1, "BayerBG8": 1, "BayerGR8": 1, "BayerGB8": 1}
+FRAME_RATE_NODES = ("ResultingFrameRate", "ResultingFrameRateAbs")  # 実際のフレームレートのノード名（USB3 / GigE）
+FRAME_RATE_FALLBACK = 20.0      # どちらのノードも読めない場合の値
+
+# リプレイ設定
+REPLAY_SPEED_REALTIME = 1.0     # 録画時と同じ速度で再生
+REPLAY_SPEED_MAX = 0.0          # 待機なし（可能な限り速く）で再生
+REPLAY_VIDEO_EXTS = (".avi", ".mp4")
+REPLAY_DEFAULT_FPS = 20.0       # 動画ファイルからFPSが取れない場合の値
+
+# ==========================================================
+# 取得結果クラス（pylonのGrabResultに相当）
+# ==========================================================
+class GrabbedFrame:
+    """
+    >>> 1回の取得結果
+    - succeeded: 取得成功か
+    - timestamp: グラブタイムスタンプ（ns）、frame_id: フレームID
+    - error_code / error_description: 失敗時の内容
+    - array(): 取得画像を参照するコンテキストマネージャ（release() まで有効）
+    """
+    def __init__(self, succeeded, timestamp=0, frame_id=-1, error_code=0, error_description="",
+                 array_context=None, release=None):
+        self.succeeded = succeeded
+        self.timestamp = timestamp
+        self.frame_id = frame_id
+        self.error_code = error_code
+        self.error_description = error_description
+        self._array_context = array_context
+        self._release = release
+
+    def array(self):
+        return self._array_context()
+
+    def release(self):
+        if self._release is not None:
+            self._release()
+            self._release = None
+
+# ==========================================================
+# PFSファイルを解析済みの設定手順（フィーチャープラン）に変換する関数
+# ==========================================================
+_PFS_PATTERN_WITH_SELECTOR = re.compile(r'^(\w+)\s+\{(\w+)=(\w+)\}\s+(.+)$')   # FeatureName {SelectorName=SelectorValue} Value
+_PFS_PATTERN_SIMPLE = re.compile(r'^(\w+)\s+(.+)$')                              # FeatureName Value
+_pfs_plan_cache = {}            # {pfs_path: (mtime, plan)}
+_pfs_plan_lock = threading.Lock()
+
+def compile_pfs(pfs_path):
+    """
+    PFSファイルを [(selector_name, selector_value, feature, value), ...] の手順に変換する（セレクタなしは None）
+    - 同じ (セレクタ, フィーチャー) の重複は最後の値だけ残す（記述順は最初の出現位置）
+    - pylonが書き出す「セレクタを元に戻すだけの行」（GainSelector All 等の繰り返し）は末尾に1回だけ残す
+    - 結果はファイルの更新時刻ごとにキャッシュする
+    """
+    mtime = os.path.getmtime(pfs_path)
+    with _pfs_plan_lock:
+        cached = _pfs_plan_cache.get(pfs_path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+    entries = {}                # {(selector_name, selector_value, feature): value}
+    selector_restore = {}       # {selector_name: value}
+    with open(pfs_path, 'r', encoding='utf-8') as f:
+        lines = [line.strip() for line in f]
+
+    selector_names = set()
+    for line in lines:
+        match_sel = _PFS_PATTERN_WITH_SELECTOR.match(line)
+        if match_sel:
+            selector_names.add(match_sel.group(2))
+
+    for line in lines:
+        if not line or line.startswith('#') or line.startswith('['):
+            continue
+        match_sel = _PFS_PATTERN_WITH_SELECTOR.match(line)
+        if match_sel:
+            feature, selector_name, selector_val, value = match_sel.groups()
+            entries[(selector_name, selector_val, feature)] = value
+            continue
+        match_simple = _PFS_PATTERN_SIMPLE.match(line)
+        if match_simple:
+            feature, value = match_simple.groups()
+            if feature in selector_names:
+                selector_restore.pop(feature, None)     # 最後の出現位置に移す
+                selector_restore[feature] = value
+            else:
+                entries[(None, None, feature)] = value
+
+    plan = [(sel_name, sel_val, feature, value) for (sel_name, sel_val, feature), value in entries.items()]
+    plan += [(None, None, selector_name, value) for selector_name, value in selector_restore.items()]
+
+    with _pfs_plan_lock:
+        _pfs_plan_cache[pfs_path] = (mtime, plan)
+    return plan
+
+# ==========================================================
+# フィーチャープランをカメラに適用する関数（現在値と異なるノードだけ書き込む）
+# ==========================================================
+def apply_pfs(nodemap, pfs_path):
+    """
+    戻り値: {"written": 書き込み数, "skipped": 既に同じ値だった数, "failed": 書き込めなかった数}
+    """
+    counts = {"written": 0, "skipped": 0, "failed": 0}
+    current_selectors = {}      # このプラン適用中に設定したセレクタ値
+
+    for selector_name, selector_val, feature, value in compile_pfs(pfs_path):
+        try:
+            if selector_name is not None and current_selectors.get(selector_name) != selector_val:
+                sel_node = nodemap.GetNode(selector_name)
+                if sel_node is None:
+                    counts["failed"] += 1
+                    continue
+                if sel_node.ToString() != selector_val:
+                    sel_node.FromString(selector_val)
+                current_selectors[selector_name] = selector_val
+
+            feat_node = nodemap.GetNode(feature)
+            if feat_node is None or not pylon.IsWritable(feat_node):
+                counts["failed"] += 1
+                continue
+            if feat_node.ToString() == value:
+                counts["skipped"] += 1
+                continue
+            feat_node.FromString(value)
+            counts["written"] += 1
+            if feature in current_selectors:
+                current_selectors[feature] = value
+        except Exception:
+            counts["failed"] += 1   # 読み取り専用ノードなどはスキップ
+    return counts
+
+# ==========================================================
+# 検出器の必要解像度からセンサー側のAOI・ビニングを決める関数
+# ==========================================================
+def _align_down(value, increment):
+    return max(increment, value - value % increment)
+
+def plan_sensor_capture(roi, target_size, min_crop_px=None, max_binning=4,
+                        width_inc=4, height_inc=2, offset_inc=2):
+    """
+    roi: 検出に必要なセンサー上の領域 (x, y, w, h)（ビニングなしの画素単位）
+    target_size: 推論入力の一辺（YOLO_IMG_SIZE）
+    min_crop_px: 推論に渡すクロップの最小の一辺（センサー画素）。None なら ROI 全体を縮小して渡す前提
+    → 縮小後も target_size 以上の画素が残る最大のビニング係数を選ぶ
+    戻り値: {"binning", "width", "height", "offset_x", "offset_y"}（ビニング後の画素単位）
+    """
+    x, y, w, h = roi
+    limit_px = min(w, h) if min_crop_px is None else min(min_crop_px, w, h)
+    binning = 1
+    for b in BINNING_CHOICES:
+        if b <= max_binning and limit_px / b >= target_size:
+            binning = b
+    return {
+        "binning": binning,
+        "width": _align_down(w // binning, width_inc),
+        "height": _align_down(h // binning, height_inc),
+        "offset_x": (x // binning) - (x // binning) % offset_inc,
+        "offset_y": (y // binning) - (y // binning) % offset_inc,
+    }
+
+# ==========================================================
+# AOI・ビニング変更による転送量・処理量の削減見積もりを返す関数
+# ==========================================================
+def capture_savings_report(before_size, after_size, pixel_format, fps, target_size):
+    """before_size / after_size: (幅, 高さ)。USB転送量 [MB/s] と推論前リサイズの入力画素数を比較する"""
+    bpp = PIXEL_BYTES.get(pixel_format, 3)
+    before_px = before_size[0] * before_size[1]
+    after_px = after_size[0] * after_size[1]
+    return {
+        "before_size": before_size,
+        "after_size": after_size,
+        "usb_before_mbps": before_px * bpp * fps / 1e6,
+        "usb_after_mbps": after_px * bpp * fps / 1e6,
+        "usb_saved_ratio": 1.0 - after_px / before_px,
+        # 推論前の縮小処理は入力画素数にほぼ比例する（出力 target_size^2 は共通）
+        "resize_input_px_before": before_px,
+        "resize_input_px_after": after_px,
+        "resize_saved_ratio": 1.0 - after_px / before_px,
+        "target_size": target_size,
+    }
+
+# ==========================================================
+# Basler実機から取得するクラス
+# ==========================================================
+class PylonSource:
+    def __init__(self, device_info, pfs_path=None, capture_target=None, pixel_format=None):
+        self.device_info = device_info
+        self.serial = device_info.GetSerialNumber()
+        self.pfs_path = pfs_path    # カメラ設定ファイル（無ければ自動露出等の既定設定）
+        self.capture_target = capture_target    # (target_size, min_crop_px)。指定時はAOI・ビニングを推論解像度に合わせる
+        self.capture_report = None
+        self.requested_pixel_format = pixel_format  # 指定時は PFS より優先（Bayer転送など）
+        self.pixel_format = None                    # 実際の画素フォーマット（open後に確定）
+        self.camera = None
+
+    # --- Pypylonによりカメラを初期化しオープンする関数 -------------------
+    def open(self):
+        """Pypylonでカメラインスタンスを生成・オープン"""
+        self.camera = pylon.InstantCamera(pylon.TlFactory.GetInstance().CreateDevice(self.device_info))
+        self.camera.Open()
+
+        # 設定ファイルがあれば、現在値と異なるノードだけ書き込む
+        if self.pfs_path and os.path.exists(self.pfs_path):
+            counts = apply_pfs(self.camera.GetNodeMap(), self.pfs_path)
+            print(f"  [Load PFS] {os.path.basename(self.pfs_path)}: 書き込み {counts['written']} / 変更なし {counts['skipped']} / 失敗 {counts['failed']}")
+            self._apply_pixel_format()
+            self._apply_capture_target()
+            return
+
+        # --- ここから追加 ---
+        # 1. 露出（明るさ）を自動にする
+        try:
+            self.camera.ExposureAuto.SetValue('Continuous')
+        except:
+            pass # 対応していないカメラ等の場合無視
+
+        # 2. ゲイン（感度）を自動にする
+        try:
+            self.camera.GainAuto.SetValue('Continuous')
+        except:
+            pass
+
+        # 3. ホワイトバランス（色味）を自動にする (カラーカメラの場合のみ)
+        try:
+            self.camera.BalanceWhiteAuto.SetValue('Continuous')
+        except:
+            pass
+        # --- ここまで ---
+        self._apply_pixel_format()
+        self._apply_capture_target()
+
+    # --- 転送画素フォーマットを設定する内部関数 -------------------
+    def _apply_pixel_format(self):
+        if self.requested_pixel_format and self.camera.PixelFormat.Value != self.requested_pixel_format:
+            self.camera.PixelFormat.Value = self.requested_pixel_format
+        self.pixel_format = self.camera.PixelFormat.Value
+
+    # --- 推論解像度に合わせてセンサー側で縮小する内部関数 -------------------
+    def _apply_capture_target(self):
+        if self.capture_target is None:
+            return
+        target_size, min_crop_px = self.capture_target
+        cam = self.camera
+
+        # 現在のAOI（ビニングなしの画素単位）を検出に必要な領域とみなす
+        try:
+            bin_h, bin_v = cam.BinningHorizontal.Value, cam.BinningVertical.Value
+            max_binning = min(cam.BinningHorizontal.Max, cam.BinningVertical.Max)
+        except Exception:   # ビニング非対応のカメラ
+            bin_h = bin_v = max_binning = 1
+        before = (cam.Width.Value, cam.Height.Value)
+        roi = (cam.OffsetX.Value * bin_h, cam.OffsetY.Value * bin_v, before[0] * bin_h, before[1] * bin_v)
+        plan = plan_sensor_capture(roi, target_size, min_crop_px, max_binning,
+                                   cam.Width.Inc, cam.Height.Inc, max(cam.OffsetX.Inc, cam.OffsetY.Inc))
+
+        # オフセット → ビニング → サイズ → オフセット の順で設定（範囲外エラー防止）
+        cam.OffsetX.Value = 0
+        cam.OffsetY.Value = 0
+        if max_binning > 1:
+            cam.BinningHorizontal.Value = plan["binning"]
+            cam.BinningVertical.Value = plan["binning"]
+        cam.Width.Value = plan["width"]
+        cam.Height.Value = plan["height"]
+        cam.OffsetX.Value = plan["offset_x"]
+        cam.OffsetY.Value = plan["offset_y"]
+
+        fps = self.get_frame_rate()
+        self.capture_report = capture_savings_report(before, (plan["width"], plan["height"]),
+                                                     cam.PixelFormat.Value, fps, target_size)
+        r = self.capture_report
+        print(f"  [AOI] {self.serial}: {before[0]}x{before[1]} -> {plan['width']}x{plan['height']} (binning {plan['binning']}), "
+              f"USB {r['usb_before_mbps']:.1f} -> {r['usb_after_mbps']:.1f} MB/s, リサイズ入力 {r['resize_saved_ratio'] * 100:.0f}% 削減")
+
+    # --- 取得画像のサイズ (幅, 高さ) を返す関数 -------------------
+    def get_frame_size(self):
+        if not self.is_open():
+            return None
+        return (self.camera.Width.Value, self.camera.Height.Value)
+
+    # --- 現在の設定での実際のフレームレートを返す関数 -------------------
+    def get_frame_rate(self):
+        """USB3 は ResultingFrameRate、GigE は ResultingFrameRateAbs。どちらも読めなければ警告して FRAME_RATE_FALLBACK"""
+        for node in FRAME_RATE_NODES:
+            try:
+                return getattr(self.camera, node).Value
+            except Exception:
+                continue
+        print(f"警告: {self.serial}: フレームレートを取得できないため {FRAME_RATE_FALLBACK} fps とみなします")
+        return FRAME_RATE_FALLBACK
+
+    def is_open(self):
+        return self.camera is not None and self.camera.IsOpen()
+
+    # --- 画像取得開始 (GrabStrategy_LatestImageOnly: バッファ詰まり防止) -------------------
+    def start(self):
+        self.camera.StartGrabbing(pylon.GrabStrategy_LatestImageOnly)
+
+    def is_grabbing(self):
+        return self.camera is not None and self.camera.IsGrabbing()
+
+    # --- 1フレーム取得する関数 -------------------
+    def retrieve(self, timeout_ms=GRAB_TIMEOUT_MS):
+        grab_result = self.camera.RetrieveResult(timeout_ms, pylon.TimeoutHandling_ThrowException)
+        if grab_result.GrabSucceeded():
+            return GrabbedFrame(True, grab_result.TimeStamp, grab_result.BlockID,
+                                array_context=grab_result.GetArrayZeroCopy,
+                                release=grab_result.Release)
+        return GrabbedFrame(False, error_code=grab_result.ErrorCode,
+                            error_description=grab_result.ErrorDescription,
+                            release=grab_result.Release)
+
+    def stop(self):
+        if self.is_grabbing():
+            self.camera.StopGrabbing()
+
+    def close(self):
+        self.stop()
+        if self.is_open():
+            self.camera.Close()
+
+# ==========================================================
+# 録画ファイルを再生して取得元とするクラス（実機なしでのベンチマーク用）
+# ==========================================================
+class ReplaySource:
+    """
+    >>> cam_video/ 以下の録画ファイルを実機カメラの代わりに流す
+    - speed: 1.0 で実時間、2.0 で2倍速、REPLAY_SPEED_MAX(0) で待機なし
+    - タイムスタンプは録画FPSから合成する（再生速度に関係なく録画時の時間軸）
+    - loop=True でファイル末尾に達したら先頭から繰り返す
+    """
+    def __init__(self, video_paths, speed=REPLAY_SPEED_REALTIME, loop=False):
+        if isinstance(video_paths, str):
+            video_paths = [video_paths]
+        self.video_paths = list(video_paths)
+        self.serial = os.path.basename(self.video_paths[0]) if self.video_paths else "replay"
+        self.speed = speed
+        self.loop = loop
+
+        self.capture = None
+        self.file_index = 0
+        self.fps = REPLAY_DEFAULT_FPS
+        self.frame_index = 0        # 全ファイル通しのフレーム番号
+        self.buffer = None          # 読み込み用の再利用バッファ
+        self.grabbing = False
+        self.start_time = 0.0
+        self.pixel_format = "BGR8"  # cv2.VideoCapture の出力
+
+    # --- ファイルを開く関数 -------------------
+    def open(self):
+        if not self.video_paths:
+            raise FileNotFoundError("再生する録画ファイルがありません")
+        self._open_file(0)
+
+    def _open_file(self, index):
+        if self.capture is not None:
+            self.capture.release()
+        self.file_index = index
+        path = self.video_paths[index]
+        self.capture = cv2.VideoCapture(path)
+        if not self.capture.isOpened():
+            raise IOError(f"録画ファイルを開けません: {path}")
+        fps = self.capture.get(cv2.CAP_PROP_FPS)
+        self.fps = fps if fps and fps > 0 else REPLAY_DEFAULT_FPS
+
+    def is_open(self):
+        return self.capture is not None and self.capture.isOpened()
+
+    def get_frame_size(self):
+        if not self.is_open():
+            return None
+        return (int(self.capture.get(cv2.CAP_PROP_FRAME_WIDTH)), int(self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+
+    def start(self):
+        self.grabbing = True
+        self.start_time = time.perf_counter()
+        self.frame_index = 0
+
+    def is_grabbing(self):
+        return self.grabbing
+
+    # --- 次のファイルへ進む内部関数（末尾ならFalse） -------------------
+    def _next_file(self):
+        next_index = self.file_index + 1
+        if next_index >= len(self.video_paths):
+            if not self.loop:
+                return False
+            next_index = 0
+        self._open_file(next_index)
+        return True
+
+    # --- 1フレーム取得する関数 -------------------
+    def retrieve(self, timeout_ms=GRAB_TIMEOUT_MS):
+        ok, frame = self.capture.read(self.buffer)
+        while not ok:
+            if not self._next_file():
+                self.grabbing = False
+                return GrabbedFrame(False, error_code=-1, error_description="end of replay")
+            ok, frame = self.capture.read(self.buffer)
+        self.buffer = frame
+
+        # 録画時の時間軸に合わせて待機（speed > 0 の場合）
+        timestamp_ns = int(self.frame_index * 1e9 / self.fps)
+        if self.speed > 0:
+            due = self.start_time + timestamp_ns / 1e9 / self.speed
+            wait = due - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+
+        frame_id = self.frame_index
+        self.frame_index += 1
+        return GrabbedFrame(True, timestamp_ns, frame_id,
+                            array_context=lambda: contextlib.nullcontext(frame))
+
+    def stop(self):
+        self.grabbing = False
+
+    def close(self):
+        self.stop()
+        if self.capture is not None:
+            self.capture.release()
+            self.capture = None
+
+# ==========================================================
+# 録画フォルダから再生ファイルを探す関数
+# ==========================================================
+def find_recordings(folder, session=None):
+    """
+    folder 内の録画ファイルを古い順に返す
+    session を指定した場合は "フォルダ名_日時" の日時部分が一致するもの（前方一致）だけを返す
+    """
+    paths = []
+    for ext in REPLAY_VIDEO_EXTS:
+        paths.extend(glob.glob(os.path.join(folder, f"*{ext}")))
+    paths.sort()
+    if session is not None:
+        prefix = f"{os.path.basename(folder)}_{session}"
+        paths = [p for p in paths if os.path.basename(p).startswith(prefix)]
+    return paths
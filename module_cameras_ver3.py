@@ -6,8 +6,17 @@ import time
 import sys
 import cv2
 import threading
-from pypylon import pylon
+import queue
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from collections import deque
+try:
+    from pypylon import pylon
+except ImportError:     # 実機のない環境（リプレイのみ）では pypylon なしでも動かせるようにする
+    pylon = None
 
+from module_video_writer import VideoWriterWorker, DiskJanitor, ClipRecorder, CLIP_PRE_ROLL_SEC, CLIP_POST_ROLL_SEC
+from module_camera_source import PylonSource, ReplaySource, find_recordings, REPLAY_SPEED_REALTIME, PFS_FOLDER
 #import module_yolo_csv as yolo
 
 # ==========================================================
@@ -33,6 +42,16 @@ FOLDER_CHILD = [
 # 動画コーデック (Windows環境では 'DIVX' や 'mp4v' が安定する場合もあります)
 VIDEO_CODEC = 'XVID'
 VIDEO_EXIT = '.avi'
+VIDEO_SEGMENT_SECONDS = 60.0    # 録画を何秒ごとのファイルに分割するか（None で分割しない）
+VIDEO_SEGMENT_MAX_BYTES = None  # 1ファイルの最大サイズ（バイト、None で無制限）
+VIDEO_DISK_QUOTA_GB = None      # cam_video/ 全体の上限 GB（超えたら既存の録画・クリップも含め古い順に削除。None で無効）
+
+# 録画モード
+RECORD_CONTINUOUS = "continuous"    # 取得した全フレームを連続で録画
+RECORD_CLIPS = "clips"              # サクランボの判定ごとに前後のクリップだけを保存（YoloDetector.on_decision と併用）
+RECORD_MODE = RECORD_CONTINUOUS
+CLIP_LABELS = None              # クリップを残すクラス名（None: すべて。例: ("damaged",)）
+CLIP_LOW_CONFIDENCE = None      # 信頼度がこれ未満の判定はクラスに関係なく残す（None: 使わない）
 
 # カメラの諸設定
 FRAME_WIDTH = 1280
@@ -40,6 +59,74 @@ FRAME_HEIGHT = 960
 FRAME_SIZE = (FRAME_WIDTH, FRAME_HEIGHT)
 FPS = 20.0
 
+# カメラ設定ファイル（cam_pfs/カメラ名.pfs）
+USE_CAMERA_PFS = False          # True: PFSの設定を書き込む / False: 従来どおり自動露出・自動ゲイン・自動WBで起動
+
+# 取得モード設定
+CAPTURE_MODE_FULL = "full"              # PFSのAOIそのまま取得
+CAPTURE_MODE_INFERENCE = "inference"    # 推論解像度に合わせてセンサー側でビニング・AOIを設定
+CAPTURE_MODE = CAPTURE_MODE_FULL
+CAPTURE_TARGET_SIZE = 320               # 推論入力サイズ（module_yolo_csv.YOLO_IMG_SIZE と合わせる）
+# 推論に渡すクロップの最小の一辺（センサー画素）。None ならフレーム全体を縮小する前提
+# 検出側はダイナミッククロップ（module_yolo_csv.dynamic_crop）で切り出すため、最小の切り出し
+# = sqrt(MIN_TARGET_AREA) × CROP_SCALE（module_yolo_csv と合わせる。USE_CROP = False なら None）
+# この値は推論入力より小さいので、クロップ使用時はビニングせず AOI の設定だけが効く
+CAPTURE_MIN_CROP_PX = int(500 ** 0.5 * 1.5)
+
+# 転送画素フォーマット設定
+CAPTURE_PIXEL_FORMAT = None     # None: PFSの設定（RGB8）のまま / "BayerRG8" 等: 生データで転送しBGR変換は必要時のみ
+DEMOSAIC_WORKERS = 4            # BGR変換（デモザイク）用ワーカースレッド数
+
+# 下流（HSV_RANGES・学習済みモデル・録画）に渡す色の並び
+# True: 従来どおり RGB8 を変換せずに渡す（これまでの閾値・モデル・録画は R と B が入れ替わった画像で作られている）
+#       Bayer転送の場合も同じ並びに変換するので、転送フォーマットを変えても下流から見た画像は変わらない
+# False: 正しいBGRに変換する（HSV_RANGES の見直しとモデルの再学習が必要）
+LEGACY_CHANNEL_ORDER = True
+
+# 画素フォーマット → BGR変換コード（LEGACY_CHANNEL_ORDER の場合は従来の並びへの変換コード）
+# （OpenCVのBayer名は2行目の画素で命名されるため、pylonの BayerRG8 は COLOR_BayerBG2BGR に対応する）
+if LEGACY_CHANNEL_ORDER:
+    BGR_CONVERSIONS = {
+        "BGR8": None,
+        "RGB8": None,
+        "Mono8": cv2.COLOR_GRAY2BGR,
+        "BayerRG8": cv2.COLOR_BayerBG2RGB,
+        "BayerBG8": cv2.COLOR_BayerRG2RGB,
+        "BayerGR8": cv2.COLOR_BayerGB2RGB,
+        "BayerGB8": cv2.COLOR_BayerGR2RGB,
+    }
+else:
+    BGR_CONVERSIONS = {
+        "BGR8": None,
+        "RGB8": cv2.COLOR_RGB2BGR,
+        "Mono8": cv2.COLOR_GRAY2BGR,
+        "BayerRG8": cv2.COLOR_BayerBG2BGR,
+        "BayerBG8": cv2.COLOR_BayerRG2BGR,
+        "BayerGR8": cv2.COLOR_BayerGB2BGR,
+        "BayerGB8": cv2.COLOR_BayerGR2BGR,
+    }
+
+# フレームリングバッファ設定
+RING_SLOTS = 4                  # カメラ1台あたりの事前確保スロット数
+
+# 表示遅延（ディレイライン）設定
+DELAY_DISPLAY_SIZE = (640, 480)     # 遅延用に保持するフレームの最大サイズ（表示サイズ相当, 幅×高さ）
+DELAY_MEMORY_LIMIT_MB = 64          # カメラ1台あたりの遅延バッファ上限（MB）
+DELAY_MAX_FPS = 60.0                # 遅延バッファの容量見積もりに使う最大フレームレート
+
+# 取得テレメトリ設定
+HISTOGRAM_EDGES_MS = (0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)  # 時間ヒストグラムの区切り（ミリ秒）
+FPS_WINDOW_SEC = 2.0            # 実効fpsを計算する時間窓（秒）
+
+# 4カメラのフレーム同期設定
+SYNC_MODE_HOST = "host"              # PCでの受信時刻で照合
+SYNC_MODE_TIMESTAMP = "timestamp"    # カメラのグラブタイムスタンプで照合（カメラ毎の時刻オフセットを自動推定）
+SYNC_MODE_FRAME_ID = "frame_id"      # フレームID（BlockID）で照合（ハードウェアトリガ運用時向け）
+SYNC_MODE = SYNC_MODE_TIMESTAMP
+SYNC_TOLERANCE_MS = 20.0        # 同一時刻とみなす許容差（ミリ秒）
+SYNC_QUEUE_SIZE = 4             # 同期済みフレームセットの待ち行列上限
+SYNC_OFFSET_WINDOW_SEC = 10.0   # 時刻オフセット（転送遅延が最小の差）を求める時間窓。カメラ時計のずれに追従する
+
 # ==========================================================
 # 保存先の親フォルダと子フォルダを作成する関数
 # ==========================================================
@@ -63,119 +150,449 @@ def setup_folders():
         print(f"フォルダ作成エラー: {e}")
         sys.exit(1)
 
+# ==========================================================
+# 生フレームをBGRに変換する関数（デモザイク等）
+# ==========================================================
+_demosaic_pool = None
+_demosaic_pool_lock = threading.Lock()
+
+def get_demosaic_pool():
+    """BGR変換用の共有スレッドプール（cv2.cvtColor はGILを解放するので並列に動く）"""
+    global _demosaic_pool
+    with _demosaic_pool_lock:
+        if _demosaic_pool is None:
+            _demosaic_pool = ThreadPoolExecutor(max_workers=DEMOSAIC_WORKERS, thread_name_prefix="demosaic")
+        return _demosaic_pool
+
+def to_bgr(frame, pixel_format):
+    code = BGR_CONVERSIONS.get(pixel_format)
+    if code is None:
+        if len(frame.shape) == 2:   # フォーマット不明のモノクロ
+            return cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+        return frame
+    return cv2.cvtColor(frame, code)
+
+# ==========================================================
+# 処理時間のヒストグラムクラス
+# ==========================================================
+class LatencyHistogram:
+    """HISTOGRAM_EDGES_MS で区切った固定ビンに処理時間を数える（最後のビンは上限超え）"""
+    def __init__(self, edges_ms=HISTOGRAM_EDGES_MS):
+        self.edges_ms = edges_ms
+        self.counts = [0] * (len(edges_ms) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def add(self, ms):
+        index = 0
+        while index < len(self.edges_ms) and ms > self.edges_ms[index]:
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.total_ms += ms
+        if ms > self.max_ms:
+            self.max_ms = ms
+
+    # --- パーセンタイルの概算（該当ビンの上限値）を返す関数 -------------------
+    def percentile(self, p):
+        if self.count == 0:
+            return 0.0
+        threshold = self.count * p / 100.0
+        cumulative = 0
+        for index, c in enumerate(self.counts):
+            cumulative += c
+            if cumulative >= threshold:
+                return min(self.edges_ms[index], self.max_ms) if index < len(self.edges_ms) else self.max_ms
+        return self.max_ms
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "mean_ms": self.total_ms / self.count if self.count else 0.0,
+            "p50_ms": self.percentile(50),
+            "p99_ms": self.percentile(99),
+            "max_ms": self.max_ms,
+            "edges_ms": list(self.edges_ms),
+            "counts": list(self.counts),
+        }
+
+# ==========================================================
+# カメラ1台分の取得テレメトリクラス
+# ==========================================================
+class CameraStats:
+    """
+    >>> 取得スレッドが記録し、snapshot() で他スレッドから読み出す
+    - 実効fps / 取得フレーム数 / フレームID（BlockID）の欠番数
+    - RetrieveResult の待ち時間・リングへのコピー時間・BGR変換時間のヒストグラム
+    - GrabSucceeded 失敗のエラーコード別件数・ループ停止理由
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.frames = 0
+            self.skipped = 0            # 連続するフレームID間の欠番（LatestImageOnly で捨てられた数）
+            self.last_frame_id = None
+            self.errors = {}            # {エラーコード: 件数}
+            self.last_error = ""
+            self.loop_exit_reason = ""
+            self.retrieve_wait = LatencyHistogram()
+            self.copy_time = LatencyHistogram()
+            self.convert_time = LatencyHistogram()
+            self.window = deque()       # 直近 FPS_WINDOW_SEC 秒のフレーム受信時刻（ns）
+
+    # --- 取得成功を記録する関数 -------------------
+    def record_frame(self, frame_id, host_ns, wait_ns, copy_ns):
+        with self.lock:
+            self.frames += 1
+            if self.last_frame_id is not None and frame_id > self.last_frame_id + 1:
+                self.skipped += frame_id - self.last_frame_id - 1
+            self.last_frame_id = frame_id
+            self.retrieve_wait.add(wait_ns / 1e6)
+            self.copy_time.add(copy_ns / 1e6)
+            self.window.append(host_ns)
+            while self.window and host_ns - self.window[0] > FPS_WINDOW_SEC * 1e9:
+                self.window.popleft()
+
+    # --- 取得失敗を記録する関数 -------------------
+    def record_error(self, error_code, description=""):
+        with self.lock:
+            self.errors[error_code] = self.errors.get(error_code, 0) + 1
+            self.last_error = f"{error_code}: {description}"
+
+    def record_convert(self, ns):
+        with self.lock:
+            self.convert_time.add(ns / 1e6)
+
+    def record_exit(self, reason):
+        with self.lock:
+            self.loop_exit_reason = reason
+
+    def snapshot(self):
+        with self.lock:
+            if len(self.window) > 1:
+                fps = (len(self.window) - 1) / ((self.window[-1] - self.window[0]) / 1e9)
+            else:
+                fps = 0.0
+            return {
+                "fps": fps,
+                "frames": self.frames,
+                "skipped": self.skipped,
+                "errors": dict(self.errors),
+                "last_error": self.last_error,
+                "loop_exit_reason": self.loop_exit_reason,
+                "retrieve_wait": self.retrieve_wait.snapshot(),
+                "copy": self.copy_time.snapshot(),
+                "convert": self.convert_time.snapshot(),
+            }
+
+# ==========================================================
+# カメラ時刻（グラブタイムスタンプ）をPC時刻に換算するクラス
+# ==========================================================
+class DeviceClock:
+    """
+    >>> カメラごとに時刻の起点が異なるため、転送遅延が最小のときの (PC時刻 − カメラ時刻) をオフセットとして足す
+    - 全期間の最小値だとカメラ時計の進み・遅れで古くなるため、直近 window_ns の最小値を使う
+    - フレーム間隔はカメラ時刻のまま保たれる（PC側の受け取りの揺らぎが入らない）
+    """
+    def __init__(self, window_ns=int(SYNC_OFFSET_WINDOW_SEC * 1e9)):
+        self.window_ns = window_ns
+        self.window = deque()       # (PC時刻, 差) の単調増加キュー（時間窓内の最小値を求める）
+        self.offset = None
+
+    # --- カメラ時刻（ns）をPC時刻（host_ns と同じ時計のns）に換算する関数 -------------------
+    def convert(self, host_ns, device_ns):
+        offset = host_ns - device_ns
+        window = self.window
+        while window and window[-1][1] >= offset:
+            window.pop()
+        window.append((host_ns, offset))
+        while window[0][0] < host_ns - self.window_ns:
+            window.popleft()
+        self.offset = window[0][1]
+        return device_ns + self.offset
+
+# ==========================================================
+# 事前確保したスロットにフレームを書き込むリングバッファクラス
+# ==========================================================
+class FrameRing:
+    """
+    >>> 1台のカメラ専用の固定長リングバッファ
+    - 取得スレッドは次のスロットへ上書きコピーするだけ（毎フレームのメモリ確保なし）
+    - 読み出し側には読み取り専用ビューとシーケンス番号を返す
+    - ビューは RING_SLOTS - 1 フレーム分の間は上書きされない。長く保持する場合は呼び出し側でコピーすること
+    """
+    def __init__(self, num_slots=RING_SLOTS):
+        self.num_slots = num_slots
+        self.slots = None           # (num_slots, H, W[, C]) の配列。初回フレームの形状で確保
+        self.timestamps = np.zeros(num_slots, dtype=np.int64)   # 各スロットのグラブタイムスタンプ
+        self.frame_ids = np.full(num_slots, -1, dtype=np.int64) # 各スロットのフレームID
+        self.seq = 0                # 書き込み済みフレーム数（最新フレームのシーケンス番号 = seq - 1）
+        self.lock = threading.Lock()
+
+    # --- フレーム形状に合わせてスロットを確保する関数 -------------------
+    def _allocate(self, shape, dtype):
+        self.slots = np.empty((self.num_slots,) + tuple(shape), dtype=dtype)
+
+    # --- 次のスロットへフレームを書き込む関数（取得スレッドのみが呼ぶ） -------------------
+    def write(self, frame, timestamp=0, frame_id=-1):
+        if self.slots is None or self.slots.shape[1:] != frame.shape or self.slots.dtype != frame.dtype:
+            with self.lock:
+                self._allocate(frame.shape, frame.dtype)
+                self.seq = 0
+        index = self.seq % self.num_slots
+        np.copyto(self.slots[index], frame)
+        self.timestamps[index] = timestamp
+        self.frame_ids[index] = frame_id
+        with self.lock:             # 書き込み完了後にシーケンスを進めて公開
+            self.seq += 1
+        return self.seq - 1
+
+    # --- 最新フレームの読み取り専用ビューとシーケンス番号を返す関数 -------------------
+    def read_latest(self):
+        with self.lock:
+            if self.slots is None or self.seq == 0:
+                return None, -1
+            seq = self.seq - 1
+            view = self.slots[seq % self.num_slots]
+        view = view.view()
+        view.flags.writeable = False
+        return view, seq
+
+    # --- 指定シーケンスのフレームのビュー・タイムスタンプ・フレームIDを返す関数 -------------------
+    def read(self, seq):
+        if not self.is_valid(seq):
+            return None, 0, -1
+        index = seq % self.num_slots
+        view = self.slots[index].view()
+        view.flags.writeable = False
+        return view, int(self.timestamps[index]), int(self.frame_ids[index])
+
+    # --- 指定シーケンスのスロットがまだ上書きされていないか確認する関数 -------------------
+    def is_valid(self, seq):
+        with self.lock:
+            return 0 <= seq and self.seq - seq < self.num_slots
+
+    # --- バッファを空にする関数 -------------------
+    def clear(self):
+        with self.lock:
+            self.seq = 0
+
+# ==========================================================
+# グラブタイムスタンプ基準の表示遅延クラス
+# ==========================================================
+class DelayLine:
+    """
+    >>> 指定秒数だけ過去のフレームを返すディレイライン
+    - フレームは DELAY_DISPLAY_SIZE 以内に縮小して事前確保した領域に保存する
+    - メモリ上限に収まらない場合は保存間隔を間引き、常に遅延時間全体をカバーする
+    - 遅延はフレーム数ではなくタイムスタンプ（ns）で計算するため、実フレームレートが変動しても一定
+    """
+    def __init__(self, delay_seconds, display_size=DELAY_DISPLAY_SIZE, memory_limit_mb=DELAY_MEMORY_LIMIT_MB):
+        self.delay_seconds = delay_seconds
+        self.delay_ns = int(delay_seconds * 1e9)
+        self.display_size = display_size
+        self.memory_limit = int(memory_limit_mb * 1024 * 1024)
+
+        self.slots = None           # (capacity, h, w[, c]) の保存領域
+        self.timestamps = None
+        self.capacity = 0
+        self.min_interval_ns = 0    # 保存するフレームの最小間隔（容量不足時の間引き）
+        self.head = 0               # 最も古いフレームの位置
+        self.count = 0
+        self.last_stored_ns = None
+
+    # --- 初回フレームに合わせて保存領域を確保する内部関数 -------------------
+    def _allocate(self, frame):
+        h, w = frame.shape[:2]
+        max_w, max_h = self.display_size
+        scale = min(1.0, max_w / w, max_h / h)
+        shape = (max(1, int(h * scale)), max(1, int(w * scale))) + frame.shape[2:]
+
+        frame_bytes = int(np.prod(shape)) * frame.itemsize
+        needed = int(np.ceil(self.delay_seconds * DELAY_MAX_FPS)) + 2
+        self.capacity = max(2, min(needed, self.memory_limit // frame_bytes))
+        self.min_interval_ns = self.delay_ns // (self.capacity - 1) if self.capacity < needed else 0
+
+        self.slots = np.empty((self.capacity,) + shape, dtype=frame.dtype)
+        self.timestamps = np.zeros(self.capacity, dtype=np.int64)
+
+    # --- フレームを追加する関数（保存した場合は True） -------------------
+    def push(self, frame, timestamp_ns):
+        if self.slots is None or self.slots.shape[3:] != frame.shape[2:]:
+            self._allocate(frame)
+            self.count = 0
+        if self.last_stored_ns is not None and timestamp_ns - self.last_stored_ns < self.min_interval_ns:
+            return False    # 間引き対象
+
+        if self.count == self.capacity:     # 満杯なら最も古いフレームを上書き
+            self.head = (self.head + 1) % self.capacity
+            self.count -= 1
+        index = (self.head + self.count) % self.capacity
+        slot = self.slots[index]
+        cv2.resize(frame, (slot.shape[1], slot.shape[0]), dst=slot, interpolation=cv2.INTER_AREA)
+        self.timestamps[index] = timestamp_ns
+        self.count += 1
+        self.last_stored_ns = timestamp_ns
+        return True
+
+    # --- 直前に追加したフレームを取り消す関数（コピー中に元のフレームが上書きされた場合） -------------------
+    def drop_last(self):
+        if self.count == 0:
+            return
+        self.count -= 1
+        self.last_stored_ns = (int(self.timestamps[(self.head + self.count - 1) % self.capacity])
+                               if self.count else None)
+
+    # --- now_ns から遅延秒数だけ前のフレームを返す関数（まだ無ければ None） -------------------
+    def get(self, now_ns):
+        target = now_ns - self.delay_ns
+        # 目標時刻以前のフレームが2つ以上あれば古い方は不要
+        while self.count > 1 and self.timestamps[(self.head + 1) % self.capacity] <= target:
+            self.head = (self.head + 1) % self.capacity
+            self.count -= 1
+        if self.count == 0 or self.timestamps[self.head] > target:
+            return None
+        return self.slots[self.head]
+
+    # --- 保存領域のバイト数を返す関数 -------------------
+    @property
+    def nbytes(self):
+        return 0 if self.slots is None else self.slots.nbytes
+
 # ==========================================================
 # 個々のカメラの制御（接続、録画、停止）を行うクラス
 # ==========================================================
 class CameraController:
-    def __init__(self, device_info, save_path, cam_name = "unknown"):
-        self.device_info = device_info
+    def __init__(self, source, save_path, cam_name = "unknown"):
+        self.source = source        # 画像取得元（PylonSource / ReplaySource）
         self.save_path = save_path
         self.name = cam_name
 
-        self.camera = None
         self.video_writer = None
+        self.clip_recorder = None       # イベント録画（RECORD_CLIPS の場合）
         self.is_recording = False
         self.thread = None
         self.video_filename = ""
-        self.latest_frame = None     # 最新フレーム保存用
-        self.lock = threading.Lock() # データの衝突防止用ロック
+        self.frame_ring = FrameRing(RING_SLOTS) # 最新フレーム保存用リングバッファ
+        self.synchronizer = None                # 4カメラ同期器（CameraManagerが設定）
+        self.stats = CameraStats()              # 取得テレメトリ
+        self.clock = DeviceClock()              # グラブタイムスタンプ → UNIX時刻（録画の索引・クリップに使う）
 
-    # --- Pypylonによりカメラを初期化しオープンする関数 -------------------
-    def init_camera(self):
-        """Pypylonでカメラインスタンスを生成・オープン"""
-        try:
-            self.camera = pylon.InstantCamera(pylon.TlFactory.GetInstance().CreateDevice(self.device_info))
-            self.camera.Open()
-            # 設定ファイルのロードが必要な場合はここで行う
-            #pylon.FeaturePersistence.Load("path/to/settings.pfs", self.camera.GetNodeMap(), True)
-            # --- ここから追加 ---
-            # 1. 露出（明るさ）を自動にする
-            try:
-                self.camera.ExposureAuto.SetValue('Continuous')
-            except:
-                pass # 対応していないカメラ等の場合無視
+        # 表示同期用の設定
+        self.delay_seconds = 0.0                # 表示遅延秒数
+        self.delay_line = None
+        self.delay_last_seq = -1                # ディレイラインへ最後に追加したシーケンス番号
 
-            # 2. ゲイン（感度）を自動にする
-            try:
-                self.camera.GainAuto.SetValue('Continuous')
-            except:
-                pass
+        # BGR変換済みフレームのキャッシュ（同じフレームを複数の利用者が取得しても変換は1回）
+        self.bgr_lock = threading.Lock()
+        self.bgr_cache_seq = -1
+        self.bgr_cache = None
 
-            # 3. ホワイトバランス（色味）を自動にする (カラーカメラの場合のみ)
-            try:
-                self.camera.BalanceWhiteAuto.SetValue('Continuous')
-            except:
-                pass
-            # --- ここまで ---
+    # --- 取得元の画素フォーマット -------------------
+    @property
+    def pixel_format(self):
+        return getattr(self.source, "pixel_format", None)
+
+    # --- 取得元（カメラ / 録画ファイル）をオープンする関数 -------------------
+    def init_camera(self):
+        try:
+            self.source.open()
             return True
         except Exception as e:
             print(f"カメラ初期化エラー: {e}")
             return False
 
-    # --- 動画録画開始する関数 -------------------
-    def start_recording(self):
-        if not self.camera or not self.camera.IsOpen():
-            print(f"エラー: カメラが開かれていません ({self.device_info.GetSerialNumber()})")
+    # --- 動画録画開始する関数（record=False の場合は取得のみ） -------------------
+    def start_recording(self, record=True, mode=RECORD_MODE):
+        if not self.source.is_open():
+            print(f"エラー: カメラが開かれていません ({self.source.serial})")
             return
 
-        # 保存ファイル・書き込み設定
-        folder_name = os.path.basename(self.save_path)
-        timestamp = time.strftime("%Y%m%d_%H%M%S")
-        fourcc = cv2.VideoWriter_fourcc(*VIDEO_CODEC)
-        self.video_filename = os.path.join(self.save_path, f"{folder_name}_{timestamp}{VIDEO_EXIT}") # ファイル名を "フォルダ名_日時.avi" にする
-        self.video_writer = cv2.VideoWriter(self.video_filename, fourcc, FPS, FRAME_SIZE)
-        if not self.video_writer.isOpened():
-            print(f"エラー: VideoWriterの作成に失敗しました ({self.video_filename})")
-            return
+        if record and mode == RECORD_CLIPS:
+            # 判定ごとのクリップだけを保存（"フォルダ名_日時_id00001_ラベル.avi"）
+            folder_name = os.path.basename(self.save_path)
+            timestamp = time.strftime("%Y%m%d_%H%M%S")
+            frame_size = self.source.get_frame_size() or FRAME_SIZE
+            self.clip_recorder = ClipRecorder(self.save_path, f"{folder_name}_{timestamp}", VIDEO_CODEC, FPS, frame_size,
+                                              name=self.name, convert_code=BGR_CONVERSIONS.get(self.pixel_format),
+                                              ext=VIDEO_EXIT)
+            self.clip_recorder.start()
+            self.video_filename = os.path.join(self.save_path, f"{folder_name}_{timestamp}_id*{VIDEO_EXIT}")
+        elif record:
+            # 保存ファイル・書き込み設定
+            folder_name = os.path.basename(self.save_path)
+            timestamp = time.strftime("%Y%m%d_%H%M%S")
+            self.video_filename = os.path.join(self.save_path, f"{folder_name}_{timestamp}{VIDEO_EXIT}") # ファイル名を "フォルダ名_日時.avi" にする
+            # 分割する場合は "フォルダ名_日時_0000.avi" ... と "フォルダ名_日時_index.csv" になる
+            # エンコードは専用スレッドで行う（取得ループは受け渡しのみ）
+            # 取得サイズのまま保存する（不明な場合は FRAME_SIZE）
+            frame_size = self.source.get_frame_size() or FRAME_SIZE
+            # 生フレームのまま渡し、BGR変換は書き込みスレッド側で行う
+            self.video_writer = VideoWriterWorker(self.video_filename, VIDEO_CODEC, FPS, frame_size, name=self.name,
+                                                  convert_code=BGR_CONVERSIONS.get(self.pixel_format),
+                                                  segment_seconds=VIDEO_SEGMENT_SECONDS,
+                                                  segment_bytes=VIDEO_SEGMENT_MAX_BYTES)
+            if not self.video_writer.start():
+                self.video_writer = None
+                return
 
         self.is_recording = True
 
-        # カメラの画像取得開始 (GrabStrategy_LatestImageOnly: バッファ詰まり防止)
-        self.camera.StartGrabbing(pylon.GrabStrategy_LatestImageOnly)
+        # 画像取得開始
+        self.source.start()
         # スレッドを作成してループ処理を実行
         self.thread = threading.Thread(target=self._capture_loop)
         self.thread.daemon = True # メインプログラム終了時に強制終了できるようにする
         self.thread.start()
-        print(f"録画開始: {self.name}：{self.video_filename}")
+        print(f"録画開始: {self.name}：{self.video_filename or '(保存なし)'}")
 
     # --- フレームキャプチャと保存のループ処理関数 -------------------
     def _capture_loop(self):
-        serial = self.device_info.GetSerialNumber()
+        serial = self.source.serial
+        self.stats.reset()
+        self.clock = DeviceClock()      # 再開時はカメラ時刻の起点が変わりうるので測り直す
 
-        while self.is_recording and self.camera.IsGrabbing():
+        while self.is_recording and self.source.is_grabbing():
             try:
-                grab_result = self.camera.RetrieveResult(5000, pylon.TimeoutHandling_ThrowException)  # タイムアウト5000msで画像取得待機
-                if grab_result.GrabSucceeded():
-                    frame = grab_result.Array
-                    with self.lock:  # 鍵をかけて書き込む
-                        self.latest_frame = frame.copy()
-                    # Bayer配列の場合は変換が必要（カメラ設定による）
-                    # frame_bgr = cv2.cvtColor(frame, cv2.COLOR_BAYER_BG2BGR)
-                    # 今回は単純化のため、取得画像が既にカラーかモノクロ扱える前提で記述# 必要に応じて cv2.cvtColor を有効化してください
-                    frame_bgr = None
-
-                    # 画像の書き込み
-                    # 注意: pypylonのraw画像とOpenCVの形式が合うか要確認
-                    # 保存のためにBGR形式に変換します。
-                    if len(frame.shape) == 2: # モノクロの場合
-                        frame_bgr = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
-                    else:
-                        frame_bgr = frame
-
-                    # リサイズが必要な場合（設定したFRAME_SIZEと異なる場合）
-                    if frame_bgr.shape[:2] != (FRAME_HEIGHT, FRAME_WIDTH):
-                        frame_bgr = cv2.resize(frame_bgr, (FRAME_WIDTH, FRAME_HEIGHT))
-
-                    # 書き込み
-                    self.video_writer.write(frame_bgr)
-                else:
-                    print(f"フレーム取得エラー: {serial}, Error: {grab_result.ErrorCode}")
-
-                grab_result.Release()
+                wait_start = time.perf_counter_ns()
+                grab = self.source.retrieve(5000)  # タイムアウト5000msで画像取得待機
+                host_ns = time.perf_counter_ns()
+                if grab.succeeded:
+                    # 取得元のバッファから事前確保スロットへ直接コピー（中間配列を作らない）
+                    with grab.array() as raw:
+                        seq = self.frame_ring.write(raw, grab.timestamp, grab.frame_id)
+                    self.stats.record_frame(grab.frame_id, host_ns, host_ns - wait_start, time.perf_counter_ns() - host_ns)
+                    frame, _ = self.frame_ring.read_latest()
+                    # 撮影時刻: グラブタイムスタンプを UNIX時刻に換算したもの（録画の索引・クリップ・判定時刻に使う）
+                    capture_time = (self.clock.convert(time.time_ns(), grab.timestamp) if grab.timestamp > 0
+                                    else time.time_ns()) / 1e9
+
+                    # 同期器へフレームの到着を通知
+                    if self.synchronizer is not None:
+                        self.synchronizer.push(self.name, seq, host_ns, grab.timestamp, grab.frame_id, capture_time)
+
+                    # 書き込み（エンコーダ側のキューへ受け渡すだけ。変換・リサイズはワーカー側で行う）
+                    if self.video_writer is not None:
+                        self.video_writer.submit(frame, capture_time)
+                    # イベント録画はリングへのコピーのみ（書き出しは判定時に別スレッドで行う）
+                    if self.clip_recorder is not None:
+                        self.clip_recorder.push(frame, capture_time)
+                elif self.source.is_grabbing():
+                    self.stats.record_error(grab.error_code, grab.error_description)
+                    print(f"フレーム取得エラー: {serial}, Error: {grab.error_code}")
+
+                grab.release()
 
             except Exception as e:
+                self.stats.record_exit(f"exception: {e}")
                 print(f"Loop Error ({serial}): {e}")
                 break
+        else:
+            self.stats.record_exit("stopped" if not self.is_recording else "source finished")
 
     # --- 動画録画停止する関数 -------------------
     def stop_recording(self):
@@ -185,29 +602,281 @@ class CameraController:
         if self.thread is not None:
             self.thread.join(timeout=2.0)
 
-        if self.camera and self.camera.IsGrabbing():
-            self.camera.StopGrabbing()
+        self.source.stop()
 
         if self.video_writer:
-            self.video_writer.release()
-            print(f"録画停止・保存完了: {self.video_filename}")
+            self.video_writer.stop()
+            stats = self.video_writer.get_stats()
+            print(f"録画停止・保存完了: {self.video_filename} (書き込み {stats['written']} / 破棄 {stats['dropped']}"
+                  f" / ファイル数 {stats['segments']})")
+            self.video_writer = None
+
+        if self.clip_recorder:
+            self.clip_recorder.stop()
+            stats = self.clip_recorder.get_stats()
+            print(f"クリップ録画停止: {self.name} (クリップ {stats['clips']} / 書き込み {stats['written']}"
+                  f" / 取得 {stats['pushed']} フレーム)")
+            self.clip_recorder = None
+
+    # --- 判定1件分のクリップを保存する関数 -------------------
+    def save_clip(self, clip_name, t_start, t_end):
+        if self.clip_recorder is not None:
+            self.clip_recorder.save(clip_name, t_start, t_end)
+
+    # --- 最新フレームの読み取り専用ビューとシーケンス番号を取得する関数 -------------------
+    def get_latest_frame(self):
+        return self.frame_ring.read_latest()
+
+    # --- 遅延させたフレームを取得する内部関数（GUIスレッドから呼ぶ） -------------------
+    def _get_delayed_frame(self, seq):
+        if self.delay_line is None or self.delay_line.delay_seconds != self.delay_seconds:
+            self.delay_line = DelayLine(self.delay_seconds)
+            self.delay_last_seq = -1
+
+        # 前回以降に届いたフレームのうち、まだリングに残っているものを追加
+        latest_ts = None
+        for pending_seq in range(max(self.delay_last_seq + 1, seq - RING_SLOTS + 1), seq + 1):
+            frame, timestamp, _ = self.frame_ring.read(pending_seq)
+            if frame is not None:
+                # Bayer配列のまま縮小すると色が壊れるため、BGR変換してから追加
+                stored = self.delay_line.push(to_bgr(frame, self.pixel_format), timestamp)
+                # リングのスロットは借り物なので、コピー後にまだ上書きされていないか確認する（されていたら捨てる）
+                if not self.frame_ring.is_valid(pending_seq):
+                    if stored:
+                        self.delay_line.drop_last()
+                    continue
+                latest_ts = timestamp
+        self.delay_last_seq = seq
+        if latest_ts is None:
+            return None
+        return self.delay_line.get(latest_ts)
+
+    # --- 指定シーケンス（省略時は最新）のフレームをBGRで取得する関数 -------------------
+    def get_bgr_frame(self, seq=None):
+        """生フレームのBGR変換は、ここで実際に取得されたフレームに対してだけ行う"""
+        if seq is None:
+            raw, seq = self.frame_ring.read_latest()
+        else:
+            raw, _, _ = self.frame_ring.read(seq)
+        if raw is None:
+            return None, -1
+
+        with self.bgr_lock:
+            if self.bgr_cache_seq == seq:
+                return self.bgr_cache, seq
+        convert_start = time.perf_counter_ns()
+        img = to_bgr(raw, self.pixel_format)
+        self.stats.record_convert(time.perf_counter_ns() - convert_start)
+        if not self.frame_ring.is_valid(seq):   # 変換中に上書きされた
+            return None, -1
+        with self.bgr_lock:
+            self.bgr_cache_seq, self.bgr_cache = seq, img
+        return img, seq
+
+    # --- BGR変換をワーカープールで行う関数（Futureを返す） -------------------
+    def submit_bgr_frame(self, seq=None):
+        return get_demosaic_pool().submit(self.get_bgr_frame, seq)
 
     # --- 現在のフレームを取得してGUIに表示する関数 -------------------
     def get_current_frame(self):
-        with self.lock: # 鍵をかけて読み込む
-            if self.latest_frame is not None:
-                # カラー変換が必要ならここで行う
-                img = self.latest_frame
-                if len(img.shape) == 2:
-                    img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
-                return img
-        return None
+        _, seq = self.frame_ring.read_latest()
+        if seq < 0:
+            return None
+        if self.delay_seconds > 0:
+            return self._get_delayed_frame(seq)     # ディレイラインはBGRで保持している
+        # カラー変換はロック外で行う（取得スレッドを待たせない）
+        img, _ = self.get_bgr_frame(seq)
+        return img
 
     # --- カメラリソースの解放をする関数 -------------------
     def close(self):
         self.stop_recording()
-        if self.camera and self.camera.IsOpen():
-            self.camera.Close()
+        self.source.close()
+
+# ==========================================================
+# 同期済みフレームセット（4カメラ同一時刻のフレーム）
+# ==========================================================
+class SyncedFrameSet:
+    def __init__(self, names, raw_frames, timestamps, frame_ids, pixel_formats=None, capture_times=None):
+        self.names = names              # カメラ名のタプル（TARGET_SERIALS の順）
+        self.raw_frames = raw_frames    # 取得したままのフレームのタプル（names と同じ順）
+        self.timestamps = timestamps    # 照合に使った時刻（ns）
+        self.frame_ids = frame_ids
+        self.capture_times = capture_times  # 各カメラの撮影時刻（UNIX時刻）
+        self.pixel_formats = pixel_formats or (None,) * len(names)
+        self._frames = None
+
+    # --- BGRフレームのタプル（初回参照時にワーカープールで並列に変換） -------------------
+    @property
+    def frames(self):
+        if self._frames is None:
+            self._frames = tuple(get_demosaic_pool().map(to_bgr, self.raw_frames, self.pixel_formats))
+        return self._frames
+
+    def as_dict(self):
+        return dict(zip(self.names, self.frames))
+
+    # --- セットの撮影時刻（UNIX時刻、各カメラの平均）。YoloDetector・YoloServer に timestamp として渡す -------------------
+    @property
+    def capture_time(self):
+        if not self.capture_times:
+            return None
+        return sum(self.capture_times) / len(self.capture_times)
+
+    # --- セット内の最大時刻差（ミリ秒）を返す関数 -------------------
+    def spread_ms(self):
+        return (max(self.timestamps) - min(self.timestamps)) / 1e6
+
+# ==========================================================
+# 4カメラのフレームを時刻で突き合わせる同期クラス
+# ==========================================================
+class FrameSynchronizer:
+    """
+    >>> 各カメラの取得スレッドから push() され、全カメラのフレームが許容差内に揃ったらセットにして出力する
+    - 照合キー: SYNC_MODE_HOST / SYNC_MODE_TIMESTAMP / SYNC_MODE_FRAME_ID
+    - 相手が見つからずに捨てたフレームはカメラ毎に unmatched として数える
+    - 出力は get_frame_set() またはイテレーションで受け取る
+    - 取得スレッドでは照合だけを行い、リングからのコピーは受け取り側（get_frame_set）で行う
+    """
+    def __init__(self, controllers, tolerance_ms=SYNC_TOLERANCE_MS, mode=SYNC_MODE, queue_size=SYNC_QUEUE_SIZE):
+        self.names = tuple(c.name for c in controllers)
+        self.rings = {c.name: c.frame_ring for c in controllers}
+        self.controllers = controllers
+        self.tolerance_ns = int(tolerance_ms * 1e6)
+        self.mode = mode
+        self.frame_period_ns = int(1e9 / FPS)
+
+        self.lock = threading.Lock()
+        self.pending = {name: deque() for name in self.names}   # (照合キー, seq, 撮影時刻) の待ち行列
+        self.offsets = {}           # カメラ時刻 -> PC時刻 のオフセット（timestampモード）
+        self.clocks = {}            # カメラ毎の DeviceClock（timestampモード）
+        self.first_ids = {}         # 最初のフレームID（frame_idモード）
+        self.output = queue.Queue(maxsize=queue_size)
+        self.is_running = True
+
+        # 統計用カウンタ
+        self.matched = 0
+        self.unmatched = {name: 0 for name in self.names}
+        self.stale = 0              # 照合後に読み出す前にリング上で上書きされたセット数
+        self.dropped_sets = 0       # 出力キューが満杯で捨てたセット数
+
+    # --- 照合用のキー（ns）を計算する内部関数 -------------------
+    def _key(self, name, host_ns, device_ns, frame_id):
+        if self.mode == SYNC_MODE_HOST:
+            return host_ns
+        if self.mode == SYNC_MODE_FRAME_ID:
+            first = self.first_ids.setdefault(name, frame_id)
+            return (frame_id - first) * self.frame_period_ns
+        # カメラ毎に時刻の起点が異なるため、転送遅延が最小のときの差をオフセットとして採用する
+        clock = self.clocks.setdefault(name, DeviceClock())
+        key = clock.convert(host_ns, device_ns)
+        self.offsets[name] = clock.offset
+        return key
+
+    # --- フレーム到着を登録する関数（取得スレッドから呼ぶ） -------------------
+    def push(self, name, seq, host_ns, device_ns, frame_id, capture_time=None):
+        if name not in self.pending or not self.is_running:
+            return
+        with self.lock:
+            pending = self.pending[name]
+            pending.append((self._key(name, host_ns, device_ns, frame_id), seq, capture_time))
+            # リングに残っていないフレームは照合しても読み出せないので捨てる
+            while len(pending) >= RING_SLOTS:
+                pending.popleft()
+                self.unmatched[name] += 1
+            matched = self._match()
+        for entries in matched:
+            self._emit(entries)     # ここではシーケンス番号を渡すだけ（コピーしない）
+
+    # --- 待ち行列の先頭同士を突き合わせる内部関数（ロック内で呼ぶ） -------------------
+    def _match(self):
+        matched = []
+        while all(self.pending[name] for name in self.names):
+            newest = max(self.pending[name][0][0] for name in self.names)
+            dropped = False
+            for name in self.names:
+                pending = self.pending[name]
+                while pending and pending[0][0] < newest - self.tolerance_ns:
+                    pending.popleft()
+                    self.unmatched[name] += 1
+                    dropped = True
+            if dropped:
+                continue
+            matched.append([self.pending[name].popleft() for name in self.names])
+            self.matched += 1
+        return matched
+
+    # --- 揃ったフレームのシーケンス番号を出力キューに積む内部関数 -------------------
+    def _emit(self, entries):
+        try:
+            self.output.put_nowait(entries)
+        except queue.Full:
+            # 古いセットを捨てて最新を優先する
+            try:
+                self.output.get_nowait()
+                with self.lock:
+                    self.dropped_sets += 1
+            except queue.Empty:
+                pass
+            try:
+                self.output.put_nowait(entries)
+            except queue.Full:      # 他の取得スレッドが先に積んだ
+                with self.lock:
+                    self.dropped_sets += 1
+
+    # --- リングからフレームをコピーしてセットを作る内部関数（受け取り側で呼ぶ） -------------------
+    def _read_set(self, entries):
+        frames, frame_ids = [], []
+        for name, (_, seq, _) in zip(self.names, entries):
+            ring = self.rings[name]
+            view, _, frame_id = ring.read(seq)
+            if view is None:
+                return None
+            frames.append(np.array(view))       # 出力側が保持できるようにコピー
+            if not ring.is_valid(seq):          # コピー中に上書きされていないか確認
+                return None
+            frame_ids.append(frame_id)
+        capture_times = tuple(t for _, _, t in entries)
+        return SyncedFrameSet(self.names, tuple(frames), tuple(key for key, _, _ in entries), tuple(frame_ids),
+                              tuple(c.pixel_format for c in self.controllers),
+                              capture_times if None not in capture_times else None)
+
+    # --- 同期済みフレームセットを1つ取り出す関数 -------------------
+    def get_frame_set(self, timeout=None):
+        """リング上で上書きされていたセットは stale に数えて次のセットを待つ"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                entries = self.output.get(timeout=remaining)
+            except queue.Empty:
+                return None
+            frame_set = self._read_set(entries)
+            if frame_set is not None:
+                return frame_set
+            with self.lock:
+                self.stale += 1
+
+    # --- 同期済みフレームセットを順に返すジェネレータ -------------------
+    def __iter__(self):
+        while self.is_running or not self.output.empty():
+            frame_set = self.get_frame_set(timeout=0.5)
+            if frame_set is not None:
+                yield frame_set
+
+    # --- 同期を停止する関数 -------------------
+    def stop(self):
+        self.is_running = False
+
+    # --- 統計情報を返す関数 -------------------
+    def get_stats(self):
+        with self.lock:
+            return {
+                "matched": self.matched,
+                "unmatched": dict(self.unmatched),
+                "stale": self.stale,
+                "dropped_sets": self.dropped_sets,
+            }
 
 # ==========================================================
 # システム全体の管理（全カメラの接続・実行）を行うクラス
@@ -215,10 +884,21 @@ class CameraController:
 class CameraManager:
     def __init__(self):
         self.controllers = []
+        self.synchronizer = None
+        self.janitor = None             # 録画フォルダの容量管理（録画時のみ）
         setup_folders()
 
     # --- シリアルナンバーに基づき各カメラを初期化する関数 -------------------
-    def init_cameras(self):
+    def init_cameras(self, capture_mode=CAPTURE_MODE, target_size=CAPTURE_TARGET_SIZE, min_crop_px=CAPTURE_MIN_CROP_PX,
+                     pixel_format=CAPTURE_PIXEL_FORMAT, use_pfs=USE_CAMERA_PFS):
+        """
+        capture_mode=CAPTURE_MODE_INFERENCE の場合は target_size に合わせてセンサー側で縮小する
+        use_pfs=True の場合は cam_pfs/カメラ名.pfs を書き込む（False なら自動露出等の従来設定）
+        pixel_format="BayerRG8" 等を指定すると生データで転送する（USB転送量はRGB8の1/3）
+        """
+        if pylon is None:
+            print("Pylon初期化エラー: pypylon がインストールされていません\n")
+            return False
         try:
             tlFactory = pylon.TlFactory.GetInstance()
             devices = tlFactory.EnumerateDevices()
@@ -231,6 +911,7 @@ class CameraManager:
             return False
 
         print("カメラをシリアルナンバーで検索中・・・")
+        start_time = time.perf_counter()
         for i, (target_serial, cam_name) in enumerate(TARGET_SERIALS):
             found_device_info = None
 
@@ -241,16 +922,24 @@ class CameraManager:
 
             if found_device_info:
                 save_path = os.path.join(FOLDER_PARENT, FOLDER_CHILD[i])
-                controller = CameraController(found_device_info, save_path, cam_name)
+                pfs_path = os.path.join(PFS_FOLDER, f"{cam_name}.pfs") if use_pfs else None
+                capture_target = (target_size, min_crop_px) if capture_mode == CAPTURE_MODE_INFERENCE else None
+                source = PylonSource(found_device_info, pfs_path, capture_target, pixel_format)
+                controller = CameraController(source, save_path, cam_name)
                 self.controllers.append(controller)
+            else:
+                print(f"[接続不可] Serial：{target_serial}, カメラ位置：{cam_name}")
 
-                if controller.init_camera():
-                    print(f"[ 接続完了 + 初期化完了 ]シリアルナンバー：{target_serial}, カメラ位置：{cam_name}")
-                else:
-                    print(f"エラー: シリアルナンバー {target_serial}, カメラ位置：{cam_name} のカメラの初期化に失敗しました。")
+        # オープンと設定の書き込みは全カメラ並列で行う
+        with ThreadPoolExecutor(max_workers=max(1, len(self.controllers))) as executor:
+            results = list(executor.map(lambda c: c.init_camera(), self.controllers))
 
+        for controller, ok in zip(self.controllers, results):
+            if ok:
+                print(f"[ 接続完了 + 初期化完了 ]シリアルナンバー：{controller.source.serial}, カメラ位置：{controller.name}")
             else:
-                print(f"[接続不可] Serial：{target_serial}, カメラ位置：{cam_name}")
+                print(f"エラー: シリアルナンバー {controller.source.serial}, カメラ位置：{controller.name} のカメラの初期化に失敗しました。")
+        print(f"  カメラ初期化時間: {time.perf_counter() - start_time:.2f} 秒")
 
         if len(self.controllers) != len(TARGET_SERIALS):
             print(f"警告: 予定台数 {len(TARGET_SERIALS)} に対し、接続成功は {len(self.controllers)} 台です。")
@@ -259,17 +948,100 @@ class CameraManager:
             print(f">>> 全 {len(self.controllers)} 台のカメラ準備完了。\n")
             return True
 
+    # --- 録画ファイルを取得元として各カメラを初期化する関数（実機なしでの検証・ベンチマーク用） -------------------
+    def init_replay_cameras(self, speed=REPLAY_SPEED_REALTIME, loop=False, session=None):
+        """
+        cam_video/cam_video_*/ の録画をカメラの代わりに再生する
+        speed: 1.0=実時間, 2.0=2倍速, 0=待機なし / session: "YYYYmmdd_HHMMSS"（前方一致）で録画を選択
+        """
+        print("録画ファイルを検索中・・・")
+        for i, (_, cam_name) in enumerate(TARGET_SERIALS):
+            save_path = os.path.join(FOLDER_PARENT, FOLDER_CHILD[i])
+            paths = find_recordings(save_path, session)
+            if not paths:
+                print(f"[再生不可] 録画なし：{save_path}, カメラ位置：{cam_name}")
+                continue
+
+            controller = CameraController(ReplaySource(paths, speed, loop), save_path, cam_name)
+            if controller.init_camera():
+                self.controllers.append(controller)
+                print(f"[ 再生準備完了 ]ファイル数：{len(paths)}, カメラ位置：{cam_name}")
+
+        if len(self.controllers) != len(TARGET_SERIALS):
+            print(f"警告: 予定台数 {len(TARGET_SERIALS)} に対し、再生準備完了は {len(self.controllers)} 台です。")
+            return False
+        print(f">>> 全 {len(self.controllers)} 台の再生準備完了。\n")
+        return True
+
+    # --- 全カメラの取得テレメトリをまとめて返す関数 -------------------
+    def get_stats_snapshot(self):
+        """
+        {カメラ名: {fps, frames, skipped, errors, retrieve_wait, copy, convert, writer}, "sync": 同期器の統計}
+        取得側（fps低下・欠番・待ち時間）と下流（録画の破棄数・同期の不一致数）のどちらで落ちているかの切り分け用
+        """
+        snapshot = {}
+        for controller in self.controllers:
+            stats = controller.stats.snapshot()
+            stats["writer"] = controller.video_writer.get_stats() if controller.video_writer else None
+            snapshot[controller.name] = stats
+        snapshot["sync"] = self.synchronizer.get_stats() if self.synchronizer else None
+        return snapshot
+
+    # --- AOI・ビニング変更による削減見積もりを返す関数 -------------------
+    def get_capture_reports(self):
+        return {c.name: getattr(c.source, "capture_report", None) for c in self.controllers}
+
+    # --- 4カメラのフレーム同期器を作成する関数 -------------------
+    def create_synchronizer(self, tolerance_ms=SYNC_TOLERANCE_MS, mode=SYNC_MODE):
+        self.synchronizer = FrameSynchronizer(self.controllers, tolerance_ms, mode)
+        for controller in self.controllers:
+            controller.synchronizer = self.synchronizer
+        return self.synchronizer
+
     # --- 全てのカメラのフレーム取得を開始する関数 -------------------
-    def start_all_get_frame(self):
+    def start_all_get_frame(self, record=True, mode=RECORD_MODE):
         if not self.controllers:
             print("有効なカメラがありません。\n")
             return
         print("---- 全カメラ録画開始 ----")
+        if record and VIDEO_DISK_QUOTA_GB and self.janitor is None:
+            self.janitor = DiskJanitor(FOLDER_PARENT, VIDEO_DISK_QUOTA_GB)
+            self.janitor.start()
+        for controller in self.controllers:
+            controller.start_recording(record, mode)
+
+    # --- サクランボの判定結果に対応するクリップを全カメラで保存する関数 -------------------
+    def save_cherry_clip(self, result):
+        """
+        result: YoloDetector の確定結果（YoloResult）。detector.on_decision に設定するか、
+                YoloServer の finalized_result を渡す（RECORD_CLIPS で録画中のみ保存される）
+                判定時刻はリングと同じ撮影時刻である必要がある（evaluate_frame_set はそのまま、YoloServer には
+                submit(..., timestamp=frame_set.capture_time) で渡す）
+        CLIP_LABELS / CLIP_LOW_CONFIDENCE を指定した場合は、該当する判定だけを残す
+        """
+        if result is None or result.decided_at is None:
+            return False
+        if CLIP_LABELS is not None or CLIP_LOW_CONFIDENCE is not None:
+            wanted = CLIP_LABELS is not None and result.label_name in CLIP_LABELS
+            uncertain = CLIP_LOW_CONFIDENCE is not None and result.confidence < CLIP_LOW_CONFIDENCE
+            if not (wanted or uncertain):
+                return False
+
+        t_start = (result.first_seen_at or result.decided_at) - CLIP_PRE_ROLL_SEC
+        t_end = result.decided_at + CLIP_POST_ROLL_SEC
+        clip_name = f"id{result.id:05d}_{result.label_name}"   # CSVのIDと対応させる
         for controller in self.controllers:
-            controller.start_recording()
+            controller.save_clip(clip_name, t_start, t_end)
+        return True
 
     # --- 全てのカメラのフレーム取得を停止する関数 -------------------
     def stop_all_get_frame(self):
         print("---- 全カメラ録画停止完了 ----")
+        if self.synchronizer is not None:
+            self.synchronizer.stop()
+            print(f"  [Sync] {self.synchronizer.get_stats()}")
         for controller in self.controllers:
             controller.close()
+        if self.janitor is not None:
+            self.janitor.stop()
+            self.janitor = None
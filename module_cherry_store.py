@@ -0,0 +1,256 @@
+# -------------------------------------------------
+# サクランボ1個ごとの判定記録を列形式で保存・検索するプログラムmodule
+# -------------------------------------------------
+import os
+import json
+import glob
+import datetime
+
+import numpy as np
+
+# ==========================================================
+# 定数定義
+# ==========================================================
+STORE_DIR = "evaluated_store"   # 保存先フォルダ
+STORE_CHUNK_ROWS = 4096         # 1チャンク（memmap）の行数。満杯になったら NPZ に書き出す
+STORE_CAMERAS = ('cam_top', 'cam_under', 'cam_inside', 'cam_outside')
+INDEX_FILE = "index.json"       # チャンク一覧（時刻・ID範囲・ラベル別件数）
+
+# 判定理由のコード
+REASON_CODES = {"": 0, "threshold": 1, "all_views": 2, "exit": 3, "close": 4}
+REASON_NAMES = {code: name for name, code in REASON_CODES.items()}
+
+# カメラ1台分の記録（最も信頼度の高かったフレームの値）
+VIEW_DTYPE = np.dtype([
+    ('frames', 'i2'),           # 推論したフレーム数（0 = このカメラでは見えなかった）
+    ('label', 'i2'),            # クラス番号（-1 = 検出なし）
+    ('conf', 'f4'),             # 信頼度
+    ('mx', 'i4'), ('my', 'i4'), # get_target_info の中心
+    ('x', 'i4'), ('y', 'i4'), ('w', 'i4'), ('h', 'i4'),    # 外接矩形
+    ('area', 'i4'),             # 面積
+])
+
+# サクランボ1個分の記録
+def make_record_dtype(n_cameras=len(STORE_CAMERAS)):
+    return np.dtype([
+        ('cherry_id', 'i8'),
+        ('first_seen', 'f8'),       # 最初に見えた時刻（UNIX時刻）
+        ('decided', 'f8'),          # 判定した時刻（UNIX時刻、未判定は 0）
+        ('decision_ms', 'f4'),      # 見えてから判定までの時間
+        ('label', 'i2'),            # 判定クラス番号（-1 = 判定なし）
+        ('confidence', 'f4'),       # 統合確率
+        ('reason', 'u1'),           # 判定理由（REASON_CODES）
+        ('views', VIEW_DTYPE, (n_cameras,)),
+    ])
+
+# ==========================================================
+# 判定記録ストアクラス
+# ==========================================================
+class CherryStore:
+    """
+    >>> 追記専用の判定記録。書き込み中のチャンクは memmap、満杯になったら NPZ に書き出す
+    - 1行 = サクランボ1個（時刻、判定、カメラごとのクラス・信頼度・切り出し位置）
+    - index.json に各チャンクの時刻・ID範囲とラベル別件数を持ち、期間検索で不要なチャンクを読まない
+    - 異常終了で残った memmap は、次回起動時に書き込み済みの行だけ NPZ に書き出して回収する
+    """
+    def __init__(self, folder=STORE_DIR, cameras=STORE_CAMERAS, label_names=None, chunk_rows=STORE_CHUNK_ROWS):
+        self.folder = folder
+        self.cameras = tuple(cameras)
+        self.chunk_rows = chunk_rows
+        self.dtype = make_record_dtype(len(self.cameras))
+        os.makedirs(folder, exist_ok=True)
+
+        self.index = self._load_index()
+        if label_names is not None:
+            self.index["label_names"] = {str(k): v for k, v in dict(label_names).items()}
+        self.index["cameras"] = list(self.cameras)
+        self._label_ids = {name: int(k) for k, name in self.index["label_names"].items()}
+
+        self.chunk = None               # 書き込み中の memmap
+        self.chunk_path = None
+        self.count = 0
+
+        self._recover()
+        self._save_index()
+
+    # --- インデックスを読み込む内部関数 -------------------
+    def _load_index(self):
+        path = os.path.join(self.folder, INDEX_FILE)
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return {"label_names": {}, "cameras": [], "chunks": []}
+
+    def _save_index(self):
+        path = os.path.join(self.folder, INDEX_FILE)
+        tmp = path + ".tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(self.index, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, path)
+
+    # --- 前回の書き込み途中の memmap を回収する内部関数 -------------------
+    def _recover(self):
+        for path in sorted(glob.glob(os.path.join(self.folder, "chunk_*.dat"))):
+            rows = np.memmap(path, dtype=self.dtype, mode='r')
+            count = int(np.count_nonzero(rows['cherry_id']))    # ID は1から振るので 0 は未使用行
+            records = np.array(rows[:count])
+            del rows
+            if count:
+                self._write_npz(path, records)
+                print(f"判定記録: 前回の書き込み途中のチャンクを回収しました ({count} 行)")
+            os.remove(path)
+
+    # --- 新しいチャンクを作る内部関数 -------------------
+    def _open_chunk(self):
+        stamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        self.chunk_path = os.path.join(self.folder, f"chunk_{stamp}.dat")
+        self.chunk = np.memmap(self.chunk_path, dtype=self.dtype, mode='w+', shape=(self.chunk_rows,))
+        self.count = 0
+
+    # --- 1個分の記録を追加する関数 -------------------
+    def append(self, cherry):
+        """cherry: module_yolo_csv.CherryState（画面外に出て記録が揃ったもの）"""
+        if self.chunk is None:
+            self._open_chunk()
+        row = self.chunk[self.count]
+        row['cherry_id'] = cherry.cherry_id
+        row['first_seen'] = cherry.first_seen_at or 0.0
+        row['views'] = np.zeros(len(self.cameras), dtype=VIEW_DTYPE)
+        row['views']['label'] = -1
+
+        decision = cherry.decision
+        if decision is not None:
+            row['decided'] = cherry.decided_at or 0.0
+            row['decision_ms'] = decision.decision_ms or 0.0
+            row['label'] = self._label_id(decision.label_name)
+            row['confidence'] = decision.confidence
+            row['reason'] = REASON_CODES.get(decision.reason, 0)
+        else:
+            row['label'] = -1
+
+        for i, cam_name in enumerate(self.cameras):
+            detail = cherry.view_detail.get(cam_name)
+            if detail is None:
+                continue
+            view = row['views'][i]
+            view['frames'] = detail["frames"]
+            view['label'] = self._label_id(detail["label"]) if detail["label"] else -1
+            view['conf'] = detail["conf"]
+            target = detail["target"]
+            if target is not None:
+                view['mx'], view['my'] = target['mx'], target['my']
+                view['x'], view['y'], view['w'], view['h'], view['area'] = target['stat'][:5]
+
+        self.count += 1
+        if self.count >= self.chunk_rows:
+            self.rollover()
+
+    # --- ラベル名 → クラス番号（未知のラベルは追加） -------------------
+    def _label_id(self, label_name):
+        if label_name not in self._label_ids:
+            new_id = max(self._label_ids.values(), default=-1) + 1
+            self._label_ids[label_name] = new_id
+            self.index["label_names"][str(new_id)] = label_name
+        return self._label_ids[label_name]
+
+    # --- 書き込み中のチャンクを NPZ に書き出す関数 -------------------
+    def rollover(self):
+        if self.chunk is None:
+            return
+        records = np.array(self.chunk[:self.count])
+        path = self.chunk_path
+        self.chunk.flush()
+        self.chunk = None
+        if self.count:
+            self._write_npz(path, records)
+        os.remove(path)
+        self._save_index()
+
+    def _write_npz(self, dat_path, records):
+        npz_path = os.path.splitext(dat_path)[0] + ".npz"
+        np.savez_compressed(npz_path, records=records)
+        decided = records['label'] >= 0
+        labels, counts = np.unique(records['label'][decided], return_counts=True)
+        self.index["chunks"].append({
+            "file": os.path.basename(npz_path),
+            "rows": int(len(records)),
+            "id_min": int(records['cherry_id'].min()),
+            "id_max": int(records['cherry_id'].max()),
+            "t_min": float(records['first_seen'].min()),
+            "t_max": float(records['first_seen'].max()),
+            "label_counts": {str(int(k)): int(v) for k, v in zip(labels, counts)},
+        })
+
+    # --- 期間・ラベルで検索する関数 -------------------
+    def query(self, t_from=None, t_to=None, label_name=None):
+        """
+        first_seen が [t_from, t_to) の記録を構造化配列で返す（t は UNIX時刻または datetime）
+        インデックスの時刻範囲・ラベルが合わないチャンクは読まない（書き込み中のチャンクも対象に含める）
+        """
+        t_from = t_from.timestamp() if isinstance(t_from, datetime.datetime) else t_from
+        t_to = t_to.timestamp() if isinstance(t_to, datetime.datetime) else t_to
+        label = self._label_ids.get(label_name) if label_name is not None else None
+        if label_name is not None and label is None:
+            return np.empty(0, dtype=self.dtype)
+
+        parts = []
+        for chunk in self.index["chunks"]:
+            if t_from is not None and chunk["t_max"] < t_from:
+                continue
+            if t_to is not None and chunk["t_min"] >= t_to:
+                continue
+            if label is not None and str(label) not in chunk["label_counts"]:
+                continue
+            with np.load(os.path.join(self.folder, chunk["file"])) as data:
+                parts.append(data["records"])
+        if self.chunk is not None and self.count:
+            parts.append(np.array(self.chunk[:self.count]))
+        if not parts:
+            return np.empty(0, dtype=self.dtype)
+
+        records = np.concatenate(parts)
+        mask = np.ones(len(records), dtype=bool)
+        if t_from is not None:
+            mask &= records['first_seen'] >= t_from
+        if t_to is not None:
+            mask &= records['first_seen'] < t_to
+        if label is not None:
+            mask &= records['label'] == label
+        return records[mask]
+
+    # --- 期間内のラベル別件数を返す関数（チャンク全体が期間内ならインデックスだけで数える） -------------------
+    def count_labels(self, t_from=None, t_to=None):
+        t_from = t_from.timestamp() if isinstance(t_from, datetime.datetime) else t_from
+        t_to = t_to.timestamp() if isinstance(t_to, datetime.datetime) else t_to
+        label_counts = {}
+
+        def add(label, n):
+            name = self.index["label_names"].get(str(label), str(label))
+            label_counts[name] = label_counts.get(name, 0) + n
+
+        def add_records(records):
+            mask = records['label'] >= 0
+            if t_from is not None:
+                mask &= records['first_seen'] >= t_from
+            if t_to is not None:
+                mask &= records['first_seen'] < t_to
+            labels, counts = np.unique(records['label'][mask], return_counts=True)
+            for label, n in zip(labels, counts):
+                add(int(label), int(n))
+
+        for chunk in self.index["chunks"]:
+            if (t_from is not None and chunk["t_max"] < t_from) or (t_to is not None and chunk["t_min"] >= t_to):
+                continue
+            if (t_from is None or chunk["t_min"] >= t_from) and (t_to is None or chunk["t_max"] < t_to):
+                for label, n in chunk["label_counts"].items():
+                    add(label, n)
+            else:
+                # 期間の境界にかかるチャンクだけ実際に読んで数える
+                with np.load(os.path.join(self.folder, chunk["file"])) as data:
+                    add_records(data["records"])
+        if self.chunk is not None and self.count:
+            add_records(np.array(self.chunk[:self.count]))
+        return label_counts
+
+    def close(self):
+        self.rollover()
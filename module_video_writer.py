@@ -0,0 +1,673 @@
+# -------------------------------------------------
+# 動画エンコードを取得スレッドから切り離して行うプログラムmodule
+# -------------------------------------------------
+import os
+import csv
+import glob
+import time
+import threading
+from collections import deque
+
+import cv2
+import numpy as np
+
+# ==========================================================
+# 定数定義
+# ==========================================================
+WRITER_QUEUE_SIZE = 8           # エンコード待ちフレームの上限数（= 事前確保バッファ数）
+
+# キューが満杯のときの扱い
+DROP_OLDEST = "drop_oldest"     # 最も古い待ちフレームを捨てて新しいフレームを入れる
+DROP_NEWEST = "drop_newest"     # 新しいフレームを捨てる（待ちフレームはそのまま）
+BLOCK = "block"                 # 捨てずに空きができるまで待つ（録画済み動画の再評価など、取りこぼしたくない場合）
+
+# 分割録画の設定（segment_seconds / segment_bytes を指定した場合）
+SEGMENT_SECONDS = 60.0          # 1ファイルの長さ（秒、フレームの撮影時刻で測る）
+SEGMENT_MAX_BYTES = None        # 1ファイルの最大サイズ（バイト、None で無制限）
+SEGMENT_SIZE_CHECK_FRAMES = 20  # ファイルサイズを確認する間隔（フレーム数）
+INDEX_SUFFIX = "_index.csv"     # 分割ファイルの索引（"元のファイル名_index.csv"）
+INDEX_HEADER = ["file", "segment", "offset", "first_frame", "frames", "start_time", "end_time"]
+SEGMENT_RUN_GAP_FACTOR = 1.8    # 書き込んだフレームの時刻が実測のフレーム間隔のこの倍数以上空いたら（取りこぼし）索引の行を分ける
+FRAME_INTERVAL_WINDOW = 31      # フレーム間隔の実測に使う直近の間隔の数（中央値を採る）
+FRAME_INTERVAL_MIN_SAMPLES = 5  # この数の間隔を測るまでは取りこぼしと判定しない
+
+# ディスク容量の管理
+DISK_QUOTA_GB = 200.0           # 録画フォルダ全体の上限（超えたら古いファイルから削除）
+JANITOR_INTERVAL_SEC = 30.0     # 容量を確認する間隔
+JANITOR_EXTS = (".avi", ".mp4")
+
+# イベント録画（サクランボ1個ごとのクリップ）の設定
+CLIP_PRE_ROLL_SEC = 1.0         # 最初に見えた時刻より前に含める秒数
+CLIP_POST_ROLL_SEC = 1.0        # 判定時刻より後に含める秒数
+CLIP_RING_SECONDS = 5.0         # メモリ上に保持する秒数（前ロール + 通過時間 + 後ロールを覆う長さ）
+CLIP_MEMORY_LIMIT_MB = 256      # カメラ1台あたりのリング上限（収まらない場合は保持秒数が短くなる）
+CLIP_QUEUE_SIZE = 8             # 書き出し待ちクリップの上限（満杯なら古い依頼を捨てる）
+CLIP_ARRIVAL_MARGIN_SEC = 0.2   # 終了時刻の後、その時刻までに撮影したフレームがリングに届くまで待つ秒数
+
+# 書き込み中のファイル（容量管理で削除しない）
+_active_files = set()
+_active_lock = threading.Lock()
+
+def _set_active(path, active):
+    with _active_lock:
+        if active:
+            _active_files.add(os.path.abspath(path))
+        else:
+            _active_files.discard(os.path.abspath(path))
+
+def is_active_file(path):
+    with _active_lock:
+        return os.path.abspath(path) in _active_files
+
+# ==========================================================
+# エンコード前の形式変換（BGR変換・リサイズ）を行う関数
+# ==========================================================
+def prepare_frame(frame, convert_code, frame_size):
+    if convert_code is not None:
+        frame = cv2.cvtColor(frame, convert_code)
+    elif len(frame.shape) == 2:   # モノクロの場合
+        frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+    w, h = frame_size
+    if frame.shape[:2] != (h, w):
+        frame = cv2.resize(frame, (w, h))
+    return frame
+
+# ==========================================================
+# フレームの撮影時刻から実際のフレーム間隔を測るクラス
+# ==========================================================
+class FrameIntervalMeter:
+    """
+    >>> 直近 FRAME_INTERVAL_WINDOW 個のフレーム間隔の中央値を、実際のフレーム間隔（秒）とする
+    - 測れるまでは公称FPSの間隔を返す
+    - 取りこぼし（gap_factor 倍以上の間隔）も窓には入れる（中央値なので時々の取りこぼしでは動かず、
+      実際のフレームレートが変わった場合は窓の半分が入れ替わった時点で追従する）
+    """
+    def __init__(self, fps, gap_factor=SEGMENT_RUN_GAP_FACTOR, window=FRAME_INTERVAL_WINDOW,
+                 min_samples=FRAME_INTERVAL_MIN_SAMPLES):
+        self.nominal = 1.0 / fps if fps else None
+        self.gap_factor = gap_factor
+        self.min_samples = min_samples
+        self.intervals = deque(maxlen=window)
+        self.interval = self.nominal
+        self.last_time = None
+
+    # --- 撮影時刻を1つ加え、直前のフレームから取りこぼしがあったかを返す関数 -------------------
+    def update(self, timestamp):
+        gap = False
+        if self.last_time is not None:
+            delta = timestamp - self.last_time
+            gap = len(self.intervals) >= self.min_samples and delta >= self.gap_factor * self.interval
+            if delta > 0:
+                self.intervals.append(delta)
+                self.interval = float(np.median(self.intervals))
+        self.last_time = timestamp
+        return gap
+
+    @property
+    def fps(self):
+        return 1.0 / self.interval if self.interval else None
+
+# ==========================================================
+# 専用スレッドで cv2.VideoWriter に書き込むクラス
+# ==========================================================
+class VideoWriterWorker:
+    """
+    >>> 1ファイル分のエンコード処理を受け持つワーカー
+    - submit() は空きバッファへコピーしてキューに積むだけなので取得ループを待たせない
+    - キューが満杯のときは drop_policy に従ってフレームを捨て、frames_dropped に数える
+    - リサイズ・BGR変換（デモザイク含む）などの前処理もワーカースレッド側で行う
+    - segment_seconds / segment_bytes を指定すると "元の名前_0000.avi" のように分割して書き、
+      "元の名前_index.csv" に各ファイルの先頭フレーム番号・フレーム数・時刻範囲を記録する
+    - 取りこぼしで時刻が飛んだ箇所では索引の行を分ける（1行 = 時刻が連続した区間、offset はファイル内の開始位置）
+    - 取りこぼしの判定・ファイルの長さは submit() に渡された撮影時刻で測る（公称FPSは実測できるまでの初期値）
+    """
+    def __init__(self, filename, codec, fps, frame_size,
+                 queue_size=WRITER_QUEUE_SIZE, drop_policy=DROP_OLDEST, name="", convert_code=None,
+                 segment_seconds=None, segment_bytes=None):
+        self.filename = filename
+        self.codec = codec
+        self.fps = fps
+        self.frame_size = frame_size    # (幅, 高さ)
+        self.queue_size = queue_size
+        self.drop_policy = drop_policy
+        self.name = name
+        self.convert_code = convert_code    # BGR変換コード（Bayer・RGBの生フレームを受け取る場合）
+
+        # 分割録画
+        self.segmented = bool(segment_seconds or segment_bytes)
+        self.segment_seconds = segment_seconds
+        self.segment_bytes = segment_bytes
+        self.segment_no = -1
+        self.segment_path = filename    # 書き込み中のファイル
+        self.segment_count = 0          # 書き込み中のファイルのフレーム数
+        self.segment_start_time = None  # 書き込み中のファイルの先頭フレームの時刻
+        self.interval_meter = FrameIntervalMeter(fps)
+        # 索引の1行分（時刻が連続した区間）
+        self.run_offset = 0             # 区間の先頭のファイル内フレーム位置
+        self.run_first_frame = 0        # 区間の先頭の通しフレーム番号
+        self.run_count = 0
+        self.run_start_time = None
+        self.run_end_time = None
+        stem, self.ext = os.path.splitext(filename)
+        self.stem = stem
+        self.index_path = stem + INDEX_SUFFIX
+
+        self.writer = None
+        self.thread = None
+        self.is_running = False
+
+        # 統計用カウンタ
+        self.frames_submitted = 0
+        self.frames_written = 0
+        self.frames_dropped = 0
+
+        self._cond = threading.Condition()
+        self._pending = deque()         # エンコード待ちのバッファ
+        self._free = []                 # 空きバッファ
+        self._allocated = 0             # 確保済みバッファ数
+
+    # --- VideoWriterを開いてワーカースレッドを起動する関数 -------------------
+    def start(self):
+        if self.segmented:
+            with open(self.index_path, 'w', newline='', encoding='utf-8') as f:
+                csv.writer(f).writerow(INDEX_HEADER)
+        if not self._open_writer():
+            return False
+
+        self.is_running = True
+        self.thread = threading.Thread(target=self._write_loop, daemon=True)
+        self.thread.start()
+        return True
+
+    # --- 次の書き込み先ファイルを開く内部関数 -------------------
+    def _open_writer(self):
+        if self.segmented:
+            self.segment_no += 1
+            self.segment_path = f"{self.stem}_{self.segment_no:04d}{self.ext}"
+            self.segment_count = 0
+            self.segment_start_time = None
+            self._start_run()
+        fourcc = cv2.VideoWriter_fourcc(*self.codec)
+        self.writer = cv2.VideoWriter(self.segment_path, fourcc, self.fps, self.frame_size)
+        if not self.writer.isOpened():
+            print(f"エラー: VideoWriterの作成に失敗しました ({self.segment_path})")
+            self.writer = None
+            return False
+        _set_active(self.segment_path, True)
+        return True
+
+    # --- 書き込み中のファイルを閉じて索引に記録する内部関数 -------------------
+    def _close_writer(self):
+        if self.writer is None:
+            return
+        self.writer.release()
+        self.writer = None
+        _set_active(self.segment_path, False)
+        if self.segmented:
+            self._write_index_row()
+
+    # --- 索引の区間を書き込み位置から始め直す内部関数 -------------------
+    def _start_run(self):
+        self.run_offset = self.segment_count
+        self.run_first_frame = self.frames_written
+        self.run_count = 0
+        self.run_start_time = None
+        self.run_end_time = None
+
+    # --- 書き込み済みの区間を索引に1行記録する内部関数 -------------------
+    def _write_index_row(self):
+        if self.run_count == 0:
+            return
+        try:
+            with open(self.index_path, 'a', newline='', encoding='utf-8') as f:
+                csv.writer(f).writerow([os.path.basename(self.segment_path), self.segment_no,
+                                        self.run_offset, self.run_first_frame, self.run_count,
+                                        f"{self.run_start_time:.3f}", f"{self.run_end_time:.3f}"])
+        except OSError as e:
+            print(f"索引書き込みエラー ({self.index_path}): {e}")
+
+    # --- 分割条件を満たしたら次のファイルに切り替える内部関数 -------------------
+    def _rotate_if_needed(self, timestamp):
+        if not self.segmented or self.segment_count == 0:
+            return
+        full = (self.segment_seconds is not None
+                and timestamp - self.segment_start_time >= self.segment_seconds)
+        if (not full and self.segment_bytes
+                and self.segment_count % SEGMENT_SIZE_CHECK_FRAMES == 0
+                and os.path.getsize(self.segment_path) >= self.segment_bytes):
+            full = True
+        if full:
+            self._close_writer()
+            self._open_writer()
+
+    # --- 書き込み用バッファを1つ取得する内部関数（ロック内で呼ぶ） -------------------
+    def _acquire_buffer(self, frame):
+        if self._free:
+            return self._free.pop()
+        if self._allocated < self.queue_size:
+            self._allocated += 1
+            return np.empty_like(frame)
+        if self.drop_policy == BLOCK:
+            while self.is_running and not self._free:
+                self._cond.wait()
+            return self._free.pop() if self._free else None
+        if self.drop_policy == DROP_OLDEST and self._pending:
+            self.frames_dropped += 1
+            return self._pending.popleft()[0]
+        self.frames_dropped += 1
+        return None
+
+    # --- フレームをエンコード待ちキューに積む関数（取得スレッドから呼ぶ） -------------------
+    def submit(self, frame, timestamp=None):
+        """timestamp: フレームの撮影時刻（UNIX時刻、省略時は現在時刻。分割録画の索引・ファイルの長さ・取りこぼしの判定に使う）"""
+        if timestamp is None:
+            timestamp = time.time()
+        with self._cond:
+            if not self.is_running:
+                return False
+            self.frames_submitted += 1
+            buf = self._acquire_buffer(frame)
+        if buf is None:
+            return False
+
+        # バッファはどのリストにも属していないのでロック外でコピーしてよい
+        if buf.shape != frame.shape or buf.dtype != frame.dtype:
+            buf = np.empty_like(frame)
+        np.copyto(buf, frame)
+
+        with self._cond:
+            self._pending.append((buf, timestamp))
+            self._cond.notify()
+        return True
+
+    # --- 書き込みループ（ワーカースレッド） -------------------
+    def _write_loop(self):
+        while True:
+            with self._cond:
+                while self.is_running and not self._pending:
+                    self._cond.wait()
+                if not self._pending:   # 停止要求かつ待ちフレームなし
+                    break
+                buf, timestamp = self._pending.popleft()
+
+            written = False
+            try:
+                gap = self.interval_meter.update(timestamp)
+                self._rotate_if_needed(timestamp)
+                # 取りこぼしで時刻が飛んだら索引の行を分ける（再評価でカメラ間を時刻で揃えるため）
+                if self.segmented and self.run_count > 0 and gap:
+                    self._write_index_row()
+                    self._start_run()
+                if self.writer is not None:
+                    self.writer.write(self._prepare(buf))
+                    written = True
+                    self.segment_count += 1
+                    if self.segment_start_time is None:
+                        self.segment_start_time = timestamp
+                    self.run_count += 1
+                    if self.run_start_time is None:
+                        self.run_start_time = timestamp
+                    self.run_end_time = timestamp
+            except Exception as e:
+                print(f"Writer Error ({self.name}): {e}")
+
+            with self._cond:
+                self._free.append(buf)
+                if written:
+                    self.frames_written += 1
+                if self.drop_policy == BLOCK:
+                    self._cond.notify_all()     # 空き待ちの submit() を起こす
+
+    # --- エンコード前の形式変換を行う内部関数 -------------------
+    def _prepare(self, frame):
+        return prepare_frame(frame, self.convert_code, self.frame_size)
+
+    # --- 待ちフレームを書き出してから停止する関数 -------------------
+    def stop(self):
+        with self._cond:
+            self.is_running = False
+            self._cond.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self._close_writer()
+
+    # --- 統計情報を返す関数 -------------------
+    def get_stats(self):
+        with self._cond:
+            return {
+                "submitted": self.frames_submitted,
+                "written": self.frames_written,
+                "dropped": self.frames_dropped,
+                "pending": len(self._pending),
+                "segments": self.segment_no + 1 if self.segmented else 1,
+                "measured_fps": self.interval_meter.fps,
+            }
+
+# ==========================================================
+# 分割録画の索引を読む関数
+# ==========================================================
+def load_segment_index(index_path):
+    """索引の行を辞書のリストで返す（容量管理で削除済みのファイルは除く）"""
+    folder = os.path.dirname(index_path)
+    rows = []
+    try:
+        with open(index_path, 'r', newline='', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                path = os.path.join(folder, row["file"])
+                if not os.path.exists(path):
+                    continue
+                rows.append({
+                    "path": path,
+                    "segment": int(row["segment"]),
+                    "offset": int(row.get("offset") or 0),
+                    "first_frame": int(row["first_frame"]),
+                    "frames": int(row["frames"]),
+                    "start_time": float(row["start_time"]),
+                    "end_time": float(row["end_time"]),
+                })
+    except OSError as e:
+        print(f"索引読み込みエラー ({index_path}): {e}")
+    return rows
+
+def find_segment(index_path, wall_time=None, frame_no=None):
+    """
+    時刻（UNIX時刻）または通しフレーム番号から (ファイルパス, ファイル内のフレーム位置) を返す
+    時刻の場合は区間内を等間隔とみなして位置を求める。見つからなければ None
+    """
+    for row in load_segment_index(index_path):
+        if frame_no is not None:
+            if row["first_frame"] <= frame_no < row["first_frame"] + row["frames"]:
+                return row["path"], row["offset"] + frame_no - row["first_frame"]
+        elif wall_time is not None and row["start_time"] <= wall_time <= row["end_time"]:
+            span = row["end_time"] - row["start_time"]
+            offset = int(round((wall_time - row["start_time"]) / span * (row["frames"] - 1))) if span > 0 else 0
+            return row["path"], row["offset"] + offset
+    return None
+
+# ==========================================================
+# 録画フォルダの容量を管理するクラス
+# ==========================================================
+class DiskJanitor:
+    """
+    >>> 録画フォルダ以下の動画ファイルの合計が上限を超えたら、古いファイルから削除する
+    - 書き込み中のファイルは削除しない
+    - 専用スレッドで JANITOR_INTERVAL_SEC ごとに確認する（取得・エンコードは待たせない）
+    - 動画がすべて消えた索引ファイルも削除する
+    """
+    def __init__(self, root, quota_gb=DISK_QUOTA_GB, interval=JANITOR_INTERVAL_SEC, exts=JANITOR_EXTS):
+        self.root = root
+        self.quota_bytes = int(quota_gb * 1024 ** 3)
+        self.interval = interval
+        self.exts = exts
+        self.files_deleted = 0
+        self.bytes_deleted = 0
+
+        self._stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self._stop_event.clear()
+        self.thread = threading.Thread(target=self._loop, daemon=True)
+        self.thread.start()
+
+    def _loop(self):
+        while not self._stop_event.is_set():
+            try:
+                self.run_once()
+            except OSError as e:
+                print(f"容量管理エラー: {e}")
+            self._stop_event.wait(self.interval)
+
+    # --- 1回分の確認と削除を行う関数 -------------------
+    def run_once(self):
+        files = []
+        for ext in self.exts:
+            files.extend(glob.glob(os.path.join(self.root, "**", f"*{ext}"), recursive=True))
+        entries = []
+        total = 0
+        for path in files:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue    # 確認中に消えたファイル
+            entries.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+        if total <= self.quota_bytes:
+            return []
+
+        deleted = []
+        for _, size, path in sorted(entries):
+            if total <= self.quota_bytes:
+                break
+            if is_active_file(path):
+                continue
+            try:
+                os.remove(path)
+            except OSError as e:
+                print(f"削除できませんでした ({path}): {e}")
+                continue
+            total -= size
+            deleted.append(path)
+            self.files_deleted += 1
+            self.bytes_deleted += size
+        if deleted:
+            print(f"容量管理: 古い録画 {len(deleted)} ファイルを削除しました（残り {total / 1024 ** 3:.1f} GB）")
+            self._remove_orphan_indexes()
+        return deleted
+
+    # --- 動画が残っていない索引を削除する内部関数 -------------------
+    def _remove_orphan_indexes(self):
+        for index_path in glob.glob(os.path.join(self.root, "**", f"*{INDEX_SUFFIX}"), recursive=True):
+            stem = index_path[:-len(INDEX_SUFFIX)]
+            if not any(glob.glob(f"{glob.escape(stem)}_*{ext}") for ext in self.exts):
+                try:
+                    os.remove(index_path)
+                except OSError:
+                    pass
+
+    def stop(self):
+        self._stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+# ==========================================================
+# サクランボごとにクリップを保存するイベント録画クラス
+# ==========================================================
+class ClipRecorder:
+    """
+    >>> 直近 CLIP_RING_SECONDS 秒のフレームをメモリ上のリングに保持し、依頼された時間範囲だけを動画に書き出す
+    - push() は事前確保したスロットへコピーするだけ（取得ループでエンコード・ディスク書き込みをしない）
+    - save() は依頼をキューに積むだけで、書き込みスレッドが終了時刻（後ロール）まで待ってから書き出す
+    - 書き出し中に上書きされたフレームは飛ばし、frames_overwritten に数える
+    - ファイル名は "接頭辞_クリップ名.avi"（クリップ名にサクランボIDを入れてCSVと対応させる）
+    - リングの時刻・クリップの時間範囲はどちらも撮影時刻（グラブタイムスタンプを換算した UNIX時刻）
+    - リングの長さは実測のフレームレートで決める（公称FPSで確保し、実測で足りなければ広げる）
+    """
+    def __init__(self, folder, prefix, codec, fps, frame_size, name="", convert_code=None, ext=".avi",
+                 ring_seconds=CLIP_RING_SECONDS, memory_limit_mb=CLIP_MEMORY_LIMIT_MB, queue_size=CLIP_QUEUE_SIZE):
+        self.folder = folder
+        self.prefix = prefix
+        self.codec = codec
+        self.fps = fps
+        self.frame_size = frame_size    # (幅, 高さ)
+        self.name = name
+        self.convert_code = convert_code    # BGR変換コード（Bayer・RGBの生フレームを受け取る場合）
+        self.ext = ext
+        self.ring_seconds = ring_seconds
+        self.memory_limit = int(memory_limit_mb * 1024 * 1024)
+        self.queue_size = queue_size
+
+        # フレームのリング（初回フレームの形状で確保）
+        self.slots = None
+        self.timestamps = None          # 各スロットの時刻（UNIX時刻）
+        self.capacity = 0
+        self.seq = 0                    # 書き込み済みフレーム数
+        self.lock = threading.Lock()
+        self.interval_meter = FrameIntervalMeter(fps)
+        self.memory_capped = False      # メモリ上限のためリングが ring_seconds に届かない
+
+        self.thread = None
+        self.is_running = False
+        self._cond = threading.Condition()
+        self._pending = deque()         # 書き出し待ちの (クリップ名, 開始時刻, 終了時刻)
+
+        # 統計用カウンタ
+        self.frames_pushed = 0
+        self.frames_written = 0
+        self.frames_overwritten = 0
+        self.clips_saved = 0
+        self.clips_dropped = 0
+        self.bytes_written = 0
+
+    def start(self):
+        self.is_running = True
+        self.thread = threading.Thread(target=self._write_loop, daemon=True)
+        self.thread.start()
+        return True
+
+    # --- 初回フレームに合わせてリングを確保する内部関数 -------------------
+    def _allocate(self, frame):
+        self.capacity = 0
+        self.slots = None
+        self._resize(frame.shape, frame.dtype, frame.nbytes)
+
+    # --- 実測のフレームレートで ring_seconds 分のスロット数に広げる内部関数（ロック内で呼ぶ） -------------------
+    def _resize(self, shape, dtype, frame_bytes):
+        needed = int(np.ceil(self.ring_seconds / self.interval_meter.interval)) + 2
+        capacity = max(2, min(needed, self.memory_limit // frame_bytes))
+        if capacity <= self.capacity:
+            return
+        slots = np.empty((capacity,) + shape, dtype=dtype)
+        timestamps = np.zeros(capacity, dtype=np.float64)
+        # 保持中のフレームはシーケンス番号の位置を保ったまま移す
+        for s in range(max(0, self.seq - self.capacity + 1), self.seq):
+            slots[s % capacity] = self.slots[s % self.capacity]
+            timestamps[s % capacity] = self.timestamps[s % self.capacity]
+        self.slots, self.timestamps, self.capacity = slots, timestamps, capacity
+        self.memory_capped = capacity < needed
+        if self.memory_capped:
+            print(f"警告: {self.name} のクリップ用リングはメモリ上限のため "
+                  f"{(capacity - 1) * self.interval_meter.interval:.1f} 秒分です")
+
+    # --- フレームをリングに追加する関数（取得スレッドのみが呼ぶ） -------------------
+    def push(self, frame, timestamp=None):
+        """timestamp: 撮影時刻（UNIX時刻、省略時は現在時刻）"""
+        if timestamp is None:
+            timestamp = time.time()
+        self.interval_meter.update(timestamp)
+        if self.slots is None or self.slots.shape[1:] != frame.shape or self.slots.dtype != frame.dtype:
+            with self.lock:
+                self.seq = 0
+                self._allocate(frame)
+        elif (not self.memory_capped and len(self.interval_meter.intervals) >= self.interval_meter.min_samples
+              and self.capacity < self.ring_seconds / self.interval_meter.interval + 2):
+            # 実測のフレームレートが公称より高く、保持秒数が足りない
+            with self.lock:
+                self._resize(frame.shape, frame.dtype, frame.nbytes)
+        index = self.seq % self.capacity
+        np.copyto(self.slots[index], frame)
+        self.timestamps[index] = timestamp
+        with self.lock:             # 書き込み完了後にシーケンスを進めて公開
+            self.seq += 1
+            self.frames_pushed += 1
+
+    # --- クリップの書き出しを依頼する関数 -------------------
+    def save(self, clip_name, t_start, t_end):
+        """t_start〜t_end（撮影時刻、UNIX時刻）のフレームを "接頭辞_clip_name" に書き出す（t_end まではリングへの追加を待つ）"""
+        with self._cond:
+            if not self.is_running:
+                return False
+            if len(self._pending) >= self.queue_size:
+                self._pending.popleft()
+                self.clips_dropped += 1
+            self._pending.append((clip_name, t_start, t_end))
+            self._cond.notify()
+        return True
+
+    # --- 書き出しループ（ワーカースレッド） -------------------
+    def _write_loop(self):
+        while True:
+            with self._cond:
+                while self.is_running and not self._pending:
+                    self._cond.wait()
+                if not self._pending:   # 停止要求かつ待ち依頼なし
+                    break
+                clip_name, t_start, t_end = self._pending[0]
+                # 後ロールの終わりのフレームが届くまで待つ（停止要求があればその時点のフレームで書き出す）
+                wait = t_end + CLIP_ARRIVAL_MARGIN_SEC - time.time()
+                if wait > 0 and self.is_running:
+                    self._cond.wait(wait)
+                    continue
+                self._pending.popleft()
+
+            try:
+                self._write_clip(clip_name, t_start, t_end)
+            except Exception as e:
+                print(f"Clip Error ({self.name}): {e}")
+
+    # --- リングから時間範囲のフレームを取り出して書き出す内部関数 -------------------
+    def _write_clip(self, clip_name, t_start, t_end):
+        with self.lock:
+            if self.slots is None:
+                return
+            # リングを広げても古い配列の内容は上書きされないので、確認時点の配列を使う
+            slots, capacity = self.slots, self.capacity
+            first = max(0, self.seq - capacity + 1)     # 書き込み中のスロットは除く
+            seqs = [s for s in range(first, self.seq)
+                    if t_start <= self.timestamps[s % capacity] <= t_end]
+        if not seqs:
+            print(f"クリップなし ({self.name}): {clip_name} の時間範囲のフレームがリングに残っていません")
+            return
+
+        path = os.path.join(self.folder, f"{self.prefix}_{clip_name}{self.ext}")
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*self.codec), self.fps, self.frame_size)
+        if not writer.isOpened():
+            print(f"エラー: VideoWriterの作成に失敗しました ({path})")
+            return
+        _set_active(path, True)
+        scratch = np.empty_like(slots[0])
+        written = 0
+        try:
+            for s in seqs:
+                np.copyto(scratch, slots[s % capacity])
+                with self.lock:
+                    valid = self.seq - s < capacity     # コピー中に上書きされていないか確認
+                if not valid:
+                    self.frames_overwritten += 1
+                    continue
+                writer.write(prepare_frame(scratch, self.convert_code, self.frame_size))
+                written += 1
+        finally:
+            writer.release()
+            _set_active(path, False)
+        self.frames_written += written
+        self.clips_saved += 1
+        self.bytes_written += os.path.getsize(path)
+
+    # --- 待ち依頼を書き出してから停止する関数 -------------------
+    def stop(self):
+        with self._cond:
+            self.is_running = False
+            self._cond.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    # --- 統計情報を返す関数 -------------------
+    def get_stats(self):
+        with self.lock:
+            pushed = self.frames_pushed
+        with self._cond:
+            return {
+                "pushed": pushed,
+                "written": self.frames_written,
+                "overwritten": self.frames_overwritten,
+                "clips": self.clips_saved,
+                "clips_dropped": self.clips_dropped,
+                "pending": len(self._pending),
+                "ring_seconds": (self.capacity - 1) * self.interval_meter.interval if self.capacity else 0.0,
+                "measured_fps": self.interval_meter.fps,
+                "bytes": self.bytes_written,
+            }
@@ -3,117 +3,767 @@ import numpy as np
 import datetime
 import os
 import csv
+import time
+import threading
+from collections import deque
 from ultralytics import YOLO
 
+from module_cherry_store import CherryStore, STORE_DIR
+from module_video_writer import VideoWriterWorker, DROP_OLDEST, BLOCK
+
 # ==========================================================
 # 定数定義
 # ==========================================================
 # 動作設定
 USE_CROP = True                 # ダイナミッククロップを使用するか
+CROP_SCALE = 1.5                # クロップの一辺 = 外接矩形の長辺 × この倍率
 CENTER_THRESHOLD_X = 50          # クロップを発動する中心からの許容ピクセル幅
 
+# ターゲット抽出の探索窓設定（前フレームの位置周辺だけを処理する）
+USE_SEARCH_WINDOW = True        # 探索窓を使用するか
+SEARCH_WINDOW_SCALE = 2.0       # 前フレームの外接矩形に対する探索窓の倍率
+SEARCH_WINDOW_MARGIN = 40       # 探索窓に加える余白（ピクセル）
+
+# ピラミッド（縮小）セグメンテーション設定
+SEGMENT_SCALE = 1               # 1: 原寸 / 2: 1/2 / 4: 1/4 に縮小してマスク抽出（結果は原寸座標に戻す）
+MORPH_KERNEL_SIZE = 5           # 原寸でのモルフォロジーカーネルサイズ
+MIN_TARGET_AREA = 500           # 原寸でのターゲット最小面積（ピクセル）
+
+# マスク抽出の色範囲（OpenCVのHSV: H 0-179, S 0-255, V 0-255）。複数指定した場合は和集合
+HSV_RANGES = [
+    ((10, 40, 120), (179, 255, 255)),
+]
+
+# 在否ゲート設定（サクランボのいない静止画面ではマスク抽出・推論を省略する）
+USE_PRESENCE_GATE = True        # 在否ゲートを使用するか
+GATE_SIZE = (80, 60)            # 比較用に縮小するサイズ（横, 縦）
+GATE_PIXEL_THRESHOLD = 20       # 背景との輝度差がこれを超えた画素を「変化あり」とする
+GATE_CHANGED_RATIO = 0.003      # 変化画素の割合がこれ以上ならマスク抽出を行う
+GATE_BG_ALPHA = 0.05            # 背景の更新率（空と判定したフレームで少しずつ追従させる）
+
 # YOLO設定
 MODEL_PATH = "Trained_Models/best.pt"
 YOLO_IMG_SIZE = 320             # 推論およびアノテーション画像のサイズ
+
+# 推論バックエンド（"pytorch": .pt をそのまま / "onnx": ONNX Runtime / "openvino": OpenVINO IR）
+# onnx・openvino は初回に .pt から YOLO_IMG_SIZE で書き出し、以降は書き出し済みモデルを読み込む
+# （onnxruntime / openvino パッケージが必要）
+INFERENCE_BACKEND = "pytorch"
+BACKEND_CHOICES = ("pytorch", "onnx", "openvino")
+EXPORT_DYNAMIC_BATCH = True     # 書き出しモデルをバッチ可変にする（evaluate_frames のバッチ推論用）
 CONF_THRESHOLD = 0.5            # 推論の信頼度閾値
 
+# トラッカー設定（カメラごとのセグメンテーション結果による追跡）
+TRACK_IOU_THRESHOLD = 0.3       # 前フレームの外接矩形とのIoUがこれ以上なら同一物体
+TRACK_MAX_DISTANCE = 80         # または中心の移動量（ピクセル）がこれ以下なら同一物体
+TRACK_MAX_MISSED = 3            # 連続でこのフレーム数を超えて見失ったら追跡終了
+
+# 多視点判定（サクランボ1個ごとに各カメラのクラス確率を統合して判定する）
+DECISION_THRESHOLD = 0.90       # 統合確率がこれを超えたら全カメラの結果を待たずに判定
+EXIT_EMPTY_FRAMES = 2           # 全カメラがこのフレーム数連続で未検出なら「完全に画面外」とみなす
+
 # 保存設定
+USE_CHERRY_STORE = True         # サクランボごとの詳細記録（module_cherry_store）を残すか
 SAVE_DIR_VIDEO = "evaluated_videos" # タイル動画の保存先
 SAVE_DIR_CSV = "evaluated_csv"     # CSVの保存先
 FPS = 10.0                      # 保存動画のFPS（実測に合わせて調整してください）
+TILE_QUEUE_SIZE = 4             # 合成待ちタイルの上限数（満杯なら古いタイルを捨てる）
+TILE_BLOCK_WHEN_FULL = False    # True: 捨てずに空きを待つ（録画の再評価など、推論側を待たせてよい場合）
+
+# CSV書き込み設定（書き込みスレッドでまとめて書く）
+CSV_FLUSH_ROWS = 16             # 待ち行数がこれに達したら書き出す
+CSV_FLUSH_INTERVAL_SEC = 1.0    # 最初の待ち行からこの時間が経ったら書き出す
+CSV_DURABILITY = "flush"        # "flush": OSへ渡すまで / "fsync": ディスクへの書き込み完了まで待つ
+CSV_FSYNC_INTERVAL_SEC = 5.0    # "fsync" の場合に fsync を行う最短間隔
 
 # ★追加：4分割画面のサイズ
 TILE_VIDEO_SIZE = (YOLO_IMG_SIZE * 2, YOLO_IMG_SIZE * 2) # (横, 縦)
+# タイル内の配置 {カメラ名: (行, 列)}
+TILE_LAYOUT = {
+    'cam_inside': (0, 0),       # 左上
+    'cam_under': (1, 0),        # 左下
+    'cam_outside': (0, 1),      # 右上
+    'cam_top': (1, 1),          # 右下
+}
+
+# アノテーション描画設定（BGR）
+ANNOTATION_COLORS = [(56, 56, 255), (151, 157, 255), (31, 112, 255), (29, 178, 255), (49, 210, 207), (10, 249, 72)]
+ANNOTATION_FONT_SCALE = 0.5
+
+# ==========================================================
+# 推論バックエンドの書き出し・読み込み
+# ==========================================================
+def get_export_path(model_path, backend):
+    """ultralytics の書き出し先（best.pt → best.onnx / best_openvino_model/）"""
+    stem = os.path.splitext(model_path)[0]
+    if backend == "onnx":
+        return stem + ".onnx"
+    if backend == "openvino":
+        return stem + "_openvino_model"
+    return model_path
+
+def export_model(model_path=MODEL_PATH, backend=INFERENCE_BACKEND, imgsz=YOLO_IMG_SIZE, force=False):
+    """必要なら .pt を指定バックエンド形式に書き出し、読み込むべきパスを返す
+    書き出し済みでも .pt の方が新しければ書き出し直す（imgsz を変えた場合は force=True）"""
+    if backend not in BACKEND_CHOICES:
+        raise ValueError(f"未対応のバックエンドです: {backend} (選択肢: {BACKEND_CHOICES})")
+    if backend == "pytorch":
+        return model_path
+
+    export_path = get_export_path(model_path, backend)
+    if (not force and os.path.exists(export_path)
+            and os.path.getmtime(export_path) >= os.path.getmtime(model_path)):
+        return export_path
+
+    print(f"{model_path} を {backend} 形式で書き出し中 (imgsz={imgsz})...")
+    exported = YOLO(model_path).export(format=backend, imgsz=imgsz, dynamic=EXPORT_DYNAMIC_BATCH, device="cpu")
+    return str(exported) if exported else export_path
+
+def load_model(model_path=MODEL_PATH, backend=INFERENCE_BACKEND):
+    """指定バックエンドのモデルを読み込む（前処理・後処理は ultralytics が .pt と同じく行う）"""
+    path = export_model(model_path, backend)
+    if backend == "pytorch":
+        return YOLO(path)
+    return YOLO(path, task="detect")
+
+def compare_backends(images, model_path=MODEL_PATH, backends=BACKEND_CHOICES, repeat=3):
+    """
+    クロップ画像（YOLO_IMG_SIZE 四方のBGR画像）のリストで各バックエンドの1枚あたりの遅延と、
+    .pt に対する判定の一致率・信頼度の差を計測する
+    戻り値: {バックエンド名: {"median_ms", "p95_ms", "agree", "conf_diff"}}
+    """
+    reference = None
+    report = {}
+    for backend in backends:
+        try:
+            model = load_model(model_path, backend)
+        except Exception as e:     # onnxruntime / openvino が未導入の場合など
+            print(f"[{backend:8s}] 読み込み失敗: {e}")
+            continue
+        model.predict(images[0], imgsz=YOLO_IMG_SIZE, verbose=False, conf=CONF_THRESHOLD)   # ウォームアップ
+
+        latencies = []
+        labels = []
+        for _ in range(repeat):
+            labels = []
+            for img in images:
+                start = time.perf_counter()
+                result = model.predict(img, imgsz=YOLO_IMG_SIZE, verbose=False, conf=CONF_THRESHOLD)[0]
+                latencies.append((time.perf_counter() - start) * 1000)
+                if len(result.boxes) > 0:
+                    box = result.boxes[0]
+                    labels.append((model.names[int(box.cls)], float(box.conf)))
+                else:
+                    labels.append(("None", 0.0))
+
+        if reference is None:
+            reference = labels      # 最初のバックエンド（通常 pytorch）を基準にする
+        agree = sum(a[0] == b[0] for a, b in zip(labels, reference)) / len(labels)
+        conf_diff = float(np.mean([abs(a[1] - b[1]) for a, b in zip(labels, reference)]))
+        report[backend] = {
+            "median_ms": float(np.median(latencies)),
+            "p95_ms": float(np.percentile(latencies, 95)),
+            "agree": agree,
+            "conf_diff": conf_diff,
+        }
+        print(f"[{backend:8s}] 中央値 {report[backend]['median_ms']:6.2f} ms  p95 {report[backend]['p95_ms']:6.2f} ms  "
+              f"一致率 {agree * 100:5.1f} %  信頼度差 {conf_diff:.3f}")
+    return report
+
+# ==========================================================
+# 描画を遅延させたアノテーション画像クラス
+# ==========================================================
+class AnnotatedFrame:
+    """
+    >>> 推論結果の枠・ラベル描画を、画像が取り出されるまで行わないフレーム
+    - 推論時は元画像の参照と検出枠（数値）だけを持ち、render() でリサイズ・描画する
+    - 描画先は呼び出し側のバッファ（タイルの一部など）か、カメラごとに使い回すバッファ
+    - 元画像（image）は render() するまで書き換えないこと
+      （リング・共有メモリなど借りているメモリの場合は、保持する前に snapshot() で自前のバッファへ移す）
+    """
+    def __init__(self, image, boxes=None, names=None, buffer=None):
+        self.image = image              # 推論入力のクロップ（未推論時は元フレーム）
+        self.boxes = boxes              # [[x1, y1, x2, y2, conf, cls], ...]（image の座標）
+        self.names = names              # クラス番号 → ラベル名
+        self.buffer = buffer            # render() の描画先（使い回す）
+        self.shape = (YOLO_IMG_SIZE, YOLO_IMG_SIZE, 3)
+
+    # --- 元画像を自前のバッファへ縮小コピーする関数 -------------------
+    def snapshot(self, out):
+        """元画像を out（タイル1区画分など）へ縮小コピーし、out を参照する AnnotatedFrame を返す（描画はしない）"""
+        h, w = out.shape[:2]
+        src_h, src_w = self.image.shape[:2]
+        if (src_h, src_w) == (h, w):
+            np.copyto(out, self.image)
+        else:
+            cv2.resize(self.image, (w, h), dst=out)
+        boxes = None
+        if self.boxes is not None:
+            boxes = self.boxes.copy()
+            boxes[:, [0, 2]] *= w / src_w
+            boxes[:, [1, 3]] *= h / src_h
+        return AnnotatedFrame(out, boxes, self.names, self.buffer)
+
+    # --- 画像を描画して返す関数 -------------------
+    def render(self, out=None):
+        """out（省略時は使い回しバッファ）に描画して返す。返した配列は次の render() で上書きされる"""
+        if out is None:
+            if self.buffer is None or self.buffer.shape != self.shape:
+                self.buffer = np.empty(self.shape, dtype=np.uint8)
+            out = self.buffer
+        h, w = out.shape[:2]
+        src_h, src_w = self.image.shape[:2]
+        if (src_h, src_w) == (h, w):
+            np.copyto(out, self.image)
+        else:
+            cv2.resize(self.image, (w, h), dst=out)
+
+        if self.boxes is not None:
+            sx, sy = w / src_w, h / src_h
+            for x1, y1, x2, y2, conf, cls in self.boxes:
+                color = ANNOTATION_COLORS[int(cls) % len(ANNOTATION_COLORS)]
+                p1 = (int(x1 * sx), int(y1 * sy))
+                p2 = (int(x2 * sx), int(y2 * sy))
+                cv2.rectangle(out, p1, p2, color, 2)
+                name = self.names[int(cls)] if self.names else str(int(cls))
+                if not name.isascii():      # cv2.putText は日本語を描けないためクラス番号で表示（色で区別）
+                    name = str(int(cls))
+                label = f"{name} {conf:.2f}"
+                cv2.putText(out, label, (p1[0], max(p1[1] - 4, 12)), cv2.FONT_HERSHEY_SIMPLEX,
+                            ANNOTATION_FONT_SCALE, color, 1, cv2.LINE_AA)
+        return out
 
 # ==========================================================
 # 判定結果データクラス
 # ==========================================================
 class YoloResult:
-    def __init__(self, obj_id, label_name, confidence):
+    def __init__(self, obj_id, label_name, confidence, track_id=None):
         self.id = obj_id
         self.label_name = label_name
         self.confidence = confidence
+        self.track_id = track_id        # カメラごとの追跡ID（CentroidTracker）
+        self.decision_ms = None         # 最初に見えてから判定までの時間（確定結果のみ）
+        self.reason = ""                # 判定理由（threshold / all_views / exit / close）
+        self.first_seen_at = None       # 最初に見えた時刻（UNIX時刻、確定結果のみ。クリップ録画の範囲に使う）
+        self.decided_at = None          # 判定した時刻（UNIX時刻、確定結果のみ）
 
     def to_csv_row(self):
-        return [self.id, self.label_name, f"{self.confidence:.2f}"]
+        decision_ms = f"{self.decision_ms:.1f}" if self.decision_ms is not None else ""
+        return [self.id, self.label_name, f"{self.confidence:.2f}", decision_ms, self.reason]
+
+# ==========================================================
+# サクランボ1個分の多視点判定（状態遷移）クラス
+# ==========================================================
+class CherryState:
+    """
+    >>> 収集中 → 判定済み の状態を持ち、カメラごとのクラス確率を届いた順に統合する
+    - カメラごとにクラスの最大信頼度を保持し、クラスごとに noisy-OR で統合
+      （P = 1 - Π(1 - p_カメラ)：どれか1台でも強く見えれば確率が上がる）
+    - 統合確率が DECISION_THRESHOLD を超えた時点、または全カメラ（fusion_cameras）がクラスを1回以上出した時点で判定する
+    - どちらにも達しないまま画面外に出た場合は、それまでの統合確率で判定する
+    """
+    COLLECTING = "collecting"
+    DECIDED = "decided"
+
+    def __init__(self, cherry_id):
+        self.cherry_id = cherry_id
+        self.state = CherryState.COLLECTING
+        self.start_time = None          # 最初にいずれかのカメラで見つかった時刻（perf_counter、フレーム時刻を渡した場合はその時刻）
+        self.first_seen_at = None       # 同上（UNIX時刻、記録用）
+        self.decided_at = None          # 判定した時刻（UNIX時刻、記録用）
+        self.view_probs = {}            # {カメラ名: {ラベル: 最大信頼度}}（検出なしの推論は空の辞書）
+        self.view_detail = {}           # {カメラ名: {"frames", "label", "conf", "target"}}（記録用）
+        self.decision = None
+
+    # --- いずれかのカメラで見つかったことを記録する関数 -------------------
+    def mark_seen(self, now=None):
+        """now: フレームの撮影時刻（UNIX時刻）。録画の再評価ではこれを渡し、判定時間を動画の時間軸で測る"""
+        if self.start_time is None:
+            self.start_time = time.perf_counter() if now is None else now
+            self.first_seen_at = time.time() if now is None else now
+
+    @property
+    def is_seen(self):
+        return self.start_time is not None
+
+    # --- 1カメラ分の推論結果を加える関数 -------------------
+    def add_view(self, cam_name, boxes, names, target=None):
+        probs = self.view_probs.setdefault(cam_name, {})
+        detail = self.view_detail.setdefault(cam_name, {"frames": 0, "label": None, "conf": 0.0, "target": target})
+        detail["frames"] += 1
+        if boxes is None:
+            return
+        for conf, cls in boxes[:, 4:6]:
+            label = names[int(cls)]
+            if conf > probs.get(label, 0.0):
+                probs[label] = float(conf)
+            if conf > detail["conf"]:
+                # このカメラで最も信頼度の高かったフレームのクラスと切り出し位置を残す
+                detail.update(label=label, conf=float(conf), target=target)
+
+    # --- クラスを1回以上出したカメラの集合を返す関数（検出なしの推論だけのカメラは含めない） -------------------
+    def classified_views(self):
+        return {cam_name for cam_name, probs in self.view_probs.items() if probs}
+
+    # --- クラスごとの統合確率を返す関数 -------------------
+    def fused(self):
+        miss = {}
+        for probs in self.view_probs.values():
+            for label, p in probs.items():
+                miss[label] = miss.get(label, 1.0) * (1.0 - p)
+        return {label: 1.0 - m for label, m in miss.items()}
+
+    # --- 判定条件を満たしていれば判定する関数 -------------------
+    def try_decide(self, expected_views, force_reason=None, now=None):
+        """判定したら YoloResult を返す（判定済み・判定材料なしの場合は None）
+        now: フレームの撮影時刻（mark_seen と同じく、渡す場合は毎回渡す）"""
+        if self.state == CherryState.DECIDED:
+            return None
+        fused = self.fused()
+        if not fused:
+            return None     # どのカメラでもクラスが出ていない
+        label, prob = max(fused.items(), key=lambda x: x[1])
+
+        if force_reason:
+            reason = force_reason
+        elif prob >= DECISION_THRESHOLD:
+            reason = "threshold"
+        elif expected_views and set(expected_views) <= self.classified_views():
+            reason = "all_views"
+        else:
+            return None
+
+        self.state = CherryState.DECIDED
+        self.decided_at = time.time() if now is None else now
+        self.decision = YoloResult(self.cherry_id, label, prob)
+        self.decision.reason = reason
+        elapsed = (time.perf_counter() if now is None else now) - self.start_time if self.start_time else None
+        self.decision.decision_ms = elapsed * 1000 if elapsed is not None else None
+        self.decision.first_seen_at = self.first_seen_at
+        self.decision.decided_at = self.decided_at
+        return self.decision
+
+# ==========================================================
+# CSVを専用スレッドでまとめて書き込むクラス
+# ==========================================================
+class CsvWriterWorker:
+    """
+    >>> CSVの行をメモリ上のキューに積み、書き込みスレッドがまとめて書き出す
+    - write_row() はキューに積むだけなので、ファイルシステムが遅くても推論側を待たせない
+    - CSV_FLUSH_ROWS 行たまるか、最初の行から CSV_FLUSH_INTERVAL_SEC 経ったら書き出す
+    - durability="fsync" の場合は CSV_FSYNC_INTERVAL_SEC ごとに fsync してディスクまで書く
+    - close() で待ち行をすべて書き出してからファイルを閉じる
+    """
+    def __init__(self, path, header=None, flush_rows=CSV_FLUSH_ROWS, flush_interval=CSV_FLUSH_INTERVAL_SEC,
+                 durability=CSV_DURABILITY, fsync_interval=CSV_FSYNC_INTERVAL_SEC):
+        self.path = path
+        self.flush_rows = flush_rows
+        self.flush_interval = flush_interval
+        self.durability = durability
+        self.fsync_interval = fsync_interval
+
+        self.rows_written = 0
+        self.flushes = 0
+        self.errors = 0
+
+        self._cond = threading.Condition()
+        self._pending = deque()
+        self._first_pending_time = None
+        self._last_fsync = 0.0
+        self.is_running = True
+
+        self._file = open(path, 'w', newline='', encoding='utf-8')
+        self._writer = csv.writer(self._file)
+        if header:
+            self._writer.writerow(header)
+            self._file.flush()
+        self.thread = threading.Thread(target=self._write_loop, daemon=True)
+        self.thread.start()
+
+    # --- 1行をキューに積む関数（推論スレッドから呼ぶ） -------------------
+    def write_row(self, row):
+        with self._cond:
+            if not self.is_running:
+                return False
+            if not self._pending:
+                # 最初の行で起こし、書き込みスレッドに時間での書き出しを待たせる
+                self._first_pending_time = time.monotonic()
+                self._cond.notify()
+            self._pending.append(row)
+            if len(self._pending) >= self.flush_rows:
+                self._cond.notify()
+        return True
+
+    # --- 書き込みループ（書き込みスレッド） -------------------
+    def _write_loop(self):
+        while True:
+            with self._cond:
+                while self.is_running:
+                    if len(self._pending) >= self.flush_rows:
+                        break
+                    if self._pending:
+                        remaining = self.flush_interval - (time.monotonic() - self._first_pending_time)
+                        if remaining <= 0:
+                            break
+                        self._cond.wait(remaining)
+                    else:
+                        self._cond.wait()
+                rows = list(self._pending)
+                self._pending.clear()
+                running = self.is_running
+            if rows:
+                self._flush(rows)
+            if not running:
+                break
+
+    # --- まとめて書き出す内部関数 -------------------
+    def _flush(self, rows):
+        try:
+            self._writer.writerows(rows)
+            self._file.flush()
+            now = time.monotonic()
+            if self.durability == "fsync" and now - self._last_fsync >= self.fsync_interval:
+                os.fsync(self._file.fileno())
+                self._last_fsync = now
+            self.rows_written += len(rows)
+            self.flushes += 1
+        except OSError as e:
+            self.errors += 1
+            print(f"CSV書き込みエラー ({self.path}): {e}")
+
+    # --- 待ち行を書き出してから閉じる関数 -------------------
+    def close(self):
+        with self._cond:
+            if not self.is_running:
+                return
+            self.is_running = False
+            self._cond.notify_all()
+        self.thread.join()
+        try:
+            if self.durability == "fsync":
+                os.fsync(self._file.fileno())
+        except OSError as e:
+            print(f"CSV書き込みエラー ({self.path}): {e}")
+        self._file.close()
+
+    def get_stats(self):
+        with self._cond:
+            return {"written": self.rows_written, "flushes": self.flushes,
+                    "pending": len(self._pending), "errors": self.errors}
+
+# ==========================================================
+# タイル動画を別スレッドで合成・エンコードするクラス
+# ==========================================================
+class TileCompositor:
+    """
+    >>> 4カメラ分のフレーム（描画前の AnnotatedFrame）を受け取り、合成スレッドでタイルに描画する
+    - 各カメラのフレームは使い回しキャンバス（TILE_VIDEO_SIZE）の担当区画へ直接描画する
+    - エンコードは VideoWriterWorker（専用スレッド・上限付きキュー）が行う
+    - submit() は各フレームを区画サイズの自前バッファへ縮小コピーしてキューに積む
+      （元フレームはリング・共有メモリの借り物の場合があるため参照を持たない。描画・エンコードは待たない）
+      （block=True の場合は満杯なら空きを待ち、タイルを捨てない）
+    """
+    def __init__(self, video_path, fps=FPS, queue_size=TILE_QUEUE_SIZE, block=None):
+        self.video_path = video_path
+        self.queue_size = queue_size
+        self.block = TILE_BLOCK_WHEN_FULL if block is None else block
+        self.canvas = np.zeros((TILE_VIDEO_SIZE[1], TILE_VIDEO_SIZE[0], 3), dtype=np.uint8)
+        self.encoder = VideoWriterWorker(video_path, 'mp4v', fps, TILE_VIDEO_SIZE, name="tile",
+                                         drop_policy=BLOCK if self.block else DROP_OLDEST)
+        self.thread = None
+
+        self.cell_shape = (TILE_VIDEO_SIZE[1] // 2, TILE_VIDEO_SIZE[0] // 2, 3)
+        self._free_cells = []           # 区画サイズのコピー先（合成後に使い回す）
+
+        self.tiles_submitted = 0
+        self.tiles_dropped = 0
+
+        self._cond = threading.Condition()
+        self._pending = deque()
+        self.is_running = self.encoder.start()
+        if not self.is_running:
+            print(f"[Error] 動画ファイルのオープンに失敗しました: {self.video_path}")
+            return
+        self.thread = threading.Thread(target=self._compose_loop, daemon=True)
+        self.thread.start()
+
+    # --- 4カメラ分のフレームを合成待ちに積む関数（推論スレッドから呼ぶ） -------------------
+    def submit(self, frames):
+        """frames: {カメラ名: AnnotatedFrame または None（黒で埋める）}"""
+        with self._cond:
+            if not self.is_running:
+                return False
+            cells = [self._free_cells.pop() if self._free_cells else np.empty(self.cell_shape, dtype=np.uint8)
+                     for frame in frames.values() if frame is not None]
+        # 呼び出し元のフレームはこの場で自前のバッファへ移す（以降、元のメモリは参照しない）
+        owned = {}
+        for cam_name, frame in frames.items():
+            owned[cam_name] = frame.snapshot(cells.pop()) if frame is not None else None
+
+        with self._cond:
+            self.tiles_submitted += 1
+            while self.block and self.is_running and len(self._pending) >= self.queue_size:
+                self._cond.wait()
+            if len(self._pending) >= self.queue_size:
+                self._recycle(self._pending.popleft())
+                self.tiles_dropped += 1
+            self._pending.append(owned)
+            self._cond.notify()
+        return True
+
+    # --- 使い終わったタイルの区画バッファを戻す内部関数（ロック内で呼ぶ） -------------------
+    def _recycle(self, frames):
+        self._free_cells.extend(frame.image for frame in frames.values() if frame is not None)
+
+    # --- 合成ループ（合成スレッド） -------------------
+    def _compose_loop(self):
+        while True:
+            with self._cond:
+                while self.is_running and not self._pending:
+                    self._cond.wait()
+                if not self._pending:
+                    break
+                frames = self._pending.popleft()
+                if self.block:
+                    self._cond.notify_all()     # 空き待ちの submit() を起こす
+            try:
+                self.encoder.submit(self.compose(frames))
+            except Exception as e:
+                print(f"Tile Error: {e}")
+            with self._cond:
+                self._recycle(frames)
+
+    # --- キャンバスに配置どおり描画する関数 -------------------
+    def compose(self, frames):
+        # 1区画の大きさ（TILE_VIDEO_SIZE の半分）に直接描画するので合成後のリサイズは不要
+        cell_w, cell_h = TILE_VIDEO_SIZE[0] // 2, TILE_VIDEO_SIZE[1] // 2
+        for cam_name, (row, col) in TILE_LAYOUT.items():
+            region = self.canvas[row * cell_h:(row + 1) * cell_h, col * cell_w:(col + 1) * cell_w]
+            frame = frames.get(cam_name)
+            if frame is None:
+                region[:] = 0
+            else:
+                frame.render(out=region)
+        return self.canvas
+
+    # --- 合成済みのタイル画像をそのままエンコードに回す関数 -------------------
+    def submit_image(self, tile_frame):
+        return self.is_running and self.encoder.submit(tile_frame)
+
+    # --- 待ちタイルを書き出してから停止する関数 -------------------
+    def close(self):
+        with self._cond:
+            self.is_running = False
+            self._cond.notify_all()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.encoder.stop()
+
+    def get_stats(self):
+        with self._cond:
+            stats = {"submitted": self.tiles_submitted, "dropped": self.tiles_dropped, "pending": len(self._pending)}
+        stats["encoder"] = self.encoder.get_stats()
+        return stats
 
 # ==========================================================
 # 画像保存・CSV出力クラス
 # ==========================================================
 class OutputLogger:
-    def __init__(self):
+    def __init__(self, suffix=""):
         os.makedirs(SAVE_DIR_VIDEO, exist_ok=True)
         os.makedirs(SAVE_DIR_CSV, exist_ok=True)
         
         timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        self.video_path = os.path.join(SAVE_DIR_VIDEO, f"eval_{timestamp}.mp4")
-        self.csv_path = os.path.join(SAVE_DIR_CSV, f"eval_{timestamp}.csv")
+        self.video_path = os.path.join(SAVE_DIR_VIDEO, f"eval_{timestamp}{suffix}.mp4")
+        self.csv_path = os.path.join(SAVE_DIR_CSV, f"eval_{timestamp}{suffix}.csv")
         
-        self.video_writer = None
+        self.tile_writer = None         # 最初のタイルで作成する（TileCompositor）
+        self.csv_writer = None
         self._init_csv()
 
     def _init_video(self):
-        """動画ライターを★TILE_VIDEO_SIZEで初期化"""
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        # TILE_VIDEO_SIZE を使用
-        self.video_writer = cv2.VideoWriter(self.video_path, fourcc, FPS, TILE_VIDEO_SIZE)
-        if not self.video_writer.isOpened():
-            print(f"[Error] 動画ファイルのオープンに失敗しました: {self.video_path}")
+        """タイル合成・エンコードのワーカーを★TILE_VIDEO_SIZEで初期化"""
+        self.tile_writer = TileCompositor(self.video_path, FPS)
 
     def _init_csv(self):
-        with open(self.csv_path, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow(["ID", "LabelName", "Confidence"])
+        self.csv_writer = CsvWriterWorker(self.csv_path, ["ID", "LabelName", "Confidence", "DecisionMs", "Reason"])
+
+    def write_tile(self, frames):
+        """★4カメラ分のフレーム（描画前）を渡し、合成と書き込みはワーカーに任せる"""
+        if self.tile_writer is None:
+            self._init_video()
+        self.tile_writer.submit(frames)
 
     def write_video(self, tile_frame):
-        """★4分割合成されたタイル画像を動画に書き込む"""
-        if self.video_writer is None:
+        """★合成済みのタイル画像を動画に書き込む（サイズ調整はエンコードスレッドで行う）"""
+        if self.tile_writer is None:
             self._init_video()
-        
-        # 入力画像のサイズチェック（念のため）
-        h, w = tile_frame.shape[:2]
-        if (w, h) != TILE_VIDEO_SIZE:
-             tile_frame = cv2.resize(tile_frame, TILE_VIDEO_SIZE)
-             
-        self.video_writer.write(tile_frame)
+        self.tile_writer.submit_image(tile_frame)
 
     def write_csv(self, result_obj):
-        with open(self.csv_path, 'a', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            writer.writerow(result_obj.to_csv_row())
+        """行を書き込みスレッドのキューに積む（ファイルへの書き出しは待たない）"""
+        self.csv_writer.write_row(result_obj.to_csv_row())
 
     def close(self):
-        if self.video_writer:
-            self.video_writer.release()
+        self.csv_writer.close()
+        if self.tile_writer:
+            self.tile_writer.close()
             print(f"保存完了: {self.video_path}")
             print(f"保存完了: {self.csv_path}")
 
+# ==========================================================
+# 在否ゲートクラス（カメラごと）
+# ==========================================================
+class PresenceGate:
+    """
+    >>> 縮小した輝度画像を背景と比べ、変化がなければ「何もいない」としてマスク抽出を省略させる
+    - 背景は空と判定されたフレームでだけ更新する（照明のゆっくりした変化に追従）
+    - 比較は静止した物体でも検出できるよう前フレームではなく背景と行う
+    """
+    def __init__(self):
+        self.background = None          # float32 の縮小輝度画像
+        self.small = None               # 直近の has_change() で作った縮小画像（learn() で使い回す）
+        self.passed = 0                 # マスク抽出に回したフレーム数
+        self.skipped = 0                # 省略したフレーム数
+
+    # --- 縮小輝度画像を作る内部関数 -------------------
+    @staticmethod
+    def _shrink(frame):
+        # 原寸からの INTER_AREA は重いので、間引き（4倍サイズ）→ 平均化縮小 の2段で行う
+        w, h = GATE_SIZE
+        small = cv2.resize(frame, (w * 4, h * 4), interpolation=cv2.INTER_NEAREST)
+        small = cv2.resize(small, GATE_SIZE, interpolation=cv2.INTER_AREA)
+        if len(small.shape) == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return small
+
+    # --- 背景から変化があるか判定する関数 -------------------
+    def has_change(self, frame):
+        self.small = self._shrink(frame)
+        if self.background is None:
+            self.passed += 1
+            return True     # 背景がまだないので必ず調べる
+        diff = cv2.absdiff(self.small, cv2.convertScaleAbs(self.background))
+        changed = cv2.countNonZero(cv2.threshold(diff, GATE_PIXEL_THRESHOLD, 255, cv2.THRESH_BINARY)[1])
+        if changed >= GATE_CHANGED_RATIO * diff.size:
+            self.passed += 1
+            return True
+        self.skipped += 1
+        return False
+
+    # --- 空のフレームで背景を更新する関数 -------------------
+    def learn(self, frame=None):
+        small = self._shrink(frame) if frame is not None else self.small
+        if small is None:
+            return
+        if self.background is None:
+            self.background = small.astype(np.float32)
+        else:
+            cv2.accumulateWeighted(small, self.background, GATE_BG_ALPHA)
+
+    def get_stats(self):
+        return {"passed": self.passed, "skipped": self.skipped}
+
 # ==========================================================
 # 画像処理ユーティリティクラス
 # ==========================================================
 class ImageProcessor:
     @staticmethod
-    def get_target_info(frame):
-        """サクランボのマスク抽出と中心・面積取得"""
+    def get_target_info(frame, prev_target=None, scale=SEGMENT_SCALE):
+        """サクランボのマスク抽出と中心・面積取得
+        prev_target（同じカメラの前フレームの結果）を渡すと、その周辺の探索窓だけを処理する
+        （窓内で見つからない・窓の端で切れている場合はフレーム全体で再探索）
+        scale > 1 の場合は縮小画像でマスクを作り、中心・外接矩形・面積は原寸の座標で返す"""
+        if USE_SEARCH_WINDOW and prev_target is not None:
+            x1, y1, x2, y2 = ImageProcessor._search_window(frame, prev_target)
+            target = ImageProcessor._find_target(frame[y1:y2, x1:x2], scale)
+            if target is not None:
+                target = ImageProcessor._offset_target(target, x1, y1)
+                if not ImageProcessor._touches_window_edge(target, (x1, y1, x2, y2), frame.shape):
+                    return target
+        return ImageProcessor._find_target(frame, scale)
+
+    @staticmethod
+    def _search_window(frame, prev_target):
+        """前フレームの外接矩形を中心に探索窓 (x1, y1, x2, y2) を決める"""
+        img_h, img_w = frame.shape[:2]
+        stat = prev_target['stat']
+        half = int(max(stat[cv2.CC_STAT_WIDTH], stat[cv2.CC_STAT_HEIGHT]) * SEARCH_WINDOW_SCALE / 2) + SEARCH_WINDOW_MARGIN
+        x1 = max(0, prev_target['mx'] - half)
+        y1 = max(0, prev_target['my'] - half)
+        x2 = min(img_w, prev_target['mx'] + half)
+        y2 = min(img_h, prev_target['my'] + half)
+        return x1, y1, x2, y2
+
+    @staticmethod
+    def _touches_window_edge(target, window, frame_shape):
+        """外接矩形が探索窓の端（フレームの端を除く）に接していれば、窓外にはみ出している可能性がある"""
+        x1, y1, x2, y2 = window
+        img_h, img_w = frame_shape[:2]
+        x, y, w, h = target['stat'][:4]
+        return ((x <= x1 and x1 > 0) or (y <= y1 and y1 > 0) or
+                (x + w >= x2 and x2 < img_w) or (y + h >= y2 and y2 < img_h))
+
+    @staticmethod
+    def _offset_target(target, dx, dy):
+        """探索窓内の座標をフレーム全体の座標に戻す"""
+        stat = target['stat'].copy()
+        stat[cv2.CC_STAT_LEFT] += dx
+        stat[cv2.CC_STAT_TOP] += dy
+        return {
+            'mx': target['mx'] + dx,
+            'my': target['my'] + dy,
+            'area': target['area'],
+            'stat': stat
+        }
+
+    @staticmethod
+    def _find_target(frame, scale=1):
+        """画像全体からマスクを作り、最大の連結成分を返す（scale > 1 なら縮小して処理し原寸座標に戻す）"""
+        if scale > 1:
+            small = cv2.resize(frame, (max(1, frame.shape[1] // scale), max(1, frame.shape[0] // scale)),
+                               interpolation=cv2.INTER_AREA)
+            target = ImageProcessor._find_target_at(small, scale)
+            return ImageProcessor._scale_target(target, scale) if target is not None else None
+        return ImageProcessor._find_target_at(frame, 1)
+
+    @staticmethod
+    def _scale_target(target, scale):
+        """縮小画像での結果を原寸の座標に戻す（縮小画素 i は原寸の [i*scale, (i+1)*scale) に対応）"""
+        stat = target['stat'] * scale
+        stat[cv2.CC_STAT_AREA] = target['stat'][cv2.CC_STAT_AREA] * scale * scale
+        offset = (scale - 1) / 2
+        return {
+            'mx': int(target['mx_f'] * scale + offset),
+            'my': int(target['my_f'] * scale + offset),
+            'area': target['area'] * scale * scale,
+            'stat': stat
+        }
+
+    @staticmethod
+    def get_mask(frame, hsv_ranges=None):
+        """色範囲（HSV_RANGES の和集合）に入る画素を255とした2値マスクを返す"""
+        hsv_ranges = HSV_RANGES if hsv_ranges is None else hsv_ranges
         # HSVに変換
         hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
-        
-        # 赤色の範囲（2つの範囲を結合）
-        lower_red1 = np.array([0, 50, 50])
-        upper_red1 = np.array([10, 255, 255])
-        lower_red2 = np.array([160, 50, 50])
-        upper_red2 = np.array([180, 255, 255])
-
-        H_LOW = np.array([10, 40, 120])
-        H_HIGH = np.array([179, 255, 255])
-        
-        #mask1 = cv2.inRange(hsv, lower_red1, upper_red1)
-        #mask2 = cv2.inRange(hsv, lower_red2, upper_red2)
-        #mask = mask1 + mask2
-        mask = cv2.inRange(hsv, H_LOW, H_HIGH)
+
+        # 赤色を2つの範囲で取る場合の例
+        # HSV_RANGES = [((0, 50, 50), (10, 255, 255)), ((160, 50, 50), (180, 255, 255))]
+        mask = None
+        for low, high in hsv_ranges:
+            m = cv2.inRange(hsv, np.array(low), np.array(high))
+            mask = m if mask is None else cv2.bitwise_or(mask, m)
+        return mask
+
+    @staticmethod
+    def _find_target_at(frame, scale):
+        """マスク抽出と最大連結成分の選択（カーネル・面積閾値は scale に合わせて縮小）"""
+        mask = ImageProcessor.get_mask(frame)
         
         # モルフォロジー処理（ノイズ除去と結合）
-        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
+        ksize = max(1, int(round(MORPH_KERNEL_SIZE / scale))) | 1    # 奇数にする
+        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (ksize, ksize))
         mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel, iterations=2)
         mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel, iterations=2)
         
@@ -124,16 +774,12 @@ class ImageProcessor:
         if num_labels <= 1: # 背景のみ
             return None
         
-        # 最大の面積を持つラベルを探す（背景を除く）
-        max_area = 0
-        max_index = -1
-        for i in range(1, num_labels):
-            area = stats[i, cv2.CC_STAT_AREA]
-            if area > max_area:
-                max_area = area
-                max_index = i
+        # 最大の面積を持つラベルを探す（背景を除く, ベクトル化）
+        areas = stats[1:, cv2.CC_STAT_AREA]
+        max_index = int(np.argmax(areas)) + 1
+        max_area = int(areas[max_index - 1])
         
-        if max_index == -1 or max_area < 500: # 面積が小さすぎる場合は無視
+        if max_area < MIN_TARGET_AREA / (scale * scale): # 面積が小さすぎる場合は無視
             return None
         
         # 結果を辞書で返す
@@ -141,6 +787,8 @@ class ImageProcessor:
         return {
             'mx': int(mx),
             'my': int(my),
+            'mx_f': mx,     # 縮小画像から原寸に戻す際に使う小数の重心
+            'my_f': my,
             'area': max_area,
             'stat': stats[max_index] # [x, y, w, h, area]
         }
@@ -158,7 +806,7 @@ class ImageProcessor:
         obj_w, obj_h = stat[cv2.CC_STAT_WIDTH], stat[cv2.CC_STAT_HEIGHT]
         
         # クロップサイズ（外接矩形の大きい方に余白を追加）
-        crop_size = int(max(obj_w, obj_h) * 1.5)
+        crop_size = int(max(obj_w, obj_h) * CROP_SCALE)
         crop_size = min(crop_size, img_w, img_h) # 画像サイズを超えないように
         
         # クロップ範囲の計算（中心を合わせる）
@@ -173,19 +821,163 @@ class ImageProcessor:
         
         return frame[y1:y2, x1:x2]
 
+# ==========================================================
+# カメラごとの軽量トラッカークラス（ImageProcessor.get_target_info の結果で追跡）
+# ==========================================================
+class CentroidTracker:
+    """
+    >>> 1台のカメラ専用の重心・IoUトラッカー
+    - get_target_info の外接矩形と重心を前フレームと比較し、同一物体なら同じIDを返す
+    - TRACK_MAX_MISSED フレームを超えて見失ったら追跡を終了し、次の物体には新しいIDを振る
+    """
+    def __init__(self):
+        self.next_id = 1
+        self.track_id = None
+        self.last_target = None
+        self.missed = 0
+
+    @staticmethod
+    def _iou(stat_a, stat_b):
+        ax, ay, aw, ah = stat_a[:4]
+        bx, by, bw, bh = stat_b[:4]
+        iw = min(ax + aw, bx + bw) - max(ax, bx)
+        ih = min(ay + ah, by + bh) - max(ay, by)
+        if iw <= 0 or ih <= 0:
+            return 0.0
+        inter = iw * ih
+        return inter / float(aw * ah + bw * bh - inter)
+
+    def _is_same(self, target):
+        last = self.last_target
+        if self._iou(last['stat'], target['stat']) >= TRACK_IOU_THRESHOLD:
+            return True
+        distance = np.hypot(target['mx'] - last['mx'], target['my'] - last['my'])
+        return distance <= TRACK_MAX_DISTANCE
+
+    def update(self, target):
+        """今回のターゲット（未検出なら None）を渡し、追跡IDを返す（未検出時は None）"""
+        if target is None:
+            if self.track_id is not None:
+                self.missed += 1
+                if self.missed > TRACK_MAX_MISSED:
+                    self.track_id = None
+                    self.last_target = None
+            return None
+
+        if self.track_id is None or not self._is_same(target):
+            self.track_id = self.next_id
+            self.next_id += 1
+        self.last_target = target
+        self.missed = 0
+        return self.track_id
+
+# ==========================================================
+# 推論（ターゲット抽出・クロップ・分類）だけを行うクラス
+# ==========================================================
+class ViewAnalyzer:
+    """
+    >>> フレームから各カメラの検出結果（ターゲット・検出枠）だけを作る。判定の状態（ID・統合確率・CSV）は持たない
+    - 在否ゲート・探索窓の状態はカメラごとに持つ（同じカメラのフレームは同じ ViewAnalyzer に渡す）
+    - YoloDetector の中で使うほか、YoloServer のワーカーはこれだけを持ち、判定は親プロセスの YoloDetector で行う
+    """
+    def __init__(self, model_path=MODEL_PATH, backend=INFERENCE_BACKEND):
+        print(f"YOLOモデル {model_path} をロード中... (backend: {backend})")
+        self.backend = backend
+        self.model = load_model(model_path, backend)
+        self.names = self.model.names
+        self.last_targets = {}          # カメラごとの前フレームのターゲット（探索窓の中心）
+        self.gates = {}                 # カメラごとの在否ゲート
+
+    def analyze(self, frames):
+        """{カメラ名: フレーム} をまとめて処理し、ターゲットのあるカメラ分を1回の predict でバッチ推論する
+        戻り値: {カメラ名: {'frame', 'target', 'input', 'boxes', 'inferred'}}
+        （input: 推論入力のクロップ、boxes: _extract_boxes の検出枠、inferred: 推論したか）"""
+        views = {cam_name: self._prepare_input(frame, cam_name) for cam_name, frame in frames.items()}
+
+        batch_names = [cam_name for cam_name, view in views.items() if view['inferred']]
+        if batch_names:
+            results = self.model.predict([views[cam_name]['input'] for cam_name in batch_names],
+                                         imgsz=YOLO_IMG_SIZE, verbose=False, conf=CONF_THRESHOLD)
+            for cam_name, result in zip(batch_names, results):
+                views[cam_name]['boxes'] = self._extract_boxes(result)
+        return views
+
+    def _prepare_input(self, frame, cam_name):
+        """ターゲット抽出とクロップまでの推論前処理"""
+        target = self._find_target(frame, cam_name)
+        self.last_targets[cam_name] = target
+        view = {
+            'frame': frame,
+            'target': target,
+            'input': None,      # 推論入力（ターゲット未検出時は None）
+            'boxes': None,
+            'inferred': target is not None,
+        }
+        if target is None:
+            return view
+
+        # 中心判定とクロップ
+        img_w = frame.shape[1]
+        is_centered = abs(target['mx'] - img_w // 2) < CENTER_THRESHOLD_X
+
+        input_img = ImageProcessor.dynamic_crop(frame, target) if is_centered else frame
+        view['input'] = cv2.resize(input_img, (YOLO_IMG_SIZE, YOLO_IMG_SIZE), interpolation=cv2.INTER_AREA)
+        return view
+
+    def _find_target(self, frame, cam_name):
+        """在否ゲートを通したターゲット抽出（前フレームで見つかっている間はゲートを使わない）"""
+        prev_target = self.last_targets.get(cam_name)
+        if not USE_PRESENCE_GATE:
+            return ImageProcessor.get_target_info(frame, prev_target)
+
+        if cam_name not in self.gates:
+            self.gates[cam_name] = PresenceGate()
+        gate = self.gates[cam_name]
+        if prev_target is None and not gate.has_change(frame):
+            return None     # 背景のまま → マスク抽出・推論とも省略
+
+        target = ImageProcessor.get_target_info(frame, prev_target)
+        if target is None:
+            # 変化はあったがサクランボではない（照明変化など）→ 背景に取り込む
+            gate.learn(frame if prev_target is not None else None)
+        return target
+
+    def get_gate_stats(self):
+        """カメラごとの在否ゲートの通過・省略フレーム数"""
+        return {cam_name: gate.get_stats() for cam_name, gate in self.gates.items()}
+
+    @staticmethod
+    def _extract_boxes(result):
+        """Results から検出枠を数値配列 [[x1, y1, x2, y2, conf, cls], ...]（信頼度の高い順）で取り出す"""
+        if len(result.boxes) == 0:
+            return None
+        return result.boxes.data[:, :6].cpu().numpy()
+
 # ==========================================================
 # YOLO検出クラス
 # ==========================================================
 class YoloDetector:
-    def __init__(self, model_path=MODEL_PATH):
-        print(f"YOLOモデル {model_path} をロード中...")
-        self.model = YOLO(model_path)
-        self.logger = OutputLogger()
+    def __init__(self, model_path=MODEL_PATH, log_suffix="", backend=INFERENCE_BACKEND, fusion_cameras=None,
+                 label_names=None):
+        # label_names を渡した場合はモデルを読み込まず、別プロセス（YoloServer のワーカー）の検出結果から判定だけを行う
+        self.analyzer = ViewAnalyzer(model_path, backend) if label_names is None else None
+        self.names = self.analyzer.names if self.analyzer is not None else label_names
+        self.logger = OutputLogger(log_suffix)  # 複数プロセスで使う場合はファイル名が重ならないよう接尾辞を付ける
         
         self.current_cherry_id = 1
-        self.current_detections = []    # 1つのサクランボに対する複数カメラ/フレームの検出結果を溜める
-        self.empty_frames_count = 0
-        self.MAX_EMPTY_FRAMES = 8       # 4台のカメラ×2サイクル分連続で未検出なら「完全に画面外」とみなす
+        self.cherry = CherryState(self.current_cherry_id)  # 現在のサクランボの判定状態
+        self.empty_counts = {}          # カメラごとの連続未検出フレーム数（画面外判定用）
+        # 判定に揃える必要のあるカメラ（CameraManager・FrameSynchronizer のカメラ名を明示的に渡す）
+        # None の間は "all_views" の判定をせず、閾値超えか画面外に出たときだけ判定する
+        self.fusion_cameras = tuple(fusion_cameras) if fusion_cameras else None
+        self.on_decision = None         # 判定時に呼ぶ関数 f(YoloResult)（例: CameraManager.save_cherry_clip）
+        self.frame_time = None          # 処理中フレームの撮影時刻（UNIX時刻、None: 処理時の時計で判定時間を測る）
+        # サクランボごとの詳細記録（カメラごとのクラス・信頼度・切り出し位置、判定時間）
+        self.store = CherryStore(STORE_DIR + log_suffix, label_names=self.names) if USE_CHERRY_STORE else None
+
+        # カメラごとのトラッカー（共有のByteTrack状態を使わない）
+        self.trackers = {}
+        self.render_buffers = {}        # カメラごとのアノテーション描画先（使い回す）
 
         # ★追加：カメラフレーム同期用のバッファ
         self.frame_buffer = {
@@ -195,120 +987,170 @@ class YoloDetector:
             'cam_outside': None
         }
 
-    def evaluate_frame(self, frame, cam_name, obj_id=None):
-        """画像処理、推論、保存のメインフロー"""
-        target = ImageProcessor.get_target_info(frame)
+    def evaluate_frame(self, frame, cam_name, obj_id=None, buffer_tile=True, timestamp=None):
+        """画像処理、推論、保存のメインフロー（buffer_tile=False の場合はタイル用バッファに溜めない）
+        推論は predict（分類）のみで、追跡IDはカメラごとの CentroidTracker が振る
+        timestamp: フレームの撮影時刻（UNIX時刻）。渡すと判定時間・判定時刻をこの時刻で測る"""
+        return self.fuse_views(self.analyzer.analyze({cam_name: frame}), buffer_tile, timestamp)[cam_name]
+
+    def evaluate_frames(self, frames, buffer_tile=True, timestamp=None):
+        """{カメラ名: フレーム} をまとめて処理し、ターゲットのあるカメラ分を1回の predict でバッチ推論する
+        戻り値: {カメラ名: (annotated_frame, best_result, finalized_result)}（evaluate_frame と同じ形式）
+        annotated_frame は描画前の AnnotatedFrame（画像が必要なときに render() を呼ぶ）
+        timestamp: フレームの撮影時刻（UNIX時刻、evaluate_frame と同じ）"""
+        return self.fuse_views(self.analyzer.analyze(frames), buffer_tile, timestamp)
+
+    def fuse_views(self, views, buffer_tile=True, timestamp=None):
+        """ViewAnalyzer.analyze の結果（別プロセスで作ったものでもよい）から追跡・確率の統合・判定を行う
+        1フレームセット分をまとめて渡す（全カメラ分の確率を加えてから1回だけ判定する）
+        戻り値: evaluate_frames と同じ"""
+        self.frame_time = timestamp
+        # ID管理はカメラ順に逐次で行い、単体呼び出しと同じ結果にする
+        tracked = {cam_name: self._track_view(view, cam_name) for cam_name, view in views.items()}
+        outputs = {cam_name: self._finish_output(p, cam_name, buffer_tile) for cam_name, p in tracked.items()}
+        return self._decide_outputs(outputs)
+
+    def _track_view(self, view, cam_name):
+        """追跡IDの更新と、画面内外の判定・サクランボIDの切り替え"""
+        target = view['target']
         found = target is not None
+        if cam_name not in self.trackers:
+            self.trackers[cam_name] = CentroidTracker()
+        track_id = self.trackers[cam_name].update(target)
         
-        # --- 画面内外の判定とID管理 ---
+        # --- 画面内外の判定とID管理（カメラごとに連続未検出を数える） ---
         if found:
-            self.empty_frames_count = 0
+            self.empty_counts[cam_name] = 0
+            self.cherry.mark_seen(self.frame_time)
         else:
-            self.empty_frames_count = min(self.empty_frames_count + 1, 100)
+            self.empty_counts[cam_name] = min(self.empty_counts.get(cam_name, 0) + 1, 100)
         
         finalized_result = None
+        if self.cherry.is_seen and all(n >= EXIT_EMPTY_FRAMES for n in self.empty_counts.values()):
+            # 全カメラの視野から出た → 未判定ならここで判定し、次のサクランボへ
+            finalized_result = self._decide(force_reason="exit")
+            if self.store is not None:
+                self.store.append(self.cherry)
+            self.current_cherry_id += 1
+            self.cherry = CherryState(self.current_cherry_id)
 
-        if self.empty_frames_count == self.MAX_EMPTY_FRAMES:
-            if len(self.current_detections) > 0:
-                best_overall = max(self.current_detections, key=lambda x: x.confidence)
-                self.logger.write_csv(best_overall)
-                finalized_result = best_overall
-                self.current_cherry_id += 1
-                self.current_detections = []
-        
-        actual_obj_id = self.current_cherry_id
-        
-        # ターゲット未検出時は推論をスキップ
-        if not found:
-            # GUI用にはリサイズ画像を用意
-            output_frame = cv2.resize(frame, (YOLO_IMG_SIZE, YOLO_IMG_SIZE))
+        return dict(view, obj_id=self.current_cherry_id, track_id=track_id, finalized=finalized_result)
+
+    def get_gate_stats(self):
+        """カメラごとの在否ゲートの通過・省略フレーム数"""
+        return self.analyzer.get_gate_stats() if self.analyzer is not None else {}
+
+    def _finish_output(self, prepared, cam_name, buffer_tile):
+        """検出結果（未推論なら inferred=False）から出力フレームと1カメラ分の結果を作る"""
+        actual_obj_id = prepared['obj_id']
+        finalized_result = prepared['finalized']
+
+        # 描画は取り出し側（GUI・タイル動画）が render() したときに行う
+        if cam_name not in self.render_buffers:
+            self.render_buffers[cam_name] = np.empty((YOLO_IMG_SIZE, YOLO_IMG_SIZE, 3), dtype=np.uint8)
+        buffer = self.render_buffers[cam_name]
+
+        if not prepared['inferred']:
+            # GUI用のリサイズも render() まで行わない
+            output_frame = AnnotatedFrame(prepared['frame'], buffer=buffer)
             
             # ★追加：処理済みフレームをバッファに保存（保存処理はここで行わない）
-            self._buffer_frame(cam_name, output_frame)
+            if buffer_tile:
+                self._buffer_frame(cam_name, output_frame)
             # ★バグ修正：戻り値を3つにする
-            return output_frame, YoloResult(actual_obj_id, "None", 0.0), finalized_result
-        
-        # 中心判定とクロップ
-        img_w = frame.shape[1]
-        is_centered = abs(target['mx'] - img_w // 2) < CENTER_THRESHOLD_X
+            return output_frame, YoloResult(actual_obj_id, "None", 0.0, prepared['track_id']), finalized_result
 
-        input_img = ImageProcessor.dynamic_crop(frame, target) if is_centered else frame
-        input_img_resized = cv2.resize(input_img, (YOLO_IMG_SIZE, YOLO_IMG_SIZE), interpolation=cv2.INTER_AREA)
-
-        # YOLO推論
-        results = self.model.track(input_img_resized, persist=True, verbose=False, conf=CONF_THRESHOLD, tracker="bytetrack.yaml")
-        annotated_frame = results[0].plot()
+        boxes = prepared['boxes']
+        annotated_frame = AnnotatedFrame(prepared['input'], boxes, self.names, buffer)
         
         # ★追加：アノテーション済みフレームをバッファに保存
-        self._buffer_frame(cam_name, annotated_frame)
+        if buffer_tile:
+            self._buffer_frame(cam_name, annotated_frame)
         
-        best_result = self._parse_results(results, cam_name, actual_obj_id, found)
+        best_result = self._parse_results(boxes, actual_obj_id)
+        best_result.track_id = prepared['track_id']
         
-        # 推論結果が有効ならバッファに追加（ここではまだCSVに書かない）
-        if best_result.label_name != "None":
-            self.current_detections.append(best_result)
+        # このカメラの確率を加える（判定は呼び出し側で全カメラ分を加えた後に行う）
+        if actual_obj_id == self.cherry.cherry_id:
+            self.cherry.add_view(cam_name, boxes, self.names, prepared['target'])
 
         return annotated_frame, best_result, finalized_result
 
-    def _parse_results(self, results, cam_name, obj_id, found):
-        if len(results[0].boxes) > 0:
-            box = results[0].boxes[0]
-            return YoloResult(obj_id, self.model.names[int(box.cls)], float(box.conf))
+    def _decide_outputs(self, outputs):
+        """1フレームセット分の add_view の後に1回だけ判定し、判定結果を先頭のカメラ
+        （画面外判定の結果が入っていないもの）の finalized_result に入れる"""
+        decision = self._decide()
+        if decision is not None:
+            for cam_name, (frame, best_result, finalized_result) in outputs.items():
+                if finalized_result is None:
+                    outputs[cam_name] = (frame, best_result, decision)
+                    break
+        return outputs
+
+    def _decide(self, force_reason=None):
+        """現在のサクランボを判定できればCSVに書き、結果を返す"""
+        decision = self.cherry.try_decide(self.fusion_cameras, force_reason, self.frame_time)
+        if decision is not None:
+            self.logger.write_csv(decision)
+            print(f"判定 ID {decision.id}: {decision.label_name} ({decision.confidence:.2f}) "
+                  f"{decision.reason} {decision.decision_ms or 0:.1f} ms")
+            if self.on_decision is not None:
+                self.on_decision(decision)
+        return decision
+
+    def evaluate_frame_set(self, frame_set):
+        """同期済みの4カメラフレーム（CameraManagerのFrameSynchronizer出力）をまとめて処理する
+        推論は1回のバッチで行い、タイルは同じ瞬間のフレームだけで合成される"""
+        if self.fusion_cameras is None:
+            self.fusion_cameras = tuple(frame_set.names)    # 同期器のカメラ構成で判定する
+        # 判定時刻はセットの撮影時刻で記録する（クリップ録画のリングと同じ時計）
+        outputs = self.evaluate_frames(frame_set.as_dict(), buffer_tile=False, timestamp=frame_set.capture_time)
+
+        # 同一時刻のフレームでタイルを作成して書き込む
+        for cam_name, (output_frame, _, _) in outputs.items():
+            if cam_name in self.frame_buffer:
+                self.frame_buffer[cam_name] = output_frame
+        if all(f is not None for f in self.frame_buffer.values()):
+            self.logger.write_tile(self.frame_buffer)
+        self._clear_buffer()
+        return outputs
+
+    def _parse_results(self, boxes, obj_id):
+        if boxes is not None:
+            return YoloResult(obj_id, self.names[int(boxes[0, 5])], float(boxes[0, 4]))
         return YoloResult(obj_id, "None", 0.0)
 
     # ==========================================================
     # ★追加：フレーム同期とタイル合成メソッド
     # ==========================================================
     def _buffer_frame(self, cam_name, frame):
-        """各カメラの処理済みフレームをバッファに溜める"""
+        """各カメラの処理済みフレーム（AnnotatedFrame、描画前）をバッファに溜める"""
         if cam_name in self.frame_buffer:
-            # 入力フレームがYOLO_IMG_SIZEと異なる場合はリサイズして保存
-            if frame.shape[:2] != (YOLO_IMG_SIZE, YOLO_IMG_SIZE):
-                frame = cv2.resize(frame, (YOLO_IMG_SIZE, YOLO_IMG_SIZE))
             self.frame_buffer[cam_name] = frame
         
         # すべてのカメラのフレームが揃ったか確認
         if all(f is not None for f in self.frame_buffer.values()):
-            # 揃ったら合成して動画に書き込む
-            tile_frame = self._create_tile_frame()
-            self.logger.write_video(tile_frame)
+            # 揃ったら合成ワーカーに渡す（合成・エンコードは別スレッド）
+            self.logger.write_tile(self.frame_buffer)
             # バッファをクリア（次のフレームの揃いを待つ）
             self._clear_buffer()
 
-    def _create_tile_frame(self):
-        """★バッファのフレームを指定配置で合成する"""
-        # 配置に従ってフレームを取得
-        v_tl = self.frame_buffer['cam_inside']      # 左上
-        v_bl = self.frame_buffer['cam_under']    # 左下
-        v_tr = self.frame_buffer['cam_outside']   # 右上
-        v_br = self.frame_buffer['cam_top']  # 右下
-        
-        # 合成ロジック (左側縦結合、右側縦結合、最後に横結合)
-        h_left = np.vstack((v_tl, v_bl))
-        h_right = np.vstack((v_tr, v_br))
-        tile_image = np.hstack((h_left, h_right))
-        
-        # 最終アスペクト比を1:1 (TILE_VIDEO_SIZE) に調整
-        return cv2.resize(tile_image, TILE_VIDEO_SIZE)
-
     def _clear_buffer(self):
         """バッファをクリア（Noneに戻す）"""
         for key in self.frame_buffer.keys():
             self.frame_buffer[key] = None
 
     def close(self):
-        # プログラム終了時にバッファに残っていれば強制的に出力
-        if len(self.current_detections) > 0:
-            best_overall = max(self.current_detections, key=lambda x: x.confidence)
-            self.logger.write_csv(best_overall)
+        # プログラム終了時に未判定のサクランボが残っていれば強制的に判定して出力
+        self._decide(force_reason="close")
+        if self.store is not None:
+            if self.cherry.is_seen:
+                self.store.append(self.cherry)
+            self.store.close()
         
         # ★追加：もしバッファにフレームが残っていたら、最後のタイルを作って書き込む（同期は無視）
         if any(f is not None for f in self.frame_buffer.values()):
-            # Noneのフレームを真っ黒な画像で埋めて合成
-            black_img = np.zeros((YOLO_IMG_SIZE, YOLO_IMG_SIZE, 3), dtype=np.uint8)
-            for key, frame in self.frame_buffer.items():
-                if frame is None: self.frame_buffer[key] = black_img
-            tile_frame = self._create_tile_frame()
-            self.logger.write_video(tile_frame)
+            # Noneのフレームは真っ黒で合成される
+            self.logger.write_tile(self.frame_buffer)
 
         self.logger.close()
\ No newline at end of file
@@ -0,0 +1,388 @@
+# -------------------------------------------------
+# YOLO判定を別プロセスで実行する推論サーバーのプログラムmodule
+# -------------------------------------------------
+import time
+import queue
+import itertools
+import threading
+from collections import OrderedDict
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import module_yolo_csv as yolo_ctr
+
+# ==========================================================
+# 定数定義
+# ==========================================================
+SERVER_WORKERS = 1              # 推論プロセス数（カメラをプロセスに振り分ける）
+SERVER_SLOTS_PER_CAMERA = 2     # カメラごとの共有メモリスロット数（= 処理待ちにできるフレーム数）
+SERVER_FRAME_SHAPE = (960, 1280, 3)     # 受け付ける最大フレームサイズ（高さ, 幅, ch）
+SERVER_CAMERAS = ('cam_top', 'cam_under', 'cam_inside', 'cam_outside')
+SERVER_POLL_SEC = 0.5           # 結果待ちの間にワーカーの生存を確認する間隔
+OUTPUT_SHAPE = (yolo_ctr.YOLO_IMG_SIZE, yolo_ctr.YOLO_IMG_SIZE, 3)     # 返却するアノテーション画像
+
+# ==========================================================
+# 共有メモリの1スロット（入力フレーム + 出力画像）
+# ==========================================================
+class FrameSlot:
+    """
+    >>> 入力フレームとアノテーション画像を置く共有メモリ領域
+    - 親プロセスが create=True で作成し、ワーカーは名前で開いて同じ領域を ndarray として参照する
+    - 配列そのものはキューに流さない（キューにはスロット番号と形状だけを送る）
+    """
+    def __init__(self, name=None, create=False, frame_shape=SERVER_FRAME_SHAPE):
+        self.in_bytes = int(np.prod(frame_shape))
+        self.out_bytes = int(np.prod(OUTPUT_SHAPE))
+        if create:
+            self.shm = shared_memory.SharedMemory(create=True, size=self.in_bytes + self.out_bytes)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.name = self.shm.name
+
+    # --- 入力フレーム領域を指定形状の ndarray として返す関数 -------------------
+    def input_view(self, shape, dtype=np.uint8):
+        count = int(np.prod(shape))
+        return np.ndarray(shape, dtype=dtype, buffer=self.shm.buf[:count])
+
+    # --- 出力画像領域を ndarray として返す関数 -------------------
+    def output_view(self):
+        return np.ndarray(OUTPUT_SHAPE, dtype=np.uint8, buffer=self.shm.buf[self.in_bytes:self.in_bytes + self.out_bytes])
+
+    def close(self, unlink=False):
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+# ==========================================================
+# 推論ワーカープロセス
+# ==========================================================
+def _worker_main(worker_idx, cam_names, slot_names, frame_shape, task_queue, result_queue, model_path, backend):
+    """
+    担当カメラ分の推論（ターゲット抽出・クロップ・分類）だけを行い、カメラごとの検出結果をキューで返す
+    （追跡・確率の統合・判定・CSVは親プロセスの YoloDetector が全カメラ分をまとめて行う）
+    タスク: (job_id, render, [(cam_name, slot_idx, shape), ...]) / None で終了
+    render=True のときだけアノテーション画像を共有メモリの出力領域に描画する
+    """
+    # 親と同じ frame_shape で開く（出力領域の位置が入力サイズで決まるため）
+    slots = {cam: [FrameSlot(name, frame_shape=frame_shape) for name in names] for cam, names in slot_names.items()}
+    analyzer = yolo_ctr.ViewAnalyzer(model_path, backend)
+    result_queue.put(("ready", worker_idx, analyzer.names))
+
+    try:
+        while True:
+            task = task_queue.get()
+            if task is None:
+                break
+            job_id, render, items = task
+            frames = {cam: slots[cam][slot_idx].input_view(shape) for cam, slot_idx, shape in items}
+            try:
+                views = analyzer.analyze(frames)
+            except Exception as e:
+                result_queue.put(("error", worker_idx, (job_id, [(cam, idx) for cam, idx, _ in items], str(e))))
+                continue
+
+            # アノテーション画像は要求されたときだけ共有メモリの出力領域に書き、キューには検出結果だけを送る
+            payload = []
+            for cam, slot_idx, _ in items:
+                view = views[cam]
+                if render:
+                    image = view['input'] if view['inferred'] else view['frame']
+                    yolo_ctr.AnnotatedFrame(image, view['boxes'], analyzer.names).render(
+                        out=slots[cam][slot_idx].output_view())     # 共有メモリへ直接描画
+                detection = {'frame': None, 'input': None, 'target': view['target'],
+                             'boxes': view['boxes'], 'inferred': view['inferred']}
+                payload.append((cam, slot_idx, detection))
+            result_queue.put(("result", worker_idx, (job_id, payload)))
+    finally:
+        for cam_slots in slots.values():
+            for slot in cam_slots:
+                slot.close()
+
+# ==========================================================
+# 推論サーバー（GUI側プロセスで使うクラス）
+# ==========================================================
+class YoloServer:
+    """
+    >>> 推論（ViewAnalyzer）を workers 個のプロセスで動かし、GUIプロセスのGILから切り離す
+    - カメラはプロセスに固定で振り分ける（カメラごとの在否ゲート・探索窓の状態を1か所に保つため）
+    - ワーカーはカメラごとの検出結果だけを返し、追跡・確率の統合・判定・CSVは親プロセスの
+      YoloDetector（self.detector）が全カメラ分をまとめて行う（workers の数によらずCSVは1つ、IDは通し番号）
+    - 1回の submit（ジョブ）は全ワーカーの結果が揃ってから、submit した順に統合する
+    - タイル動画は render=True で全カメラ分を submit したジョブだけ書く
+    - 空きスロットがないカメラのフレームは捨てる（推論が追いつかなくても取得・GUIを待たせない）
+    - 異常終了したワーカーは検出してエラーを表示し、そのワーカーの処理中スロットを解放する
+      （以降、そのワーカー担当カメラのフレームは捨てる）
+    """
+    def __init__(self, workers=SERVER_WORKERS, cam_names=SERVER_CAMERAS, model_path=yolo_ctr.MODEL_PATH,
+                 frame_shape=SERVER_FRAME_SHAPE, slots_per_camera=SERVER_SLOTS_PER_CAMERA,
+                 backend=yolo_ctr.INFERENCE_BACKEND, log_suffix=""):
+        self.workers = max(1, min(workers, len(cam_names)))
+        self.cam_names = tuple(cam_names)
+        self.model_path = model_path
+        self.backend = backend
+        self.frame_shape = tuple(frame_shape)
+        self.slots_per_camera = slots_per_camera
+        self.log_suffix = log_suffix
+        self.detector = None            # 判定・CSVを行う YoloDetector（モデルは読み込まない。start() で作成）
+
+        # カメラ → ワーカー番号（順番に振り分け）
+        self.cam_worker = {cam: i % self.workers for i, cam in enumerate(self.cam_names)}
+
+        self.slots = {}                 # {カメラ名: [FrameSlot, ...]}
+        self.free_slots = {}            # {カメラ名: [空きスロット番号, ...]}
+        self.processes = []
+        self.task_queues = []
+        self.result_queue = None
+        self.is_running = False
+        self.dead_workers = set()       # 異常終了を検出したワーカー番号
+
+        self._lock = threading.Lock()
+        self._job_ids = itertools.count(1)
+        # 結果待ちのジョブ（submit 順）: {job_id: {"waiting": ワーカー番号の集合, "views", "images", "render", "timestamp"}}
+        self._jobs = OrderedDict()
+
+        # 統計用カウンタ
+        self.frames_submitted = 0
+        self.frames_dropped = 0
+        self.frames_done = 0
+        self.errors = 0
+
+    # --- 共有メモリを確保してワーカープロセスを起動する関数 -------------------
+    def start(self, timeout=120.0):
+        ctx = mp.get_context("spawn")   # Qt・CUDAの状態を子プロセスに持ち込まないよう spawn で起動
+        # 書き出しが必要なら親で1回だけ行う（ワーカーが同時に書き出さないように）
+        yolo_ctr.export_model(self.model_path, self.backend)
+        for cam in self.cam_names:
+            self.slots[cam] = [FrameSlot(create=True, frame_shape=self.frame_shape)
+                               for _ in range(self.slots_per_camera)]
+            self.free_slots[cam] = list(range(self.slots_per_camera))
+
+        self.result_queue = ctx.Queue()
+        for idx in range(self.workers):
+            cams = [cam for cam in self.cam_names if self.cam_worker[cam] == idx]
+            slot_names = {cam: [slot.name for slot in self.slots[cam]] for cam in cams}
+            task_queue = ctx.Queue()
+            proc = ctx.Process(target=_worker_main, daemon=True, name=f"yolo_worker_{idx}",
+                               args=(idx, cams, slot_names, self.frame_shape, task_queue, self.result_queue,
+                                     self.model_path, self.backend))
+            proc.start()
+            self.task_queues.append(task_queue)
+            self.processes.append(proc)
+
+        # 全ワーカーのモデル読み込み完了を待つ（クラス名はワーカーから受け取る）
+        ready = 0
+        label_names = None
+        while ready < self.workers:
+            try:
+                kind, worker_idx, body = self.result_queue.get(timeout=timeout)
+            except queue.Empty:
+                print("エラー: 推論ワーカーの起動がタイムアウトしました")
+                self.stop()
+                return False
+            if kind == "ready":
+                ready += 1
+                label_names = body
+        self.detector = yolo_ctr.YoloDetector(self.model_path, log_suffix=self.log_suffix, backend=self.backend,
+                                              fusion_cameras=self.cam_names, label_names=label_names)
+        self.is_running = True
+        print(f"推論サーバー起動: {self.workers} プロセス")
+        return True
+
+    # --- フレームを推論に回す関数（GUI・取得側から呼ぶ。待たない） -------------------
+    def submit(self, frames, render=False, timestamp=None):
+        """
+        frames: {カメラ名: BGRフレーム}（同じ瞬間のフレームセット。1カメラだけでもよい）
+        render: True ならワーカーでアノテーション画像を描画して返す（False なら描画しない）
+        timestamp: フレームの撮影時刻（UNIX時刻、YoloDetector.evaluate_frames と同じ）
+        戻り値: ジョブID（全カメラ分のスロットが埋まっていて何も送れなかった場合は None）
+        """
+        if not self.is_running:
+            return None
+        self._check_workers()
+        job_id = next(self._job_ids)
+        tasks = {}
+        with self._lock:
+            for cam, frame in frames.items():
+                if cam not in self.slots:
+                    continue
+                self.frames_submitted += 1
+                if self.cam_worker[cam] in self.dead_workers:
+                    self.frames_dropped += 1
+                    continue
+                if frame is None or frame.nbytes > self.slots[cam][0].in_bytes:
+                    if frame is not None:
+                        print(f"エラー: {cam} のフレームが共有メモリのサイズを超えています {frame.shape}")
+                    self.frames_dropped += 1
+                    continue
+                if not self.free_slots[cam]:
+                    self.frames_dropped += 1
+                    continue
+                slot_idx = self.free_slots[cam].pop()
+                tasks.setdefault(self.cam_worker[cam], []).append((cam, slot_idx, frame))
+
+            if tasks:
+                self._jobs[job_id] = {"waiting": set(tasks), "views": {}, "images": {},
+                                      "render": render, "timestamp": timestamp}
+        if not tasks:
+            return None
+
+        # スロットは自分だけが持っているのでロック外でコピーしてよい
+        for worker_idx, items in tasks.items():
+            message = []
+            for cam, slot_idx, frame in items:
+                np.copyto(self.slots[cam][slot_idx].input_view(frame.shape, frame.dtype), frame)
+                message.append((cam, slot_idx, frame.shape))
+            self.task_queues[worker_idx].put((job_id, render, message))
+        return job_id
+
+    # --- 推論結果を1件受け取る関数 -------------------
+    def get_result(self, timeout=None):
+        """
+        戻り値: (job_id, {カメラ名: (annotated_image, best_result, finalized_result)})
+        - best_result・finalized_result は YoloDetector.evaluate_frames と同じ（判定は親プロセスで全カメラ分を統合して行う）
+        - annotated_image は描画済みの ndarray（render=True で submit したジョブのみ。それ以外は None）
+        - ジョブは担当する全ワーカーの結果が揃ってから、submit した順に返す
+        結果がなければ（または全ワーカーが停止していれば）None
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            result = self._pop_finished_job()
+            if result is not None:
+                return result
+            wait = SERVER_POLL_SEC if deadline is None else min(SERVER_POLL_SEC, max(0.0, deadline - time.monotonic()))
+            try:
+                kind, worker_idx, body = self.result_queue.get(timeout=wait)
+            except queue.Empty:
+                # 待っている間にワーカーが落ちていないか確認する（落ちたワーカーの結果は来ない）
+                self._check_workers()
+                result = self._pop_finished_job()
+                if result is not None:
+                    return result
+                if len(self.dead_workers) >= len(self.processes):
+                    return None
+                if deadline is not None and time.monotonic() >= deadline:
+                    return None
+                continue
+            if kind == "result":
+                job_id, payload = body
+                job = self._jobs.get(job_id)
+                for cam, slot_idx, detection in payload:
+                    # 出力画像をコピーしてからスロットを返却する
+                    if job is not None:
+                        job["views"][cam] = detection
+                        if job["render"]:
+                            job["images"][cam] = self.slots[cam][slot_idx].output_view().copy()
+                    self._release_slot(cam, slot_idx)
+                self._worker_done(job_id, worker_idx)
+            elif kind == "error":
+                job_id, items, message = body
+                print(f"推論エラー (worker {worker_idx}, job {job_id}): {message}")
+                with self._lock:
+                    self.errors += 1
+                for cam, slot_idx in items:
+                    self._release_slot(cam, slot_idx)
+                self._worker_done(job_id, worker_idx)
+
+    # --- ジョブの担当ワーカー1つ分の結果が届いたことを記録する内部関数 -------------------
+    def _worker_done(self, job_id, worker_idx):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job["waiting"].discard(worker_idx)
+
+    # --- 先頭のジョブが揃っていれば判定して返す内部関数 -------------------
+    def _pop_finished_job(self):
+        with self._lock:
+            if not self._jobs:
+                return None
+            job_id, job = next(iter(self._jobs.items()))
+            if job["waiting"]:
+                return None
+            del self._jobs[job_id]
+
+        # 全カメラ分の検出結果をカメラ順に並べ、1フレームセットとして統合・判定する
+        views = {cam: job["views"][cam] for cam in self.cam_names if cam in job["views"]}
+        outputs = {}
+        if views:
+            fused = self.detector.fuse_views(views, buffer_tile=False, timestamp=job["timestamp"])
+            outputs = {cam: (job["images"].get(cam), best_result, finalized)
+                       for cam, (_, best_result, finalized) in fused.items()}
+
+        # 描画済みの全カメラ分が揃っていればタイル動画に書く
+        images = job["images"]
+        if images and all(cam in images for cam in self.detector.frame_buffer):
+            self.detector.logger.write_tile({cam: yolo_ctr.AnnotatedFrame(images[cam])
+                                             for cam in self.detector.frame_buffer})
+        return job_id, outputs
+
+    # --- 溜まっている結果をすべて受け取る関数（GUIのタイマーから呼ぶ想定） -------------------
+    def poll_results(self):
+        results = []
+        while True:
+            item = self.get_result(timeout=0)
+            if item is None:
+                return results
+            results.append(item)
+
+    # --- スロットを空きに戻す内部関数 -------------------
+    def _release_slot(self, cam, slot_idx):
+        with self._lock:
+            if slot_idx in self.free_slots[cam]:
+                return      # 停止したワーカーの分として解放済み
+            self.free_slots[cam].append(slot_idx)
+            self.frames_done += 1
+
+    # --- 異常終了したワーカーを検出する内部関数 -------------------
+    def _check_workers(self):
+        for idx, proc in enumerate(self.processes):
+            if idx in self.dead_workers or proc.is_alive():
+                continue
+            self.dead_workers.add(idx)
+            print(f"エラー: 推論ワーカー {proc.name} が停止しました (exitcode {proc.exitcode})。"
+                  f"担当カメラのフレームは以降破棄します")
+            # 処理中のスロットは結果が返らないので解放し、結果待ちのジョブからも外す
+            with self._lock:
+                self.errors += 1
+                for cam, worker_idx in self.cam_worker.items():
+                    if worker_idx == idx and cam in self.free_slots:
+                        self.free_slots[cam] = list(range(self.slots_per_camera))
+                for job in self._jobs.values():
+                    job["waiting"].discard(idx)
+
+    # --- 統計情報を返す関数 -------------------
+    def get_stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "dead_workers": len(self.dead_workers),
+                "submitted": self.frames_submitted,
+                "done": self.frames_done,
+                "dropped": self.frames_dropped,
+                "errors": self.errors,
+                "in_flight": sum(self.slots_per_camera - len(f) for f in self.free_slots.values()),
+                "pending_jobs": len(self._jobs),
+            }
+
+    # --- ワーカーを停止して共有メモリを解放する関数 -------------------
+    def stop(self, timeout=10.0):
+        self.is_running = False
+        for task_queue in self.task_queues:
+            task_queue.put(None)
+        for proc in self.processes:
+            proc.join(timeout)
+            if proc.is_alive():
+                print(f"警告: {proc.name} が終了しないため強制終了します")
+                proc.terminate()
+        self.processes = []
+        self.task_queues = []
+        if self.detector is not None:
+            self.detector.close()   # 未判定のサクランボを判定してCSV・タイル動画を閉じる
+            self.detector = None
+
+        for cam_slots in self.slots.values():
+            for slot in cam_slots:
+                slot.close(unlink=True)
+        self.slots = {}
+        self.free_slots = {}
@@ -0,0 +1,415 @@
+# -------------------------------------------------
+# reevaluate.py
+# 録画済みの cam_video/ を ImageProcessor・YoloDetector で再評価するコマンド
+# （モデル・HSV閾値を変えたときの回帰確認用。実機は不要）
+#
+# 例: uv run python reevaluate.py --model Trained_Models/new.pt --workers 8
+#     uv run python reevaluate.py --session 20260101 --hsv 10,40,120,179,255,255
+# -------------------------------------------------
+import os
+import re
+import math
+import sys
+import time
+import argparse
+import datetime
+import contextlib
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import cv2
+
+import module_yolo_csv as yolo_ctr
+from module_camera_source import find_recordings
+from module_video_writer import INDEX_SUFFIX, load_segment_index
+from module_cherry_store import CherryStore
+from module_cameras_ver3 import TARGET_SERIALS, FOLDER_PARENT, FOLDER_CHILD, FPS, SYNC_TOLERANCE_MS
+
+# ==========================================================
+# 定数定義
+# ==========================================================
+REEVAL_OUT_DIR = "reevaluated"  # 出力先（この下に evaluated_csv / evaluated_videos / evaluated_store を作る）
+REEVAL_WORKERS = max(1, (os.cpu_count() or 2) // 2)     # 既定のプロセス数
+SESSION_PATTERN = re.compile(r"^(\d{8}_\d{6})(?:_(\d{4}))?$")  # "日時" または "日時_分割番号"（クリップは対象外）
+SESSION_TOLERANCE_SEC = 10.0    # 録画の空白がこの秒数までなら同じセッションとみなす（カメラごとの開始時刻のずれを含む）
+REEVAL_WINDOW_SEC = 60.0        # 1ジョブの長さ（録画時刻の秒数。セッションをこの長さで区切って並列に評価する）
+REEVAL_OVERLAP_SEC = 5.0        # 時間窓の前後に余分に読む秒数（サクランボ1個が視野を通過する時間より長くする）
+
+# ==========================================================
+# 録画ファイルを処理単位（ジョブ）にまとめる関数
+# ==========================================================
+def _estimate_runs(path, start_time, fps):
+    """索引のない録画（分割なし・索引の書き込み前に終了したもの）は等間隔とみなして区間を推定する"""
+    cap = cv2.VideoCapture(path)
+    count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+    fps = cap.get(cv2.CAP_PROP_FPS) or fps
+    cap.release()
+    if count <= 0:
+        return []
+    print(f"警告: {os.path.basename(path)} の索引がないため、フレーム数 / FPS で時刻を推定します"
+          "（取りこぼしがあるとカメラ間がずれます）")
+    return [(start_time, start_time + (count - 1) / fps, path, 0, count)]
+
+def load_timelines(source=FOLDER_PARENT, session=None, fps=FPS):
+    """
+    カメラごとの録画を時刻の区間に分けて返す
+    - 分割録画は索引（フォルダ名_日時_index.csv）の時刻を使う（取りこぼしで時刻が飛んだ箇所は索引の行が分かれている）
+    戻り値: {カメラ名: [(開始時刻, 終了時刻, パス, ファイル内の開始位置, フレーム数), ...]}（時刻は UNIX時刻、古い順）
+    """
+    timelines = {}
+    for i, (_, cam_name) in enumerate(TARGET_SERIALS):
+        folder = os.path.join(source, FOLDER_CHILD[i])
+        prefix = os.path.basename(folder) + "_"
+        indexes = {}    # 索引のパス: 行のリスト
+        runs = []
+        for path in find_recordings(folder, session):
+            stem = os.path.splitext(os.path.basename(path))[0][len(prefix):]
+            m = SESSION_PATTERN.match(stem)
+            if m is None:
+                continue
+            if m.group(2) is not None:
+                index_path = os.path.join(folder, prefix + m.group(1) + INDEX_SUFFIX)
+                if index_path not in indexes:
+                    indexes[index_path] = load_segment_index(index_path) if os.path.exists(index_path) else []
+                rows = [row for row in indexes[index_path] if row["path"] == path]
+                if rows:
+                    runs.extend((row["start_time"], row["end_time"], path, row["offset"], row["frames"])
+                                for row in rows)
+                    continue
+            # 索引がない場合は、同じセッションの直前の区間の続き（なければファイル名の日時）から始まるとみなす
+            start = datetime.datetime.strptime(m.group(1), "%Y%m%d_%H%M%S").timestamp()
+            previous = [run[1] for run in runs if run[1] >= start]
+            runs.extend(_estimate_runs(path, max(previous) + 1.0 / fps if previous else start, fps))
+        if runs:
+            timelines[cam_name] = sorted(runs)
+    return timelines
+
+def find_jobs(source=FOLDER_PARENT, session=None, split_cameras=False, window_sec=None):
+    """
+    録画を「セッション × 時間窓」ごとのジョブにまとめて返す
+    - 1ジョブ = 同じ時間帯の各カメラの区間（多視点判定・タイルはジョブ内で、録画時刻でフレームを揃えて行う）
+    - 時間窓の前後 REEVAL_OVERLAP_SEC も読み（"read"）、窓の境目をまたぐサクランボも1つのジョブで判定できるようにする
+      （どのジョブの結果とするかは最初に見えた時刻が "window" に入るかで決める）
+    - split_cameras=True の場合はカメラごとに別ジョブにする（並列度は上がるが判定はカメラ単独になる）
+    戻り値: [{"label": "20260101_120000_0003", "segment": ..., "group": まとめ先（セッション）, "window": (開始, 終了),
+             "read": (開始, 終了), "runs": {カメラ名: 区間のリスト}}, ...]
+    """
+    window_sec = window_sec or REEVAL_WINDOW_SEC
+    timelines = load_timelines(source, session)
+
+    # 録画の空白が SESSION_TOLERANCE_SEC を超えるところでセッションを分ける
+    spans = sorted((run[0], run[1]) for runs in timelines.values() for run in runs)
+    sessions = []   # [開始時刻, 終了時刻]
+    for t_start, t_end in spans:
+        if sessions and t_start - sessions[-1][1] <= SESSION_TOLERANCE_SEC:
+            sessions[-1][1] = max(sessions[-1][1], t_end)
+        else:
+            sessions.append([t_start, t_end])
+
+    jobs = []
+    for s_start, s_end in sessions:
+        label = datetime.datetime.fromtimestamp(s_start).strftime("%Y%m%d_%H%M%S")
+        for k in range(int((s_end - s_start) // window_sec) + 1):
+            w0 = s_start + k * window_sec
+            w1 = w0 + window_sec
+            r0, r1 = w0 - REEVAL_OVERLAP_SEC, w1 + REEVAL_OVERLAP_SEC
+            runs = {cam_name: [run for run in cam_runs if run[0] < r1 and run[1] >= r0]
+                    for cam_name, cam_runs in timelines.items()}
+            runs = {cam_name: r for cam_name, r in runs.items() if r}
+            # 窓の中に録画がなければジョブにしない（前後の重なりだけのジョブは結果が残らない）
+            if not any(run[0] < w1 and run[1] >= w0 for r in runs.values() for run in r):
+                continue
+            base = f"{label}_{k:04d}"
+            if split_cameras:
+                jobs.extend({"label": f"{base}_{cam_name}", "segment": base, "group": f"{label}_{cam_name}",
+                             "window": (w0, w1), "read": (r0, r1), "runs": {cam_name: r}}
+                            for cam_name, r in runs.items())
+            else:
+                jobs.append({"label": base, "segment": base, "group": label,
+                             "window": (w0, w1), "read": (r0, r1), "runs": runs})
+    # 大きいジョブから投入して終盤の待ちを減らす
+    jobs.sort(key=lambda job: -sum(run[4] for r in job["runs"].values() for run in r))
+    return jobs
+
+# ==========================================================
+# ワーカープロセス側の処理
+# ==========================================================
+def _init_worker(out_dir, hsv_ranges, cv_threads):
+    """出力先・閾値をワーカーの module_yolo_csv に設定する（OutputLogger はこれらを参照してファイルを作る）
+    CSV・判定記録はセッションごとに親でまとめて書くため、ワーカーでは判定記録を作らない"""
+    yolo_ctr.SAVE_DIR_CSV = os.path.join(out_dir, "evaluated_csv")
+    yolo_ctr.SAVE_DIR_VIDEO = os.path.join(out_dir, "evaluated_videos")
+    yolo_ctr.USE_CHERRY_STORE = False
+    yolo_ctr.TILE_BLOCK_WHEN_FULL = True    # 再評価では速度よりタイルの取りこぼしなしを優先
+    if hsv_ranges:
+        yolo_ctr.HSV_RANGES = hsv_ranges
+    cv2.setNumThreads(cv_threads)
+
+def _iter_frames(runs, w0, w1):
+    """
+    1カメラ分の区間を順に読み、時間窓 [w0, w1) に入るフレームを (録画時刻, VideoCapture) で返す
+    grab() までを行い、画像の取り出し（retrieve）は使う場合だけ呼び出し側で行う
+    """
+    cap = None
+    cap_path = None
+    pos = 0
+    try:
+        for t_start, t_end, path, offset, count in runs:
+            interval = (t_end - t_start) / (count - 1) if count > 1 else 0.0
+            if t_start >= w0:
+                first = 0
+            elif interval > 0:
+                first = int(math.ceil((w0 - t_start) / interval - 1e-6))
+            else:
+                first = count
+            if first >= count:
+                continue
+            if path != cap_path:
+                if cap is not None:
+                    cap.release()
+                cap = cv2.VideoCapture(path)
+                cap_path = path
+                pos = 0
+            if pos != offset + first:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, offset + first)
+                pos = offset + first
+            for n in range(first, count):
+                t = t_start + n * interval
+                if t >= w1:
+                    return
+                if not cap.grab():
+                    break
+                pos += 1
+                yield t, cap
+    finally:
+        if cap is not None:
+            cap.release()
+
+class _CherryCollector:
+    """YoloDetector.store の代わりに置き、画面外に出た（または終了時に残っていた）サクランボを集める"""
+    def __init__(self):
+        self.cherries = []
+
+    def append(self, cherry):
+        self.cherries.append(cherry)
+
+    def close(self):
+        pass
+
+def run_job(job, model_path, backend, step=1, verbose=False):
+    """
+    1ジョブ分の動画を録画時刻で揃えて YoloDetector に流し、処理量と判定を返す
+    - 各カメラの先頭フレームのうち最も古い時刻から SYNC_TOLERANCE_MS 以内のものを同じ瞬間としてまとめる
+    - 判定時間（DecisionMs）は処理時間ではなく録画時刻の差で測る
+    - 前後の重なり（"read"）も評価し、最初に見えた時刻が "window" に入るサクランボだけを返す
+      （IDの振り直し・CSVへの書き出しは親がセッションごとに行うので、ジョブのCSVは残さない）
+    - タイル動画は "window" 内のフレームだけで作る（隣のジョブと重ならないように）
+    """
+    w0, w1 = job["window"]
+    r0, r1 = job.get("read", job["window"])
+    streams = {cam_name: _iter_frames(runs, r0, r1) for cam_name, runs in job["runs"].items()}
+    tolerance = SYNC_TOLERANCE_MS / 1000.0
+    collector = _CherryCollector()
+    frames_done = 0
+    group_index = 0
+    first_time = None
+    last_time = None
+
+    start = time.perf_counter()
+    # 1サクランボごとの判定表示は量が多いので、verbose 以外では捨てる
+    with open(os.devnull, 'w') as devnull, \
+            (contextlib.nullcontext() if verbose else contextlib.redirect_stdout(devnull)):
+        detector = yolo_ctr.YoloDetector(model_path, log_suffix=f"_{job['label']}", backend=backend,
+                                         fusion_cameras=tuple(streams))
+        detector.store = collector
+        owns_all = set(streams) >= set(detector.frame_buffer.keys())    # 全カメラ揃っていればタイルも書く
+        try:
+            heads = {}  # カメラごとの次のフレーム (録画時刻, VideoCapture)
+            for cam_name, stream in streams.items():
+                head = next(stream, None)
+                if head is not None:
+                    heads[cam_name] = head
+            while heads:
+                t0 = min(t for t, _ in heads.values())
+                group = [cam_name for cam_name, (t, _) in heads.items() if t <= t0 + tolerance]
+                # 間引くフレームは画像の取り出し（BGR変換）を省く
+                if group_index % step == 0:
+                    frames = {}
+                    for cam_name in group:
+                        ok, frame = heads[cam_name][1].retrieve()
+                        if ok:
+                            frames[cam_name] = frame
+                    if frames:
+                        detector.evaluate_frames(frames, buffer_tile=owns_all and w0 <= t0 < w1, timestamp=t0)
+                        frames_done += len(frames)
+                if w0 <= t0 < w1:
+                    if first_time is None:
+                        first_time = t0
+                    last_time = t0
+                group_index += 1
+                for cam_name in group:
+                    head = next(streams[cam_name], None)
+                    if head is None:
+                        del heads[cam_name]
+                    else:
+                        heads[cam_name] = head
+        finally:
+            for stream in streams.values():
+                stream.close()
+            detector.close()
+            if os.path.exists(detector.logger.csv_path):
+                os.remove(detector.logger.csv_path)
+    elapsed = time.perf_counter() - start
+
+    cherries = [cherry for cherry in collector.cherries
+                if cherry.first_seen_at is not None and w0 <= cherry.first_seen_at < w1]
+    labels = {}
+    for cherry in cherries:
+        if cherry.decision is not None:
+            labels[cherry.decision.label_name] = labels.get(cherry.decision.label_name, 0) + 1
+    return {
+        "label": job["label"],
+        "segment": job["segment"],
+        "group": job.get("group", job["label"]),
+        "cameras": len(job["runs"]),
+        "frames": frames_done,
+        "video_sec": last_time - first_time + 1.0 / FPS if first_time is not None else 0.0,
+        "cherries": sum(labels.values()),
+        "labels": labels,
+        "seconds": elapsed,
+        "records": cherries,
+        "label_names": detector.names,
+        "video": detector.logger.video_path if detector.logger.tile_writer else None,
+    }
+
+# ==========================================================
+# セッションごとに結果をまとめる関数（親プロセス）
+# ==========================================================
+def write_session(group, results, out_dir, use_store=True):
+    """
+    同じセッションのジョブの結果を最初に見えた時刻順に並べ、IDを 1 から振り直して
+    CSV（evaluated_csv/eval_セッション.csv）と判定記録（evaluated_store_セッション）に書き出す
+    戻り値: CSVのパス
+    """
+    cherries = sorted((c for r in results for c in r["records"]), key=lambda c: c.first_seen_at)
+    csv_dir = os.path.join(out_dir, "evaluated_csv")
+    os.makedirs(csv_dir, exist_ok=True)
+    csv_path = os.path.join(csv_dir, f"eval_{group}.csv")
+    csv_writer = yolo_ctr.CsvWriterWorker(csv_path, ["ID", "LabelName", "Confidence", "DecisionMs", "Reason"])
+    store = (CherryStore(os.path.join(out_dir, f"evaluated_store_{group}"), label_names=results[0]["label_names"])
+             if use_store else None)
+    try:
+        for cherry_id, cherry in enumerate(cherries, start=1):
+            cherry.cherry_id = cherry_id
+            if cherry.decision is not None:
+                cherry.decision.id = cherry_id
+                csv_writer.write_row(cherry.decision.to_csv_row())
+            if store is not None:
+                store.append(cherry)
+    finally:
+        csv_writer.close()
+        if store is not None:
+            store.close()
+    return csv_path
+
+# ==========================================================
+# 引数の解析
+# ==========================================================
+def parse_hsv(text):
+    """"H,S,V,H,S,V" → ((H, S, V), (H, S, V))"""
+    values = [int(v) for v in text.split(",")]
+    if len(values) != 6:
+        raise argparse.ArgumentTypeError(f"HSV範囲は 下限H,S,V,上限H,S,V の6つの値で指定してください: {text}")
+    return (tuple(values[:3]), tuple(values[3:]))
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="録画済みの cam_video/ を YoloDetector で再評価する")
+    parser.add_argument("--source", default=FOLDER_PARENT, help="録画の親フォルダ（既定: cam_video）")
+    parser.add_argument("--session", default=None, help="録画日時の前方一致で絞り込む（例: 20260101_12）")
+    parser.add_argument("--model", default=yolo_ctr.MODEL_PATH, help="YOLOモデル（.pt）")
+    parser.add_argument("--backend", default=yolo_ctr.INFERENCE_BACKEND, choices=yolo_ctr.BACKEND_CHOICES)
+    parser.add_argument("--hsv", type=parse_hsv, action="append", default=None,
+                        help="マスク抽出の色範囲 下限H,S,V,上限H,S,V（複数指定で和集合。省略時は HSV_RANGES）")
+    parser.add_argument("--workers", type=int, default=REEVAL_WORKERS, help="プロセス数")
+    parser.add_argument("--step", type=int, default=1, help="Nフレームおきに評価する（1: 全フレーム）")
+    parser.add_argument("--split-cameras", action="store_true", help="カメラごとに別プロセスで評価する（多視点判定なし）")
+    parser.add_argument("--out", default=REEVAL_OUT_DIR, help="出力先フォルダ")
+    parser.add_argument("--no-store", action="store_true", help="サクランボごとの詳細記録を残さない")
+    parser.add_argument("--verbose", action="store_true", help="ワーカーの判定表示をそのまま出す")
+    return parser.parse_args(argv)
+
+# ==========================================================
+# 実行ブロック
+# ==========================================================
+def main(argv=None):
+    args = parse_args(argv)
+    jobs = find_jobs(args.source, args.session, args.split_cameras)
+    if not jobs:
+        print(f"エラー: {args.source} に再評価できる録画がありません")
+        return 1
+    workers = max(1, min(args.workers, len(jobs)))
+    print(f"再評価: ジョブ {len(jobs)} 件 / {workers} プロセス / モデル {args.model} ({args.backend})")
+
+    # 書き出しは親で1回だけ行う（ワーカーが同時に書き出さないように）
+    yolo_ctr.export_model(args.model, args.backend)
+    # プロセス数 × 推論スレッド数がコア数を超えないようにする（spawn した子プロセスに引き継がれる）
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    os.environ.setdefault("OMP_NUM_THREADS", str(threads))
+
+    results = []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context("spawn"),
+                             initializer=_init_worker,
+                             initargs=(args.out, args.hsv, threads)) as pool:
+        futures = {pool.submit(run_job, job, args.model, args.backend, max(1, args.step), args.verbose): job
+                   for job in jobs}
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                r = future.result()
+            except Exception as e:
+                print(f"[失敗] {job['label']}: {e}")
+                continue
+            results.append(r)
+            print(f"[{len(results)}/{len(jobs)}] {r['label']}: {r['frames']} フレーム / {r['cherries']} 個 "
+                  f"/ {r['seconds']:.1f} 秒 ({r['frames'] / max(r['seconds'], 1e-9):.0f} フレーム/秒)")
+
+    # --- セッションごとに1つのCSVにまとめる（IDはセッション内の通し番号） ---
+    groups = {}
+    for r in results:
+        groups.setdefault(r["group"], []).append(r)
+    csv_paths = []
+    for group, group_results in sorted(groups.items()):
+        failed = sum(1 for job in jobs if job["group"] == group) - len(group_results)
+        if failed:
+            print(f"警告: {group} は {failed} 件のジョブが失敗したため、その時間帯の判定が抜けています")
+        csv_paths.append(write_session(group, group_results, args.out, use_store=not args.no_store))
+    wall = time.perf_counter() - start
+
+    # --- 集計 ---
+    frames = sum(r["frames"] for r in results)
+    cherries = sum(r["cherries"] for r in results)
+    # 録画時間はセッション×時間窓ごとに数える（--split-cameras でカメラ数倍にならないように）
+    segment_sec = {}
+    for r in results:
+        segment_sec[r["segment"]] = max(segment_sec.get(r["segment"], 0.0), r["video_sec"])
+    video_sec = sum(segment_sec.values())
+    labels = {}
+    for r in results:
+        for name, n in r["labels"].items():
+            labels[name] = labels.get(name, 0) + n
+    print("---- 再評価結果 ----")
+    print(f"  ジョブ     : {len(results)} / {len(jobs)} 件（失敗 {len(jobs) - len(results)} 件）")
+    print(f"  処理時間   : {wall:.1f} 秒（録画 {video_sec:.0f} 秒分、実時間の {video_sec / max(wall, 1e-9):.1f} 倍速）")
+    print(f"  フレーム   : {frames} ({frames / max(wall, 1e-9):.1f} フレーム/秒)")
+    print(f"  サクランボ : {cherries} 個 ({cherries / max(wall, 1e-9):.2f} 個/秒)")
+    print("  判定時間   : CSV の DecisionMs は録画時刻（最初に見えたフレームから判定したフレームまで）で測った値")
+    for name, n in sorted(labels.items(), key=lambda x: -x[1]):
+        print(f"    {name}: {n}")
+    print(f"  出力先     : {args.out}")
+    for path in csv_paths:
+        print(f"    {path}")
+    return 0 if len(results) == len(jobs) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())